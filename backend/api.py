@@ -1,129 +1,294 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 import os
 import tempfile
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
-import base64
 import json
-import google.generativeai as genai
 from datetime import datetime
 from PIL import Image
 from flask_cors import CORS
-from PIL import Image, ImageEnhance
-import numpy as np
-import cv2
 import io
 import random
-# Import API key (in production, use environment variables)
-GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
-
-# Configure Google API
-genai.configure(api_key=GOOGLE_API_KEY)
+import time
+from cache import cache_key, create_result_cache
+from pipeline import SharedCalls, medication_key, run_prescription_batch, run_prescription_pipeline
+from histology import classify_slide_upload, get_batcher, get_slide_classifier
+from llm import create_llm_client
+from enhance import enhance_image as fast_enhance_image
+from llm_images import IMAGE_BUDGETS, encode_for_llm, to_8bit
+from uploads import (MAX_BATCH_BODY_BYTES, MAX_UPLOAD_BYTES, UPLOAD_LIMIT_MESSAGE, UploadRequest, open_image,
+                     read_batch, read_upload)
+from interactions import create_interaction_store
+from json_stream import IncrementalJSONParser
+from llm_json import LLMJSONError, field, parse_llm_json
+from jobs import QueueFull, create_job_queue
+from metrics import REGISTRY, REPORT_TIERS, REQUEST_SECONDS, server_timing, span, start_request_spans
+from reference_ranges import annotate_report
+from report_ocr import read_report
+from symptoms import canonical_patient_info, canonical_symptoms, create_symptom_index
+
+# Shared LLM client (reads GOOGLE_API_KEY; set LLM_BACKEND=stub to run offline)
+llm = create_llm_client()
 
 app = Flask(__name__)
 CORS(app)
 
-UPLOAD_FOLDER = os.path.join(tempfile.gettempdir(), 'medical_images')
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Uploads are decoded from memory; nothing is written to a shared upload folder
+app.request_class = UploadRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+# The batch route takes many files per request; each is still capped at MAX_UPLOAD_BYTES
+UploadRequest.body_limits['process_prescriptions'] = MAX_BATCH_BODY_BYTES
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.request_spans = start_request_spans()
+
+@app.after_request
+def record_request_timing(response):
+    if 'request_start' in g:
+        elapsed = time.perf_counter() - g.request_start
+        REQUEST_SECONDS.observe(elapsed, endpoint=request.url_rule.rule if request.url_rule else 'unmatched',
+                                method=request.method, status=response.status_code)
+        # Streamed bodies are still being generated here, so their spans are partial
+        response.headers['Server-Timing'] = ', '.join(
+            filter(None, [server_timing(g.request_spans), f"total;dur={elapsed * 1000:.1f}"]))
+    return response
+
+# Results for byte-identical uploads are reused; the prompt text is part of
+# the key, so editing a prompt naturally invalidates its old entries.
+result_cache = create_result_cache()
+
+# Pairwise drug-interaction memo shared by every prescription
+interaction_store = create_interaction_store()
+
+# Background analyses for /api/jobs; bounded so bursts get a 429, not a pile-up
+job_queue = create_job_queue()
+
+# Previously answered symptom sets, for serving close matches without the LLM
+symptom_index = create_symptom_index()
+
+MEDICAL_IMAGE_PROMPT = """
+    You are an expert medical image analyst. Analyze the provided medical image and identify any 
+    abnormalities, findings, or areas of concern. The image could be an X-ray, MRI, CT scan, 
+    ultrasound, or other medical imaging.
+
+    Provide your analysis in a structured JSON format with the following fields:
+    1. findings: An array of findings, where each finding has:
+       - area: The anatomical area or region
+       - finding: Description of the finding
+       - confidence: A number from 1-100 indicating your confidence level
+    2. similar_cases: Estimated number of similar cases in medical literature (can be approximate)
+
+    Format your response as valid JSON following this schema:
+
+    {
+        "findings": [
+            {
+                "area": "string",
+                "finding": "string",
+                "confidence": number
+            }
+        ],
+        "similar_cases": number
+    }
+
+    IMPORTANT: Your entire response must be a valid JSON object with no other text outside of it. 
+    Do not include any explanations outside the JSON structure.
+    """
+
+PRESCRIPTION_PROMPT = """
+    You are an expert medical transcriptionist specializing in deciphering and accurately transcribing handwritten medical prescriptions. Your role is to meticulously analyze the provided prescription images and extract all relevant information with the highest degree of precision.
+
+    Your job is to extract and accurately transcribe the following details from the provided prescription images:
+    1. Patient's full name
+    2. Patient's age (handle different formats like "42y", "42yrs", "42", "42 years")
+    3. Patient's gender
+    4. Doctor's full name
+    5. Doctor's license number
+    6. Prescription date (in YYYY-MM-DD format)
+    7. List of medications including:
+       - Medication name
+       - Dosage
+       - Frequency
+       - Duration
+    8. Additional notes or instructions
+
+    Important Instructions:
+    - Ensure that each extracted field is accurate and clear. If any information is not legible or missing, indicate it as 'Not available'.
+    - Do not guess or infer any information that is not clearly legible.
+    - Pay close attention to details like medication names, dosages, and frequencies.
+    - Format your response as valid JSON following this exact schema:
 
-def enhance_image(image_path, enhancements):
-    """Apply requested enhancements to the image."""
+    {
+        "patient_name": "string",
+        "patient_age": integer,
+        "patient_gender": "string",
+        "doctor_name": "string",
+        "doctor_license": "string",
+        "prescription_date": "YYYY-MM-DD",
+        "medications": [
+            {
+                "name": "string",
+                "dosage": "string",
+                "frequency": "string",
+                "duration": "string"
+            }
+        ],
+        "additional_notes": "string"
+    }
+
+    IMPORTANT: Your entire response must be a valid JSON object with no other text outside of it. Do not include any explanations, only provide the JSON.
+    """
+
+MEDICAL_REPORT_PROMPT = """
+    You are an expert medical report analyzer. Analyze the provided medical report image (which could be 
+    a lab test, blood work, pathology report, etc.) and extract all relevant information.
+
+    Focus on:
+    1. Identifying all test parameters, their values, units and printed reference ranges
+    2. Highlighting abnormal values (too high or too low, or qualitative results such as "Positive")
+    3. Providing a brief interpretation of what the abnormal values might indicate
+    4. Suggesting follow-up actions if necessary
+
+    Provide your analysis in a structured JSON format with the following fields:
+    1. report_type: The type of medical report (e.g., "Complete Blood Count", "Comprehensive Metabolic Panel", etc.)
+    2. patient_info: Any patient information visible in the report
+    3. test_date: The date when the test was conducted
+    4. parameters: An array of test parameters, where each parameter has:
+       - name: Parameter name
+       - value: Parameter value
+       - unit: Unit of measurement
+       - reference_range: Normal reference range, exactly as printed
+       - status: "normal", "high", "low" or "abnormal" (for qualitative results)
+    5. abnormal_findings: Array of objects containing:
+       - parameter: The abnormal parameter name
+       - interpretation: Brief medical interpretation
+       - severity: "mild", "moderate", or "severe"
+    6. summary: A brief summary of the overall report findings
+    7. recommendations: Array of follow-up recommendations
+
+    Format your response as valid JSON following this schema:
+
+    {
+        "report_type": "string",
+        "patient_info": {
+            "name": "string",
+            "id": "string",
+            "age": "string",
+            "gender": "string"
+        },
+        "test_date": "string",
+        "parameters": [
+            {
+                "name": "string",
+                "value": number,
+                "unit": "string",
+                "reference_range": "string",
+                "status": "string"
+            }
+        ],
+        "abnormal_findings": [
+            {
+                "parameter": "string",
+                "interpretation": "string",
+                "severity": "string"
+            }
+        ],
+        "summary": "string",
+        "recommendations": ["string"]
+    }
+
+    IMPORTANT: Your entire response must be a valid JSON object with no other text outside of it. 
+    Do not include any explanations outside the JSON structure.
+    """
+
+# Sent in place of the image when the local OCR tier read the report but could not parse it
+MEDICAL_REPORT_OCR_NOTE = """
+    The report image was transcribed by OCR; analyze this text instead of an image.
+    It keeps the row layout of the report but may contain recognition errors.
+
+    """
+
+# What each LLM answer must contain; optional fields fall back to the default
+RESPONSE_SCHEMAS = {
+    'medical_image': {
+        'findings': field(list, items=dict),
+        'similar_cases': field((int, float, str), required=False, default=0),
+    },
+    'prescription': {
+        'medications': field(list, items=dict),
+        'patient_age': field((int, float, str), required=False, default=0),
+        'additional_notes': field(str, required=False, default=''),
+    },
+    'diseases': {
+        'possible_diseases': field(list, items=dict),
+    },
+    'interactions': {
+        'interactions': field(list, items=dict),
+    },
+    'symptoms': {
+        'possible_conditions': field(list, items=dict),
+    },
+    'medical_report': {
+        'report_type': field(str, required=False, default='Unknown'),
+        'parameters': field(list, items=dict),
+        'abnormal_findings': field(list, required=False, default=[], items=dict),
+        'summary': field(str, required=False, default=''),
+        'recommendations': field(list, required=False, default=[], items=str),
+    },
+}
+
+def parse_enhancements(raw):
+    """Enhancement names from a form's JSON list; anything malformed means none."""
+    if not raw:
+        return []
     try:
-        img = Image.open(image_path)
-        enhanced_img = img.copy()
-        
-        if 'contrastBoost' in enhancements:
-            enhancer = ImageEnhance.Contrast(enhanced_img)
-            enhanced_img = enhancer.enhance(1.5)  # Increase contrast by 50%
-            
-        if 'noiseReduction' in enhancements:
-            # Convert to OpenCV format for noise reduction
-            cv_img = np.array(enhanced_img)
-            cv_img = cv2.cvtColor(cv_img, cv2.COLOR_RGB2BGR)
-            # Apply non-local means denoising
-            cv_img = cv2.fastNlMeansDenoisingColored(cv_img, None, 10, 10, 7, 21)
-            # Convert back to PIL
-            enhanced_img = Image.fromarray(cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB))
-            
-        if 'edgeEnhancement' in enhancements:
-            # Convert to OpenCV format for edge enhancement
-            cv_img = np.array(enhanced_img)
-            cv_img = cv2.cvtColor(cv_img, cv2.COLOR_RGB2BGR)
-            # Apply unsharp masking
-            gaussian = cv2.GaussianBlur(cv_img, (0, 0), 3.0)
-            cv_img = cv2.addWeighted(cv_img, 1.5, gaussian, -0.5, 0)
-            # Convert back to PIL
-            enhanced_img = Image.fromarray(cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB))
-        
-        # Save enhanced image
-        enhanced_path = image_path.replace('.', '_enhanced.')
-        enhanced_img.save(enhanced_path)
-        
-        return enhanced_path
+        enhancements = json.loads(raw)
+    except ValueError as e:
+        print(f"Error parsing enhancements: {str(e)}")
+        return []
+    if not isinstance(enhancements, list) or not all(isinstance(name, str) for name in enhancements):
+        print(f"Ignoring enhancements that are not a list of names: {raw!r}")
+        return []
+    return enhancements
+
+def enhance_image(image, enhancements):
+    """Apply requested enhancements to a PIL image in memory."""
+    try:
+        with span('enhance'):
+            return fast_enhance_image(image, enhancements)
     except Exception as e:
         print(f"Error enhancing image: {str(e)}")
-        return image_path
+        return image
     
-def analyze_medical_image(image_path, enhancements=None):
+def extract_json(text_response, stage):
+    """Parse the JSON in an LLM response and check it against the stage's schema."""
+    return parse_llm_json(text_response, RESPONSE_SCHEMAS.get(stage), stage)
+
+def analyze_medical_image(image_data, enhancements=None):
     """Analyze medical images using Gemini model."""
     try:
-        # Apply enhancements if requested
-        if enhancements and len(enhancements) > 0:
-            processed_image_path = enhance_image(image_path, enhancements)
-        else:
-            processed_image_path = image_path
-            
+        key = cache_key('medical_image', image_data, MEDICAL_IMAGE_PROMPT, sorted(enhancements or []),
+                        IMAGE_BUDGETS['medical_image'])
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached
+
         # Load image
-        image = Image.open(processed_image_path)
-        
-        # Initialize Gemini model
-        model = genai.GenerativeModel(model_name="gemini-1.5-flash")
-        
-        prompt = """
-        You are an expert medical image analyst. Analyze the provided medical image and identify any 
-        abnormalities, findings, or areas of concern. The image could be an X-ray, MRI, CT scan, 
-        ultrasound, or other medical imaging.
-
-        Provide your analysis in a structured JSON format with the following fields:
-        1. findings: An array of findings, where each finding has:
-           - area: The anatomical area or region
-           - finding: Description of the finding
-           - confidence: A number from 1-100 indicating your confidence level
-        2. similar_cases: Estimated number of similar cases in medical literature (can be approximate)
+        image = open_image(image_data)
 
-        Format your response as valid JSON following this schema:
-        
-        {
-            "findings": [
-                {
-                    "area": "string",
-                    "finding": "string",
-                    "confidence": number
-                }
-            ],
-            "similar_cases": number
-        }
-        
-        IMPORTANT: Your entire response must be a valid JSON object with no other text outside of it. 
-        Do not include any explanations outside the JSON structure.
-        """
-        
-        response = model.generate_content([prompt, image], generation_config={"temperature": 0.2})
-    
-        text_response = response.text
-        
-     
-        json_start = text_response.find('{')
-        json_end = text_response.rfind('}') + 1
+        # Apply enhancements if requested (to 8-bit pixels; they would clip 16-bit ones)
+        if enhancements and len(enhancements) > 0:
+            image = enhance_image(to_8bit(image), enhancements)
         
-        if json_start >= 0 and json_end > json_start:
-            json_str = text_response[json_start:json_end]
-           
-            json_str = json_str.replace('```json', '').replace('```', '')
-            result = json.loads(json_str)
-            return result
-        else:
-            return {"findings": [], "similar_cases": 0}
+        # Untouched uploads that already fit the budget are sent as-is
+        image_part = encode_for_llm(image, 'medical_image', None if enhancements else image_data)
+        text_response = llm.generate([MEDICAL_IMAGE_PROMPT, image_part], temperature=0.2, json_response=True)
+
+        result = extract_json(text_response, 'medical_image')
+        result_cache.set(key, result)
+        return result
     except Exception as e:
         print(f"Error analyzing medical image: {str(e)}")
         return {"findings": [], "similar_cases": 0, "error": str(e)}
@@ -134,7 +299,6 @@ def analyze_symptoms(symptoms, patient_info=None):
         if not symptoms:
             return {"possible_conditions": []}
      
-        model = genai.GenerativeModel(model_name="gemini-1.5-flash")
         patient_age = patient_info.get('age', 'Not specified') if patient_info else 'Not specified'
         patient_gender = patient_info.get('gender', 'Not specified') if patient_info else 'Not specified'
         existing_conditions = patient_info.get('existingConditions', 'None') if patient_info else 'None'
@@ -176,124 +340,57 @@ def analyze_symptoms(symptoms, patient_info=None):
         IMPORTANT: Your entire response must be a valid JSON object with no other text outside of it. 
         Do not include any explanations, only provide the JSON. Limit to the 5 most likely conditions.
         """
-        response = model.generate_content(prompt, generation_config={"temperature": 0.3})
-       
-        text_response = response.text
-       
-        json_start = text_response.find('{')
-        json_end = text_response.rfind('}') + 1
-        
-        if json_start >= 0 and json_end > json_start:
-            json_str = text_response[json_start:json_end]
-            json_str = json_str.replace('```json', '').replace('```', '')
-            result = json.loads(json_str)
-            return result
-        else:
-            return {"possible_conditions": [], "error": "Failed to parse response"}
+        text_response = llm.generate(prompt, temperature=0.3, json_response=True)
+
+        return extract_json(text_response, 'symptoms')
     except Exception as e:
         print(f"Error analyzing symptoms: {str(e)}")
         return {"possible_conditions": [], "error": str(e)}
     
-def encode_image(image_path):
-    """Load and encode image as base64."""
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+def get_prescription_information(image_data, predict_diseases=None, get_interactions=None):
+    """Extract a prescription, then predict diseases and check interactions concurrently."""
+    key = cache_key('prescription', image_data, PRESCRIPTION_PROMPT, IMAGE_BUDGETS['prescription'])
+    cached = result_cache.get(key)
+    if cached is not None:
+        return cached
+
+    result, ok = run_prescription_pipeline(
+        image_data,
+        extract=extract_prescription_information,
+        predict_diseases=predict_diseases or predict_possible_diseases,
+        get_interactions=get_interactions or get_drug_interactions,
+        on_extract_failure=create_empty_result
+    )
+    if ok:
+        result_cache.set(key, result)
+    return result
+
+def extract_prescription_information(image_data):
+    """Transcribe a prescription image using Gemini 1.5 Flash; raises on failure."""
+    # Decode the upload using PIL for Gemini API
+    image = open_image(image_data)
     
-def get_prescription_information(image_path):
-    """Process prescription images using Gemini 1.5 Flash."""
-    # Load images using PIL for Gemini API
-    image = Image.open(image_path)
-    
-    # Initialize Gemini 1.5 Flash model
-    model = genai.GenerativeModel(model_name="gemini-1.5-flash")
-    
-    prompt = """
-    You are an expert medical transcriptionist specializing in deciphering and accurately transcribing handwritten medical prescriptions. Your role is to meticulously analyze the provided prescription images and extract all relevant information with the highest degree of precision.
-
-    Your job is to extract and accurately transcribe the following details from the provided prescription images:
-    1. Patient's full name
-    2. Patient's age (handle different formats like "42y", "42yrs", "42", "42 years")
-    3. Patient's gender
-    4. Doctor's full name
-    5. Doctor's license number
-    6. Prescription date (in YYYY-MM-DD format)
-    7. List of medications including:
-       - Medication name
-       - Dosage
-       - Frequency
-       - Duration
-    8. Additional notes or instructions
-
-    Important Instructions:
-    - Ensure that each extracted field is accurate and clear. If any information is not legible or missing, indicate it as 'Not available'.
-    - Do not guess or infer any information that is not clearly legible.
-    - Pay close attention to details like medication names, dosages, and frequencies.
-    - Format your response as valid JSON following this exact schema:
+    # Generate response using the shared LLM client
+    image_part = encode_for_llm(image, 'prescription', image_data)
+    text_response = llm.generate([PRESCRIPTION_PROMPT, image_part], temperature=0.2, json_response=True)
     
-    {
-        "patient_name": "string",
-        "patient_age": integer,
-        "patient_gender": "string",
-        "doctor_name": "string",
-        "doctor_license": "string",
-        "prescription_date": "YYYY-MM-DD",
-        "medications": [
-            {
-                "name": "string",
-                "dosage": "string",
-                "frequency": "string",
-                "duration": "string"
-            }
-        ],
-        "additional_notes": "string"
-    }
+    result = extract_json(text_response, 'prescription')
     
-    IMPORTANT: Your entire response must be a valid JSON object with no other text outside of it. Do not include any explanations, only provide the JSON.
-    """
+    # Ensure patient_age is an integer
+    if 'patient_age' in result and result['patient_age'] and isinstance(result['patient_age'], str):
+        try:
+            result['patient_age'] = int(''.join(filter(str.isdigit, result['patient_age'])))
+        except:
+            result['patient_age'] = 0
     
-    # Generate response using gemini-1.5-flash
-    try:
-        response = model.generate_content([prompt, image], generation_config={"temperature": 0.2})
-        
-        # Extract JSON from response
-        text_response = response.text
-        
-        # Find JSON object
-        json_start = text_response.find('{')
-        json_end = text_response.rfind('}') + 1
-        
-        if json_start >= 0 and json_end > json_start:
-            json_str = text_response[json_start:json_end]
-            # Clean up any potential formatting issues
-            json_str = json_str.replace('```json', '').replace('```', '')
-            result = json.loads(json_str)
-            
-            # Ensure patient_age is an integer
-            if 'patient_age' in result and result['patient_age'] and isinstance(result['patient_age'], str):
-                try:
-                    result['patient_age'] = int(''.join(filter(str.isdigit, result['patient_age'])))
-                except:
-                    result['patient_age'] = 0
-            
-            # Add possible diseases based on medications
-            result = enrich_with_possible_diseases(result)
-            
-            return result
-        else:
-            return create_empty_result("Failed to parse JSON from response")
-    except Exception as e:
-        return create_empty_result(f"Error calling Gemini API: {str(e)}")
+    return result
 
-def enrich_with_possible_diseases(prescription_data):
-    """Enrich prescription data with possible diseases based on medications."""
+def predict_possible_diseases(prescription_data):
+    """Predict possible diseases from the prescribed medications."""
     try:
         if 'medications' not in prescription_data or not prescription_data['medications']:
-            prescription_data['possible_diseases'] = []
-            return prescription_data
+            return []
             
-        # Initialize Gemini 1.5 Flash model for disease prediction
-        model = genai.GenerativeModel(model_name="gemini-1.5-flash")
-        
         # Prepare medication list for prompt
         medication_list = "\n".join([f"- {med['name']} {med['dosage']}" for med in prescription_data['medications']])
         
@@ -333,28 +430,12 @@ def enrich_with_possible_diseases(prescription_data):
         IMPORTANT: Your entire response must be a valid JSON object with no other text outside of it. Do not include any explanations, only provide the JSON.
         """
 
-        response = model.generate_content(prompt, generation_config={"temperature": 0.3})
-
-        text_response = response.text
+        text_response = llm.generate(prompt, temperature=0.3, json_response=True)
 
-        json_start = text_response.find('{')
-        json_end = text_response.rfind('}') + 1
-        
-        if json_start >= 0 and json_end > json_start:
-            json_str = text_response[json_start:json_end]
-
-            json_str = json_str.replace('```json', '').replace('```', '')
-            disease_result = json.loads(json_str)
-
-            prescription_data['possible_diseases'] = disease_result.get('possible_diseases', [])
-        else:
-            prescription_data['possible_diseases'] = []
-            
-        return prescription_data
+        return extract_json(text_response, 'diseases')['possible_diseases']
     except Exception as e:
         print(f"Error predicting diseases: {str(e)}")
-        prescription_data['possible_diseases'] = []
-        return prescription_data
+        return []
     
 def get_drug_interactions(medications):
     """Get interactions between medications."""
@@ -362,31 +443,38 @@ def get_drug_interactions(medications):
         if not medications or len(medications) < 2:
             return []
 
-        model = genai.GenerativeModel(model_name="gemini-1.5-flash")
- 
         medication_names = [med['name'] for med in medications if 'name' in med and med['name']]
 
         if len(medication_names) < 2:
             return []
+
+        # Pairs seen before are answered from the store; only new pairs go to the LLM
+        known_interactions, missing_pairs = interaction_store.lookup(medication_names)
+        if not missing_pairs:
+            return known_interactions
+
+        pair_list = "\n".join([f"{i}. {a} + {b}" for i, (a, b) in enumerate(missing_pairs, 1)])
             
         prompt = f"""
-        You are a pharmacology expert AI. Analyze the following list of medications and identify any potential interactions between them:
+        You are a pharmacology expert AI. Analyze the following pairs of medications and identify any potential interactions within each pair:
         
-        Medications:
-        {', '.join(medication_names)}
+        Medication pairs:
+        {pair_list}
         
-        For each potential drug interaction, provide:
-        1. The interacting drugs (pair)
-        2. Severity (mild, moderate, severe)
-        3. Effect description
-        4. Recommendation
+        Answer every pair, including pairs with no interaction. For each pair, provide:
+        1. pair: The number of the pair in the list above
+        2. interacts: true if the two drugs interact, false if they do not
+        3. Severity (mild, moderate, severe)
+        4. Effect description
+        5. Recommendation
         
         Format your response as valid JSON following this schema:
         
         {{
             "interactions": [
                 {{
-                    "drugs": ["Drug A", "Drug B"],
+                    "pair": 1,
+                    "interacts": true,
                     "severity": "string",
                     "effect": "string",
                     "recommendation": "string"
@@ -397,22 +485,18 @@ def get_drug_interactions(medications):
         IMPORTANT: Your entire response must be a valid JSON object with no other text outside of it. Do not include any explanations, only provide the JSON.
         """
     
-        response = model.generate_content(prompt, generation_config={"temperature": 0.2})
-   
-        text_response = response.text
+        text_response = llm.generate(prompt, temperature=0.2, json_response=True)
 
-        json_start = text_response.find('{')
-        json_end = text_response.rfind('}') + 1
-        
-        if json_start >= 0 and json_end > json_start:
-            json_str = text_response[json_start:json_end]
-            # Clean up any potential formatting issues
-            json_str = json_str.replace('```json', '').replace('```', '')
-            interaction_result = json.loads(json_str)
-            
-            return interaction_result.get('interactions', [])
-        else:
-            return []
+        try:
+            answers = extract_json(text_response, 'interactions')['interactions']
+        except LLMJSONError as e:
+            # Nothing is recorded, so these pairs are asked about again next time
+            print(f"Error parsing drug interactions: {str(e)}")
+            return known_interactions
+        # Answers are matched to the pairs sent by their number, not by drug name
+        new_interactions = interaction_store.record(missing_pairs, answers)
+
+        return known_interactions + new_interactions
     except Exception as e:
         print(f"Error getting drug interactions: {str(e)}")
         return []
@@ -428,6 +512,7 @@ def create_empty_result(error_message="Failed to process prescription image."):
         "prescription_date": "",
         "medications": [],
         "possible_diseases": [],
+        "drug_interactions": [],
         "additional_notes": error_message
     }
 
@@ -444,27 +529,150 @@ def process_prescription():
         
     if file:
 
-        temp_dir = tempfile.mkdtemp()
         try:
-            file_path = os.path.join(temp_dir, secure_filename(file.filename))
-            file.save(file_path)
-
-            result = get_prescription_information(file_path)
-
-            if 'medications' in result and len(result['medications']) > 1:
-                interactions = get_drug_interactions(result['medications'])
-                result['drug_interactions'] = interactions
-            else:
-                result['drug_interactions'] = []
+            result = get_prescription_information(read_upload(file))
      
             return jsonify(result)
+        except RequestEntityTooLarge:
+            return jsonify({"error": UPLOAD_LIMIT_MESSAGE}), 413
         except Exception as e:
             return jsonify({"error": str(e)}), 500
-        finally:
-   
-            if os.path.exists(temp_dir):
-                import shutil
-                shutil.rmtree(temp_dir)
+
+def process_prescription_batch(uploads):
+    """Yield one NDJSON event per prescription as it finishes, then a summary.
+
+    Identical images are processed once, and disease prediction and the
+    interaction check run once per distinct medication list in the batch.
+    """
+    images = SharedCalls()
+    diseases = SharedCalls()
+    interactions = SharedCalls()
+    predict = diseases.wrap(predict_possible_diseases,
+                            lambda prescription: medication_key(prescription['medications'], ('name', 'dosage')))
+    check = interactions.wrap(get_drug_interactions, medication_key)
+
+    def process(data):
+        key = cache_key('prescription', data)
+        return images.call(key, lambda d: get_prescription_information(d, predict, check), data)
+
+    failed = 0
+    for index, name, result, error in run_prescription_batch(uploads, process):
+        event = {"event": "file", "index": index, "filename": name}
+        if error is None:
+            event["result"] = result
+        else:
+            failed += 1
+            event["error"] = error
+            event["result"] = create_empty_result(error)
+        yield event
+    yield {
+        "event": "done",
+        "files": len(uploads),
+        "failed": failed,
+        "unique_images": len(images),
+        "unique_medication_sets": len(interactions)
+    }
+
+@app.route('/api/process_prescriptions', methods=['POST'])
+def process_prescriptions():
+    """API endpoint for a batch of prescription images (several `file` parts and/or zip archives).
+
+    Results stream back as NDJSON in completion order; `index` is the
+    file's position in the upload.
+    """
+    try:
+        files = [f for f in request.files.getlist('file') if f.filename != '']
+        if not files:
+            return jsonify({"error": "No file part in the request"}), 400
+
+        # Everything is read before streaming starts; the workers never touch the request
+        uploads = read_batch(files)
+        return ndjson_response(process_prescription_batch(uploads))
+    except RequestEntityTooLarge as e:
+        return jsonify({"error": e.description}), 413
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def build_symptoms_prompt(symptoms, patient_info):
+    """Build the symptom-analysis prompt used by /api/analyze_symptoms."""
+    return f"""
+    You are an expert medical AI assistant. Based on the following symptoms, identify possible medical conditions:
+    
+    Symptoms:
+    {', '.join(symptoms)}
+    
+    Additional patient information:
+    Age: {patient_info.get('age', 'Not specified')}
+    Gender: {patient_info.get('gender', 'Not specified')}
+    Existing conditions: {patient_info.get('existingConditions', 'None')}
+    
+    Provide a list of the most probable medical conditions with the following information for each:
+    1. Condition name
+    2. Probability (high, medium, or low)
+    3. Brief description
+    4. Urgency level (emergency, urgent, routine)
+    5. Recommended actions
+    
+    Format your response as valid JSON following this schema:
+    
+    {{
+        "possible_conditions": [
+            {{
+                "name": "string",
+                "probability": "string",
+                "description": "string",
+                "urgency": "string",
+                "matched_symptoms": ["string", "string", ...],
+                "recommended_actions": ["string", "string", ...]
+            }}
+        ]
+    }}
+    
+    IMPORTANT: Your entire response must be a valid JSON object with no other text outside of it. Do not include any explanations, only provide the JSON.
+    """
+
+def ndjson_response(events):
+    """Stream an iterable of event dicts as newline-delimited JSON."""
+    lines = (json.dumps(event) + '\n' for event in events)
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def stream_llm_json(contents, temperature, fallback, stage, key=None, finish=None):
+    """Yield parsed pieces of a streaming LLM JSON answer, then the full result.
+
+    Array elements and top-level fields are emitted as soon as they are
+    complete (see IncrementalJSONParser), so the UI can render the first
+    lab parameters or conditions while the model is still generating.
+    `finish` post-processes the complete result before it is cached.
+    """
+    parser = IncrementalJSONParser()
+    try:
+        for chunk in llm.generate_stream(contents, temperature=temperature, json_response=True):
+            for event in parser.feed(chunk):
+                yield event
+        result = parser.result(RESPONSE_SCHEMAS.get(stage), stage)
+        if finish is not None:
+            result = finish(result)
+        if key is not None:
+            result_cache.set(key, result)
+        yield {"event": "result", "value": result}
+    except Exception as e:
+        print(f"Error streaming analysis: {str(e)}")
+        yield {"event": "error", "error": str(e), "value": fallback}
+
+def lookup_symptom_result(key, group, symptoms):
+    """Cached answer for this exact symptom set, else for the closest answered one."""
+    result = result_cache.get(key, max_age=symptom_index.ttl)
+    if result is not None:
+        return result
+    for similarity, neighbor_key, neighbor_symptoms in symptom_index.nearest(group, symptoms):
+        result = result_cache.get(neighbor_key, max_age=symptom_index.ttl)
+        if result is not None:
+            result['similar_case'] = {"symptoms": neighbor_symptoms, "similarity": round(similarity, 3)}
+            return result
+    return None
 
 @app.route('/api/analyze_symptoms', methods=['POST'])
 def analyze_symptoms():
@@ -476,63 +684,36 @@ def analyze_symptoms():
         if not data or 'symptoms' not in data or not data['symptoms']:
             return jsonify({"error": "No symptoms provided"}), 400
             
-        symptoms = data['symptoms']
-        patient_info = data.get('patientInfo', {})
-
-        model = genai.GenerativeModel(model_name="gemini-1.5-flash")
-        
-        prompt = f"""
-        You are an expert medical AI assistant. Based on the following symptoms, identify possible medical conditions:
-        
-        Symptoms:
-        {', '.join(symptoms)}
-        
-        Additional patient information:
-        Age: {patient_info.get('age', 'Not specified')}
-        Gender: {patient_info.get('gender', 'Not specified')}
-        Existing conditions: {patient_info.get('existingConditions', 'None')}
-        
-        Provide a list of the most probable medical conditions with the following information for each:
-        1. Condition name
-        2. Probability (high, medium, or low)
-        3. Brief description
-        4. Urgency level (emergency, urgent, routine)
-        5. Recommended actions
-        
-        Format your response as valid JSON following this schema:
-        
-        {{
-            "possible_conditions": [
-                {{
-                    "name": "string",
-                    "probability": "string",
-                    "description": "string",
-                    "urgency": "string",
-                    "matched_symptoms": ["string", "string", ...],
-                    "recommended_actions": ["string", "string", ...]
-                }}
-            ]
-        }}
-        
-        IMPORTANT: Your entire response must be a valid JSON object with no other text outside of it. Do not include any explanations, only provide the JSON.
-        """
-
-        response = model.generate_content(prompt, generation_config={"temperature": 0.3})
-
-        text_response = response.text
-
-        json_start = text_response.find('{')
-        json_end = text_response.rfind('}') + 1
-        
-        if json_start >= 0 and json_end > json_start:
-            json_str = text_response[json_start:json_end]
-        
-            json_str = json_str.replace('```json', '').replace('```', '')
-            result = json.loads(json_str)
-            
+        # ["Cough", "fever "] at 34 and ["fever", "cough"] at 35 share a cached answer; the
+        # canonical forms only key the cache, the model sees what the user entered
+        symptoms = canonical_symptoms(data['symptoms'])
+        patient_info = canonical_patient_info(data.get('patientInfo', {}))
+        group = json.dumps(patient_info, sort_keys=True)
+        # The empty template is part of the key so prompt edits retire old answers
+        key = cache_key('symptoms', json.dumps(symptoms).encode('utf-8'), patient_info, build_symptoms_prompt([], {}))
+        prompt = build_symptoms_prompt(data['symptoms'], data.get('patientInfo') or {})
+
+        result = lookup_symptom_result(key, group, symptoms)
+        if result is not None:
+            if request.args.get('stream'):
+                return ndjson_response([{"event": "result", "value": result}])
             return jsonify(result)
-        else:
-            return jsonify({"error": "Failed to analyze symptoms"}), 500
+
+        symptom_index.add(key, group, symptoms)
+        if request.args.get('stream'):
+            return ndjson_response(stream_llm_json(
+                prompt,
+                temperature=0.3,
+                fallback={"possible_conditions": []},
+                stage='symptoms',
+                key=key
+            ))
+
+        text_response = llm.generate(prompt, temperature=0.3, json_response=True)
+
+        result = extract_json(text_response, 'symptoms')
+        result_cache.set(key, result)
+        return jsonify(result)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -550,130 +731,68 @@ def analyze_medical_image_endpoint():
             
         if file:
 
-            enhancements = []
-            if 'enhancements' in request.form:
-                try:
-                    enhancements = json.loads(request.form['enhancements'])
-                except Exception as e:
-                    print(f"Error parsing enhancements: {str(e)}")
-            
-
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            
-            try:
-
-                result = analyze_medical_image(filepath, enhancements)
-                return jsonify(result)
-            except Exception as e:
-                return jsonify({"error": str(e)}), 500
-            finally:
-   
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-
-                enhanced_path = filepath.replace('.', '_enhanced.')
-                if os.path.exists(enhanced_path):
-                    os.remove(enhanced_path)
+            enhancements = parse_enhancements(request.form.get('enhancements'))
+            result = analyze_medical_image(read_upload(file), enhancements)
+            return jsonify(result)
+    except RequestEntityTooLarge:
+        return jsonify({"error": UPLOAD_LIMIT_MESSAGE}), 413
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({"error": UPLOAD_LIMIT_MESSAGE}), 413
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint: request and stage latency histograms, error counters."""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint."""
-    return jsonify({"status": "healthy", "timestamp": str(os.path.getmtime(__file__))}), 200
-
-def analyze_medical_report(report_path):
+    return jsonify({
+        "status": "healthy",
+        "timestamp": str(os.path.getmtime(__file__)),
+        "result_cache": result_cache.stats(),
+        "jobs": job_queue.stats()
+    }), 200
+
+def medical_report_contents(report_data):
+    """Try the local OCR tier; returns (result, None) or (None, LLM contents).
+
+    Printed reports of a known layout are parsed without the LLM. Otherwise
+    the model gets the OCR text when it reads well, and the image when not.
+    """
+    image = open_image(report_data)
+    local = read_report(image)
+    if local is not None and local.result is not None:
+        REPORT_TIERS.inc(tier='ocr')
+        return local.result, None
+    if local is not None and local.text:
+        REPORT_TIERS.inc(tier='ocr_text')
+        return None, [MEDICAL_REPORT_PROMPT, MEDICAL_REPORT_OCR_NOTE + local.text]
+    REPORT_TIERS.inc(tier='image')
+    return None, [MEDICAL_REPORT_PROMPT, encode_for_llm(image, 'medical_report', report_data)]
+
+def analyze_medical_report(report_data):
     """Analyze medical reports (lab tests, pathology, etc.) using Gemini model."""
     try:
-        image = Image.open(report_path)
-        
-        model = genai.GenerativeModel(model_name="gemini-1.5-flash")
-        
-        prompt = """
-        You are an expert medical report analyzer. Analyze the provided medical report image (which could be 
-        a lab test, blood work, pathology report, etc.) and extract all relevant information.
-
-        Focus on:
-        1. Identifying all test parameters and their values
-        2. Highlighting abnormal values (too high or too low)
-        3. Providing a brief interpretation of what the abnormal values might indicate
-        4. Suggesting follow-up actions if necessary
-
-        Provide your analysis in a structured JSON format with the following fields:
-        1. report_type: The type of medical report (e.g., "Complete Blood Count", "Comprehensive Metabolic Panel", etc.)
-        2. patient_info: Any patient information visible in the report
-        3. test_date: The date when the test was conducted
-        4. parameters: An array of test parameters, where each parameter has:
-           - name: Parameter name
-           - value: Parameter value
-           - unit: Unit of measurement
-           - reference_range: Normal reference range
-           - status: "normal", "high", or "low"
-        5. abnormal_findings: Array of objects containing:
-           - parameter: The abnormal parameter name
-           - interpretation: Brief medical interpretation
-           - severity: "mild", "moderate", or "severe"
-        6. summary: A brief summary of the overall report findings
-        7. recommendations: Array of follow-up recommendations
-
-        Format your response as valid JSON following this schema:
-        
-        {
-            "report_type": "string",
-            "patient_info": {
-                "name": "string",
-                "id": "string",
-                "age": "string",
-                "gender": "string"
-            },
-            "test_date": "string",
-            "parameters": [
-                {
-                    "name": "string",
-                    "value": number,
-                    "unit": "string",
-                    "reference_range": "string",
-                    "status": "string"
-                }
-            ],
-            "abnormal_findings": [
-                {
-                    "parameter": "string",
-                    "interpretation": "string",
-                    "severity": "string"
-                }
-            ],
-            "summary": "string",
-            "recommendations": ["string"]
-        }
-        
-        IMPORTANT: Your entire response must be a valid JSON object with no other text outside of it. 
-        Do not include any explanations outside the JSON structure.
-        """
-
-        response = model.generate_content([prompt, image], generation_config={"temperature": 0.2})
+        key = cache_key('medical_report', report_data, MEDICAL_REPORT_PROMPT, IMAGE_BUDGETS['medical_report'])
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached
+
+        result, contents = medical_report_contents(report_data)
+        if result is not None:
+            result_cache.set(key, result)
+            return result
 
-        text_response = response.text
+        text_response = llm.generate(contents, temperature=0.2, json_response=True)
 
-        json_start = text_response.find('{')
-        json_end = text_response.rfind('}') + 1
-        
-        if json_start >= 0 and json_end > json_start:
-            json_str = text_response[json_start:json_end]
-  
-            json_str = json_str.replace('```json', '').replace('```', '')
-            result = json.loads(json_str)
-            return result
-        else:
-            return {
-                "report_type": "Unknown",
-                "parameters": [],
-                "abnormal_findings": [],
-                "summary": "Failed to analyze report",
-                "recommendations": ["Please consult with a healthcare professional"]
-            }
+        result = annotate_report(extract_json(text_response, 'medical_report'))
+        result_cache.set(key, result)
+        return result
     except Exception as e:
         print(f"Error analyzing medical report: {str(e)}")
         return {
@@ -684,6 +803,28 @@ def analyze_medical_report(report_path):
             "recommendations": ["Please consult with a healthcare professional"]
         }
 
+def stream_medical_report(report_data):
+    """Streaming variant of analyze_medical_report: lab parameters arrive one by one."""
+    key = cache_key('medical_report', report_data, MEDICAL_REPORT_PROMPT, IMAGE_BUDGETS['medical_report'])
+    cached = result_cache.get(key)
+    if cached is not None:
+        return [{"event": "result", "value": cached}]
+
+    result, contents = medical_report_contents(report_data)
+    if result is not None:
+        result_cache.set(key, result)
+        return [{"event": "result", "value": result}]
+
+    fallback = {
+        "report_type": "Error",
+        "parameters": [],
+        "abnormal_findings": [],
+        "summary": "Error analyzing report",
+        "recommendations": ["Please consult with a healthcare professional"]
+    }
+    return stream_llm_json(contents, temperature=0.2, fallback=fallback,
+                           stage='medical_report', key=key, finish=annotate_report)
+
 @app.route('/api/analyze_medical_report', methods=['POST'])
 def analyze_medical_report_endpoint():
     """API endpoint to analyze uploaded medical report images."""
@@ -697,24 +838,104 @@ def analyze_medical_report_endpoint():
             return jsonify({"error": "No file selected"}), 400
             
         if file:
- 
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            
-            try:
-                result = analyze_medical_report(filepath)
-                return jsonify(result)
-            except Exception as e:
-                return jsonify({"error": str(e)}), 500
-            finally:
-              
-                if os.path.exists(filepath):
-                    os.remove(filepath)
+            report_data = read_upload(file)
+            if request.args.get('stream'):
+                return ndjson_response(stream_medical_report(report_data))
+
+            result = analyze_medical_report(report_data)
+            return jsonify(result)
+    except RequestEntityTooLarge:
+        return jsonify({"error": UPLOAD_LIMIT_MESSAGE}), 413
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
+# Long-running analyses that can also be run as background jobs
+JOB_HANDLERS = {
+    'prescription': lambda data, form: get_prescription_information(data),
+    'medical_image': lambda data, form: analyze_medical_image(data, parse_enhancements(form.get('enhancements'))),
+    'medical_report': lambda data, form: analyze_medical_report(data),
+}
+
+@app.route('/api/jobs/<kind>', methods=['POST'])
+def submit_job(kind):
+    """Queue an upload for background analysis and return its job id (202)."""
+    if kind not in JOB_HANDLERS:
+        return jsonify({"error": f"Unknown job type '{kind}'"}), 404
+    try:
+        if 'file' not in request.files:
+            return jsonify({"error": "No file part in the request"}), 400
+
+        file = request.files['file']
+
+        if file.filename == '':
+            return jsonify({"error": "No file selected"}), 400
+
+        # The upload is read now; the job must not touch the request afterwards
+        data = read_upload(file)
+        form = request.form.to_dict()
+        try:
+            job_id = job_queue.submit(kind, JOB_HANDLERS[kind], data, form,
+                                      callback_url=form.get('callback_url'))
+        except QueueFull:
+            response = jsonify({"error": "Too many analyses in progress, please retry later"})
+            response.headers['Retry-After'] = str(job_queue.retry_after())
+            return response, 429
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        status_url = f"/api/jobs/{job_id}"
+        response = jsonify({"job_id": job_id, "status": "queued", "status_url": status_url})
+        response.headers['Location'] = status_url
+        return response, 202
+    except RequestEntityTooLarge:
+        return jsonify({"error": UPLOAD_LIMIT_MESSAGE}), 413
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Poll a background job; `result` is set once status is 'done'."""
+    job = job_queue.store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+@app.route('/api/classify_histology', methods=['POST'])
+def classify_histology_endpoint():
+    """API endpoint to classify histology tiles with the resident ViT model."""
+    try:
+        files = [f for f in request.files.getlist('file') if f.filename != '']
+        if not files:
+            return jsonify({"error": "No file part in the request"}), 400
+
+        # ?tiled=1: classify a large image patch by patch instead of resizing it to one tile
+        tiled = bool(request.args.get('tiled'))
+        try:
+            model = get_slide_classifier() if tiled else get_batcher()
+        except Exception as e:
+            print(f"Error loading histology model: {str(e)}")
+            return jsonify({"error": "Histology model unavailable"}), 503
+
+        if tiled:
+            # Read tile by tile from the upload; large images are never decoded here first
+            results = [classify_slide_upload(f) for f in files]
+        else:
+            # Same byte and decompression-bomb limits as the other image routes
+            results = model.predict([open_image(read_upload(f)).convert('RGB') for f in files])
+        for f, result in zip(files, results):
+            result['filename'] = secure_filename(f.filename)
+
+        if len(results) == 1:
+            return jsonify(results[0])
+        return jsonify({"results": results})
+    except RequestEntityTooLarge:
+        return jsonify({"error": UPLOAD_LIMIT_MESSAGE}), 413
+    except Image.DecompressionBombError as e:
+        return jsonify({"error": str(e)}), 413
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 if __name__ == "__main__":
     # Set host to 0.0.0.0 to make it accessible from outside the container
-    # For production, use a production WSGI server like Gunicorn
+    # For production, run Gunicorn with gunicorn.conf.py (see render.yaml)
     app.run(debug=False)
\ No newline at end of file
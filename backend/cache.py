@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def private_store_path(filename):
+    """Default path of an SQLite store, in a directory only this user can read.
+
+    Stores hold prescription and report results with patient names, so they
+    never default to the shared temp dir. The directory is AROGYA_DATA_DIR,
+    else ~/.cache/arogya (mode 0700); the file is created 0600. Returns None
+    when the directory cannot be created, i.e. keep the store in memory.
+    """
+    directory = os.environ.get('AROGYA_DATA_DIR') or os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'arogya')
+    path = os.path.join(directory, filename)
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        os.chmod(directory, 0o700)
+        # SQLite gives its -wal and -shm files the database file's permissions
+        os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+        os.chmod(path, 0o600)
+    except OSError as e:
+        print(f"Cannot create private store {path} ({e}); keeping it in memory")
+        return None
+    return path
+
+
+def cache_key(namespace, data, *parts):
+    """Content-addressed key: hash of the raw bytes plus everything that shapes the answer."""
+    digest = hashlib.sha256()
+    digest.update(namespace.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(data)
+    for part in parts:
+        digest.update(b'\0')
+        digest.update(json.dumps(part, sort_keys=True).encode('utf-8'))
+    return f"{namespace}:{digest.hexdigest()}"
+
+
+class ResultCache:
+    """Two-tier (in-memory LRU + SQLite) cache for JSON-serializable results.
+
+    Entries expire after `ttl` seconds in both tiers. The memory tier holds at
+    most `max_entries` results; the disk tier is trimmed to `max_disk_entries`
+    (oldest first) every `trim_every` writes. Pass `path=None` for memory only.
+    """
+
+    def __init__(self, path=None, max_entries=256, max_disk_entries=10000, ttl=24 * 3600, trim_every=100):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.trim_every = trim_every
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._db = None
+        self._db_pid = None
+
+    def _connection(self):
+        # SQLite handles must not cross a fork; open one per process lazily
+        if not self.path:
+            return None
+        if self._db is None or self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_created_at ON results (created_at)")
+            self._db_pid = os.getpid()
+        return self._db
+
+    def get(self, key, max_age=None):
+        """Return the cached value, or None if absent or older than ttl (or max_age)."""
+        now = time.time()
+        ttl = min(self.ttl, max_age) if max_age is not None else self.ttl
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if now - created_at < ttl:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return json.loads(value)
+                if now - created_at >= self.ttl:
+                    del self._memory[key]
+
+            db = self._connection()
+            if db is not None:
+                row = db.execute(
+                    "SELECT value, created_at FROM results WHERE key = ? AND created_at > ?",
+                    (key, now - ttl)
+                ).fetchone()
+                if row is not None:
+                    self._remember(key, row[1], row[0])
+                    self.disk_hits += 1
+                    return json.loads(row[0])
+
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        now = time.time()
+        # Stored serialized so callers can't mutate cached results in place
+        serialized = json.dumps(value)
+        with self._lock:
+            self._remember(key, now, serialized)
+            db = self._connection()
+            if db is not None:
+                db.execute(
+                    "INSERT OR REPLACE INTO results (key, value, created_at) VALUES (?, ?, ?)",
+                    (key, serialized, now)
+                )
+                self._writes += 1
+                if self._writes % self.trim_every == 0:
+                    self._trim(db, now)
+
+    def _remember(self, key, created_at, serialized):
+        self._memory[key] = (created_at, serialized)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _trim(self, db, now):
+        db.execute("DELETE FROM results WHERE created_at <= ?", (now - self.ttl,))
+        db.execute(
+            "DELETE FROM results WHERE key IN ("
+            "SELECT key FROM results ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,)
+        )
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+            }
+
+
+def create_result_cache():
+    """Build the process-wide cache from RESULT_CACHE_* environment variables."""
+    path = os.environ.get('RESULT_CACHE_PATH')
+    if path is None:
+        path = private_store_path('results.sqlite3')
+    return ResultCache(
+        path=path or None,
+        max_entries=int(os.environ.get('RESULT_CACHE_SIZE', '256')),
+        max_disk_entries=int(os.environ.get('RESULT_CACHE_DISK_SIZE', '10000')),
+        ttl=float(os.environ.get('RESULT_CACHE_TTL', str(24 * 3600))),
+    )
@@ -0,0 +1,92 @@
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+ENHANCEMENTS = ('contrastBoost', 'noiseReduction', 'edgeEnhancement')
+
+CONTRAST_FACTOR = 1.5      # same as ImageEnhance.Contrast(1.5)
+UNSHARP_AMOUNT = 0.5       # out = (1 + amount) * img - amount * blur
+UNSHARP_SIGMA = 3.0
+DENOISE_H = 10
+DENOISE_H_COLOR = 10
+DENOISE_TEMPLATE = 7
+DENOISE_SEARCH = 21
+
+# 'fast' works on an image no larger than what the LLM actually looks at;
+# 'full' keeps the upload's resolution like the original implementation.
+DENOISE_MODE = os.environ.get('ENHANCE_DENOISE_MODE', 'fast')
+FAST_MAX_SIDE = int(os.environ.get('ENHANCE_FAST_MAX_SIDE', '1536'))
+
+
+def _gray_mean(rgb):
+    # PIL's Contrast enhancer pivots on the rounded mean of the L (BT.601) image
+    return int(cv2.mean(cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY))[0] + 0.5)
+
+
+def _affine(rgb, alpha, beta):
+    # Saturating alpha * x + beta in one pass (convertScaleAbs would take |x|)
+    return cv2.addWeighted(rgb, alpha, rgb, 0.0, beta)
+
+
+def _denoise(rgb):
+    """Non-local means in Lab, as fastNlMeansDenoisingColored does, without BGR swaps."""
+    lab = cv2.cvtColor(rgb, cv2.COLOR_RGB2Lab)
+    l, a, b = cv2.split(lab)
+    l = cv2.fastNlMeansDenoising(l, None, DENOISE_H, DENOISE_TEMPLATE, DENOISE_SEARCH)
+    ab = cv2.fastNlMeansDenoising(cv2.merge([a, b]), None, DENOISE_H_COLOR, DENOISE_TEMPLATE, DENOISE_SEARCH)
+    return cv2.cvtColor(cv2.merge([l] + list(cv2.split(ab))), cv2.COLOR_Lab2RGB)
+
+
+def _downscale(rgb, max_side):
+    height, width = rgb.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1.0:
+        return rgb, 1.0
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(rgb, size, interpolation=cv2.INTER_AREA), scale
+
+
+def enhance_array(rgb, enhancements, mode=None, max_side=None):
+    """Apply enhancements to an RGB uint8 array, staying in that format throughout.
+
+    Contrast is an affine map and unsharp masking is linear, so without
+    denoising in between both collapse into one cv2.addWeighted pass:
+      1.5 * C(x) - 0.5 * blur(C(x)) == a * (1.5 * x - 0.5 * blur(x)) + b
+    All OpenCV calls release the GIL, so this is safe to run in a thread pool.
+    """
+    mode = mode or DENOISE_MODE
+    contrast = 'contrastBoost' in enhancements
+    denoise = 'noiseReduction' in enhancements
+    sharpen = 'edgeEnhancement' in enhancements
+    if not (contrast or denoise or sharpen):
+        return rgb
+
+    scale = 1.0
+    if denoise and mode == 'fast':
+        rgb, scale = _downscale(rgb, max_side or FAST_MAX_SIDE)
+
+    alpha, beta = 1.0, 0.0
+    if contrast:
+        alpha = CONTRAST_FACTOR
+        beta = (1.0 - CONTRAST_FACTOR) * _gray_mean(rgb)
+
+    if denoise:
+        if contrast:
+            rgb = _affine(rgb, alpha, beta)
+            alpha, beta = 1.0, 0.0
+        rgb = _denoise(rgb)
+
+    if sharpen:
+        blurred = cv2.GaussianBlur(rgb, (0, 0), max(1.0, UNSHARP_SIGMA * scale))
+        return cv2.addWeighted(rgb, alpha * (1.0 + UNSHARP_AMOUNT), blurred, -alpha * UNSHARP_AMOUNT, beta)
+    if alpha != 1.0 or beta != 0.0:
+        return _affine(rgb, alpha, beta)
+    return rgb
+
+
+def enhance_image(image, enhancements, mode=None, max_side=None):
+    """PIL in, PIL out wrapper around enhance_array."""
+    rgb = np.asarray(image.convert('RGB'))
+    return Image.fromarray(enhance_array(rgb, enhancements, mode, max_side))
@@ -0,0 +1,66 @@
+"""Gunicorn serving profile: gunicorn -c gunicorn.conf.py api:app
+
+Every setting can be overridden from the environment, so the load test in
+benchmarks/load_test.py can sweep them without editing this file.
+"""
+import gc
+import multiprocessing
+import os
+import sys
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# Requests spend almost all their time waiting on Gemini, so each worker
+# serves many of them on threads; a few processes cover the CPU-bound parts
+# (image decode, enhancement, OCR, the ViT). WEB_CONCURRENCY is the usual
+# name for the worker count on Render and Heroku. LLM_MAX_CONCURRENCY is a
+# per-process limit, so up to workers * LLM_MAX_CONCURRENCY Gemini calls run
+# at once across the server.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', str(min(4, multiprocessing.cpu_count()))))
+threads = int(os.environ.get('GUNICORN_THREADS', '16'))
+
+# A request can wait on several LLM calls (LLM_TIMEOUT, with retries), so the
+# worker timeout is generous; on SIGTERM in-flight requests get
+# graceful_timeout seconds to finish before the worker is killed.
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '180'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '60'))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '0'))
+
+# Import api.py (and the LLM client) once in the master. SQLite stores, job
+# and batching threads are opened lazily per process, so they are fork-safe.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+# Loading the ViT in the master shares its weights between workers, but it
+# also starts torch's OpenMP thread pool before the fork, which can deadlock
+# the workers' first forward pass. Opt in with PRELOAD_HISTOLOGY=1 only where
+# that has been tested; otherwise each worker loads the model on first use.
+preload_histology = os.environ.get('PRELOAD_HISTOLOGY', '0') == '1'
+
+
+def when_ready(server):
+    if preload_app and preload_histology:
+        # The ViT is loaded in the master so its weights are shared
+        # copy-on-write by the workers; a missing checkpoint only disables
+        # /api/classify_histology, as it would without preloading.
+        try:
+            import histology
+            histology.preload()
+            server.log.info("Preloaded histology model")
+        except Exception as e:
+            server.log.warning(f"Histology model not preloaded: {e}")
+    if preload_app:
+        # Keep the garbage collector from touching (and so copying) every
+        # object inherited from the master
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    # Split the cores between workers instead of every worker's torch and
+    # OpenCV thread pools claiming all of them
+    per_worker = max(1, multiprocessing.cpu_count() // max(1, workers))
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(per_worker)
+    if 'cv2' in sys.modules:
+        sys.modules['cv2'].setNumThreads(per_worker)
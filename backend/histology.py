@@ -0,0 +1,111 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+# The classifier lives in ../model; allow overriding for deployments that
+# ship the model directory elsewhere.
+MODEL_DIR = os.environ.get(
+    'HISTOLOGY_MODEL_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'model')
+)
+CHECKPOINT_PATH = os.environ.get(
+    'HISTOLOGY_CHECKPOINT',
+    os.path.join(MODEL_DIR, 'vit_cancer_model_state_dict_6.pth')
+)
+
+# Inference backend: eager, int8, torchscript, compile or onnx (see model/export.py).
+# HISTOLOGY_ARTIFACT points at a pre-exported TorchScript/ONNX file.
+BACKEND = os.environ.get('HISTOLOGY_BACKEND', 'eager')
+ARTIFACT_PATH = os.environ.get('HISTOLOGY_ARTIFACT')
+
+# Micro-batching: concurrent requests are merged into one forward pass of
+# up to MAX_BATCH_SIZE images, waiting at most MAX_WAIT_MS for company.
+MAX_BATCH_SIZE = int(os.environ.get('HISTOLOGY_MAX_BATCH_SIZE', '16'))
+MAX_WAIT_MS = float(os.environ.get('HISTOLOGY_MAX_WAIT_MS', '10'))
+
+# Test-time augmentation views (1, 2, 4 or 8) and the temperature file from
+# model/calibration.py; each micro-batch becomes one forward pass of TTA * N tiles.
+TTA = int(os.environ.get('HISTOLOGY_TTA', '1'))
+CALIBRATION_PATH = os.environ.get('HISTOLOGY_CALIBRATION')
+
+# Tiled mode (/api/classify_histology?tiled=1): patch size/step in image pixels
+# and the minimum tissue fraction for a patch to be classified.
+TILE_SIZE = int(os.environ.get('HISTOLOGY_TILE_SIZE', '224'))
+TILE_STRIDE = int(os.environ.get('HISTOLOGY_TILE_STRIDE', str(TILE_SIZE)))
+MIN_TISSUE = float(os.environ.get('HISTOLOGY_MIN_TISSUE', '0.25'))
+
+_predictor = None
+_batcher = None
+_slide_classifier = None
+_predictor_lock = threading.Lock()
+
+
+def get_predictor():
+    """Return the process-wide histology predictor, loading it on first use."""
+    global _predictor
+    if _predictor is None:
+        with _predictor_lock:
+            if _predictor is None:
+                if MODEL_DIR not in sys.path:
+                    sys.path.append(MODEL_DIR)
+                from predictor import HistologyPredictor
+                _predictor = HistologyPredictor(CHECKPOINT_PATH, device='cpu', backend=BACKEND,
+                                                artifact_path=ARTIFACT_PATH, tta=TTA,
+                                                calibration_path=CALIBRATION_PATH)
+    return _predictor
+
+
+def preload():
+    """Load the predictor now, e.g. in the gunicorn master before it forks.
+
+    Workers then share the weights copy-on-write instead of each loading
+    its own copy. The micro-batcher and slide classifier start threads, so
+    they are still created lazily inside each worker.
+    """
+    return get_predictor()
+
+
+def get_batcher():
+    """Return the process-wide micro-batching queue in front of the predictor."""
+    global _batcher
+    if _batcher is None:
+        predictor = get_predictor()
+        with _predictor_lock:
+            if _batcher is None:
+                from batching import MicroBatcher
+                _batcher = MicroBatcher(predictor, MAX_BATCH_SIZE, MAX_WAIT_MS)
+    return _batcher
+
+
+def get_slide_classifier():
+    """Return the process-wide tiling classifier sharing the resident predictor."""
+    global _slide_classifier
+    if _slide_classifier is None:
+        predictor = get_predictor()
+        with _predictor_lock:
+            if _slide_classifier is None:
+                from slide import SlideClassifier
+                _slide_classifier = SlideClassifier(predictor, TILE_SIZE, TILE_STRIDE,
+                                                    batch_size=MAX_BATCH_SIZE, min_tissue=MIN_TISSUE)
+    return _slide_classifier
+
+
+def classify_slide_upload(file):
+    """Tiled classification of an uploaded file, without decoding it whole when possible.
+
+    Whole-slide formats and TIFFs are spooled to a temporary file so the
+    classifier reads tiles lazily (OpenSlide or a memory map); other images
+    are decoded by its PillowReader, within slide.MAX_PIXELS.
+    """
+    classifier = get_slide_classifier()
+    from slide import LAZY_EXTENSIONS
+    file.stream.seek(0)
+    suffix = os.path.splitext(file.filename or '')[1].lower()
+    if suffix not in LAZY_EXTENSIONS:
+        return classifier.classify(file.stream)[0]
+    with tempfile.NamedTemporaryFile(suffix=suffix) as tmp:
+        shutil.copyfileobj(file.stream, tmp)
+        tmp.flush()
+        return classifier.classify(tmp.name)[0]
@@ -0,0 +1,209 @@
+import itertools
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from cache import private_store_path
+
+# Brand / regional names mapped to one generic name so equivalent
+# prescriptions share interaction entries.
+DRUG_SYNONYMS = {
+    'acetaminophen': 'paracetamol',
+    'tylenol': 'paracetamol',
+    'crocin': 'paracetamol',
+    'calpol': 'paracetamol',
+    'dolo': 'paracetamol',
+    'panadol': 'paracetamol',
+    'advil': 'ibuprofen',
+    'brufen': 'ibuprofen',
+    'motrin': 'ibuprofen',
+    'ecosprin': 'aspirin',
+    'disprin': 'aspirin',
+    'acetylsalicylic acid': 'aspirin',
+    'glycomet': 'metformin',
+    'glucophage': 'metformin',
+    'lipitor': 'atorvastatin',
+    'atorva': 'atorvastatin',
+    'zocor': 'simvastatin',
+    'crestor': 'rosuvastatin',
+    'coumadin': 'warfarin',
+    'plavix': 'clopidogrel',
+    'clopilet': 'clopidogrel',
+    'augmentin': 'amoxicillin clavulanate',
+    'amoxyclav': 'amoxicillin clavulanate',
+    'azithral': 'azithromycin',
+    'zithromax': 'azithromycin',
+    'pan': 'pantoprazole',
+    'pantocid': 'pantoprazole',
+    'omez': 'omeprazole',
+    'prilosec': 'omeprazole',
+    'norvasc': 'amlodipine',
+    'amlong': 'amlodipine',
+    'telma': 'telmisartan',
+    'thyronorm': 'levothyroxine',
+    'eltroxin': 'levothyroxine',
+    'synthroid': 'levothyroxine',
+    'zyrtec': 'cetirizine',
+    'allegra': 'fexofenadine',
+    'montair': 'montelukast',
+    'singulair': 'montelukast',
+}
+
+# Dosage-form and counter-ion words that do not change which interactions
+# apply. Metal ions (sodium, potassium, calcium, magnesium) are kept: in
+# "potassium chloride" or "calcium carbonate" they are the active part.
+_NOISE_WORDS = {
+    'tab', 'tabs', 'tablet', 'tablets', 'cap', 'caps', 'capsule', 'capsules',
+    'syp', 'syrup', 'susp', 'suspension', 'inj', 'injection', 'drops', 'cream',
+    'ointment', 'gel', 'sr', 'er', 'xr', 'cr', 'od', 'ds', 'forte',
+    'hcl', 'hydrochloride', 'sulfate', 'sulphate', 'maleate', 'besylate', 'succinate', 'tartrate',
+}
+_DOSAGE_RE = re.compile(r'\b\d+(\.\d+)?\s*(mg|mcg|µg|g|ml|iu|units?|%)?\b', re.IGNORECASE)
+_NON_WORD_RE = re.compile(r'[^a-z\s]+')
+
+
+def canonical_drug_name(name):
+    """Normalize a prescribed medication name: 'Tab. Glycomet-SR 500mg' -> 'metformin'."""
+    text = _DOSAGE_RE.sub(' ', name.lower())
+    text = _NON_WORD_RE.sub(' ', text)
+    text = ' '.join(w for w in text.split() if w not in _NOISE_WORDS)
+    # Whole names only: "telma h" or "pan d" are combination products, not telmisartan or pantoprazole
+    return DRUG_SYNONYMS.get(text, text)
+
+
+def pair_key(a, b):
+    return (a, b) if a <= b else (b, a)
+
+
+class InteractionStore:
+    """Persistent pairwise drug-interaction memo backed by SQLite.
+
+    Every pair the LLM explicitly answered is stored, including pairs with
+    no interaction, so known pairs do not go back to the model until the
+    answer is `ttl` seconds old. The in-memory tier is an LRU of at most
+    `max_entries` pairs. Pass `path=None` for memory only.
+    """
+
+    def __init__(self, path=None, ttl=7 * 24 * 3600, max_entries=4096):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+
+    def _connection(self):
+        # SQLite handles must not cross a fork; open one per process lazily
+        if not self.path:
+            return None
+        if self._db is None or self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS interactions ("
+                "drug_a TEXT NOT NULL, drug_b TEXT NOT NULL, interaction TEXT, created_at REAL NOT NULL, "
+                "PRIMARY KEY (drug_a, drug_b))"
+            )
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _get(self, key, now):
+        entry = self._memory.get(key)
+        if entry is not None:
+            if now - entry[0] < self.ttl:
+                self._memory.move_to_end(key)
+                return True, entry[1]
+            del self._memory[key]
+        db = self._connection()
+        if db is None:
+            return False, None
+        row = db.execute(
+            "SELECT interaction, created_at FROM interactions WHERE drug_a = ? AND drug_b = ? AND created_at > ?",
+            (key[0], key[1], now - self.ttl)
+        ).fetchone()
+        if row is None:
+            return False, None
+        value = json.loads(row[0]) if row[0] else None
+        self._remember(key, row[1], value)
+        return True, value
+
+    def _remember(self, key, created_at, value):
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def lookup(self, names):
+        """Split the pairs of `names` into known interactions and unknown pairs.
+
+        Returns (interactions, missing) where interactions use the given
+        display names and missing is a list of (display_a, display_b) pairs.
+        """
+        canonical = {}
+        for name in names:
+            canonical.setdefault(canonical_drug_name(name), name)
+        interactions, missing = [], []
+        now = time.time()
+        with self._lock:
+            for a, b in itertools.combinations(sorted(canonical), 2):
+                known, value = self._get(pair_key(a, b), now)
+                if not known:
+                    missing.append((canonical[a], canonical[b]))
+                elif value is not None:
+                    interactions.append(dict(value, drugs=[canonical[a], canonical[b]]))
+        return interactions, missing
+
+    def record(self, pairs, answers):
+        """Store the LLM's answers for `pairs` and return the interactions among them.
+
+        Each answer names the 1-based index of the pair it is about in
+        `pair`, and whether the drugs interact in `interacts`. Only pairs
+        with such an answer are stored; pairs the model skipped, and answers
+        without a valid index, are not remembered and are asked about again.
+        Returned interactions carry the pair's display names in `drugs`.
+        """
+        answered = {}
+        unindexed = []
+        for answer in answers:
+            index = answer.get('pair')
+            if isinstance(index, int) and not isinstance(index, bool) and 1 <= index <= len(pairs):
+                answered[index - 1] = answer
+            elif answer.get('interacts', True) is not False and answer.get('drugs'):
+                unindexed.append({k: v for k, v in answer.items() if k not in ('pair', 'interacts')})
+
+        now = time.time()
+        interactions = []
+        rows = []
+        with self._lock:
+            for i, answer in sorted(answered.items()):
+                a, b = pairs[i]
+                key = pair_key(canonical_drug_name(a), canonical_drug_name(b))
+                value = None
+                if answer.get('interacts') is not False:
+                    value = {k: v for k, v in answer.items() if k not in ('pair', 'interacts', 'drugs')}
+                    interactions.append(dict(value, drugs=[a, b]))
+                self._remember(key, now, value)
+                rows.append((key[0], key[1], json.dumps(value) if value is not None else None, now))
+            db = self._connection()
+            if db is not None and rows:
+                db.executemany(
+                    "INSERT OR REPLACE INTO interactions (drug_a, drug_b, interaction, created_at) "
+                    "VALUES (?, ?, ?, ?)", rows
+                )
+        return interactions + unindexed
+
+
+def create_interaction_store():
+    path = os.environ.get('INTERACTION_DB_PATH')
+    if path is None:
+        path = private_store_path('interactions.sqlite3')
+    return InteractionStore(
+        path or None,
+        ttl=float(os.environ.get('INTERACTION_CACHE_TTL', str(7 * 24 * 3600))),
+        max_entries=int(os.environ.get('INTERACTION_CACHE_SIZE', '4096')),
+    )
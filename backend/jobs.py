@@ -0,0 +1,212 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from cache import private_store_path
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when the pending-job limit has been reached."""
+
+
+class JobStore:
+    """SQLite-backed job records, shared by every worker process using `path`.
+
+    Gunicorn may route the poll to a different worker than the submit, so the
+    store lives on disk; jobs older than `ttl` seconds are deleted on write.
+    """
+
+    def __init__(self, path, ttl=24 * 3600, trim_every=100):
+        self.path = path
+        self.ttl = ttl
+        self.trim_every = trim_every
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._db = None
+        self._db_pid = None
+
+    def _connection(self):
+        # SQLite handles must not cross a fork; open one per process lazily
+        if self._db is None or self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, "
+                "result TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_created_at ON jobs (created_at)")
+            self._db_pid = os.getpid()
+        return self._db
+
+    def create(self, kind):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            db = self._connection()
+            db.execute(
+                "INSERT INTO jobs (id, kind, status, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, kind, now, now)
+            )
+            self._writes += 1
+            if self._writes % self.trim_every == 0:
+                db.execute("DELETE FROM jobs WHERE created_at <= ?", (now - self.ttl,))
+        return job_id
+
+    def update(self, job_id, status, result=None, error=None):
+        with self._lock:
+            self._connection().execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(), job_id)
+            )
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT id, kind, status, result, error, created_at, updated_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row[0],
+            "kind": row[1],
+            "status": row[2],
+            "result": json.loads(row[3]) if row[3] is not None else None,
+            "error": row[4],
+            "created_at": row[5],
+            "updated_at": row[6],
+        }
+
+
+class JobQueue:
+    """Bounded background execution of analysis jobs.
+
+    At most `workers` jobs run at once per process and at most `max_pending`
+    may be queued or running; submit() raises QueueFull beyond that so the
+    endpoint can answer 429 instead of piling up work. When a job finishes
+    its record is optionally POSTed to a callback URL whose host is listed
+    in `callback_hosts`.
+    """
+
+    def __init__(self, store, workers=4, max_pending=32, callback_hosts=(), callback_timeout=10):
+        self.store = store
+        self.workers = workers
+        self.max_pending = max_pending
+        self.callback_hosts = set(callback_hosts)
+        self.callback_timeout = callback_timeout
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._executor = None
+        self._executor_pid = None
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._avg_seconds = 10.0
+
+    def _pool(self):
+        # Threads do not survive a fork either (gunicorn --preload)
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='analysis-job')
+            self._executor_pid = os.getpid()
+            self._pending = 0
+        return self._executor
+
+    def check_callback(self, url):
+        """Raise ValueError unless `url` is an allowed http(s) callback target."""
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+            raise ValueError("callback_url must be an http(s) URL")
+        if parsed.hostname not in self.callback_hosts:
+            raise ValueError(f"callback host '{parsed.hostname}' is not allowed")
+
+    def submit(self, kind, fn, *args, callback_url=None):
+        """Queue fn(*args) and return its job id; raises QueueFull when saturated."""
+        if callback_url:
+            self.check_callback(callback_url)
+        with self._lock:
+            pool = self._pool()
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise QueueFull(f"{self._pending} analysis jobs already pending")
+            self._pending += 1
+        try:
+            job_id = self.store.create(kind)
+            pool.submit(self._run, job_id, fn, args, callback_url)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        return job_id
+
+    def _run(self, job_id, fn, args, callback_url):
+        try:
+            self.store.update(job_id, 'running')
+            start = time.perf_counter()
+            try:
+                result = fn(*args)
+            except Exception as e:
+                print(f"Job {job_id} failed: {str(e)}")
+                self.store.update(job_id, 'failed', error=str(e))
+                with self._lock:
+                    self.failed += 1
+            else:
+                self.store.update(job_id, 'done', result=result)
+                with self._lock:
+                    self.completed += 1
+            with self._lock:
+                # Moving average of job duration, used for Retry-After
+                self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * (time.perf_counter() - start)
+            if callback_url:
+                self._notify(callback_url, self.store.get(job_id))
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _notify(self, url, job):
+        request = urllib.request.Request(
+            url, data=json.dumps(job).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}, method='POST'
+        )
+        try:
+            urllib.request.urlopen(request, timeout=self.callback_timeout).close()
+        except Exception as e:
+            print(f"Job callback to {url} failed: {str(e)}")
+
+    def retry_after(self):
+        """Rough seconds until a slot frees up, for the Retry-After header."""
+        with self._lock:
+            return max(1, math.ceil(self._avg_seconds * self._pending / max(1, self.workers)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+                "workers": self.workers,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_seconds": round(self._avg_seconds, 3),
+            }
+
+
+def create_job_queue():
+    """Build the process-wide job queue from JOB_* environment variables."""
+    # Without a file, jobs are only visible to the worker process that ran them
+    path = os.environ.get('JOB_STORE_PATH') or private_store_path('jobs.sqlite3') or ':memory:'
+    hosts = [h.strip() for h in os.environ.get('JOB_CALLBACK_HOSTS', '').split(',') if h.strip()]
+    return JobQueue(
+        JobStore(path, ttl=float(os.environ.get('JOB_TTL', str(24 * 3600)))),
+        workers=int(os.environ.get('JOB_WORKERS', '4')),
+        max_pending=int(os.environ.get('JOB_MAX_PENDING', '32')),
+        callback_hosts=hosts,
+        callback_timeout=float(os.environ.get('JOB_CALLBACK_TIMEOUT', '10')),
+    )
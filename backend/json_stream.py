@@ -0,0 +1,120 @@
+import json
+
+from llm_json import parse_llm_json
+
+
+class IncrementalJSONParser:
+    """Pulls complete pieces out of a top-level JSON object while it streams in.
+
+    Feed text chunks as they arrive; each call returns the events that became
+    complete:
+      {"event": "item", "field": "parameters", "value": {...}}  one array element
+      {"event": "field", "field": "summary", "value": "..."}    a non-array field
+    Anything before the first '{' (such as a ```json fence) is skipped.
+    Call result() once the stream has ended for the full parsed object.
+    """
+
+    def __init__(self):
+        self.text = ''
+        self._pos = 0
+        self._depth = 0
+        self._started = False
+        self.done = False
+        self._in_string = False
+        self._escape = False
+        self._expect_key = False
+        self._key = None
+        self._key_start = None
+        self._value_start = None
+        self._value_is_array = False
+        self._item_start = None
+
+    def feed(self, chunk):
+        self.text += chunk
+        events = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            if self.done:
+                break
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._key_start is not None:
+                        self._key = json.loads(text[self._key_start:i + 1])
+                        self._key_start = None
+                continue
+
+            if not self._started:
+                if c == '{':
+                    self._started = True
+                    self._depth = 1
+                    self._expect_key = True
+                continue
+
+            if c.isspace():
+                continue
+            self._mark_start(i, c)
+
+            if c == '"':
+                self._in_string = True
+            elif c in '{[':
+                self._depth += 1
+            elif c in '}]':
+                if self._depth == 2 and self._value_is_array:
+                    self._finish_item(i, events)
+                elif self._depth == 1:
+                    self._finish_field(i, events)
+                    self.done = True
+                self._depth -= 1
+            elif c == ',':
+                if self._depth == 2 and self._value_is_array:
+                    self._finish_item(i, events)
+                elif self._depth == 1:
+                    self._finish_field(i, events)
+                    self._expect_key = True
+            elif c == ':' and self._depth == 1:
+                self._expect_key = False
+                self._value_start = None
+        self._pos = len(text)
+        return events
+
+    def _mark_start(self, i, c):
+        """Remember where a top-level key, field value or array element begins."""
+        if c in ',:}]':
+            return
+        if self._depth == 1:
+            if self._expect_key and c == '"':
+                self._key_start = i
+            elif not self._expect_key and self._value_start is None:
+                self._value_start = i
+                self._value_is_array = c == '['
+        elif self._depth == 2 and self._value_is_array and self._item_start is None:
+            self._item_start = i
+
+    def _finish_item(self, end, events):
+        if self._item_start is not None:
+            try:
+                value = json.loads(self.text[self._item_start:end])
+                events.append({"event": "item", "field": self._key, "value": value})
+            except ValueError:
+                pass
+        self._item_start = None
+
+    def _finish_field(self, end, events):
+        if self._value_start is not None and not self._value_is_array:
+            try:
+                value = json.loads(self.text[self._value_start:end])
+                events.append({"event": "field", "field": self._key, "value": value})
+            except ValueError:
+                pass
+        self._value_start = None
+        self._value_is_array = False
+
+    def result(self, schema=None, stage='stream'):
+        """Parse everything received so far as one JSON object (see parse_llm_json)."""
+        return parse_llm_json(self.text, schema, stage)
@@ -0,0 +1,306 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+from metrics import LLM_ERRORS, LLM_RETRIES, record
+
+DEFAULT_MODEL = "gemini-1.5-flash"
+
+# Exception class names (anywhere in the MRO) worth retrying: rate limits,
+# transient server errors and timeouts from google.api_core / requests / grpc.
+RETRYABLE_ERRORS = {
+    'ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable', 'InternalServerError',
+    'DeadlineExceeded', 'GatewayTimeout', 'TimeoutError', 'ConnectionError',
+}
+
+
+class LLMError(Exception):
+    """Raised when the LLM call fails after all retries."""
+
+
+class LLMBusyError(LLMError):
+    """Raised when no concurrency slot frees up in time."""
+
+
+def _is_retryable(error):
+    return any(cls.__name__ in RETRYABLE_ERRORS for cls in type(error).__mro__)
+
+
+def _error_reason(error):
+    if isinstance(error, LLMBusyError):
+        return 'busy'
+    names = {cls.__name__ for cls in type(error).__mro__}
+    if names & {'DeadlineExceeded', 'GatewayTimeout', 'TimeoutError'}:
+        return 'timeout'
+    if names & {'ResourceExhausted', 'TooManyRequests'}:
+        return 'rate_limited'
+    return 'error'
+
+
+def _part_fingerprint(part):
+    if isinstance(part, str):
+        return part.encode('utf-8')
+    if isinstance(part, (bytes, bytearray, memoryview)):
+        return bytes(part)
+    if isinstance(part, dict) and 'data' in part:
+        # Inline blobs such as {'mime_type': 'image/jpeg', 'data': b'...'}
+        return part['data']
+    if hasattr(part, 'tobytes'):
+        # PIL images: hash the pixels so replays match byte-identical uploads
+        return part.tobytes()
+    return repr(part).encode('utf-8')
+
+
+def request_key(contents, model_name):
+    """Stable hash of a request, used to look up recorded responses."""
+    digest = hashlib.sha256(model_name.encode('utf-8'))
+    for part in contents if isinstance(contents, list) else [contents]:
+        digest.update(b'\0')
+        digest.update(_part_fingerprint(part))
+    return digest.hexdigest()
+
+
+def _prompt_text(contents):
+    parts = contents if isinstance(contents, list) else [contents]
+    return "\n".join(part for part in parts if isinstance(part, str))
+
+
+class GeminiBackend:
+    """google-generativeai backend that reuses one GenerativeModel per model name."""
+
+    def __init__(self, api_key=None):
+        import google.generativeai as genai
+        self._genai = genai
+        genai.configure(api_key=api_key or os.environ.get("GOOGLE_API_KEY"))
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _model(self, model_name):
+        model = self._models.get(model_name)
+        if model is None:
+            with self._lock:
+                model = self._models.setdefault(model_name, self._genai.GenerativeModel(model_name=model_name))
+        return model
+
+    def generate(self, contents, model_name, generation_config, timeout):
+        response = self._model(model_name).generate_content(
+            contents,
+            generation_config=generation_config,
+            request_options={"timeout": timeout}
+        )
+        return response.text
+
+    def generate_stream(self, contents, model_name, generation_config, timeout):
+        response = self._model(model_name).generate_content(
+            contents,
+            generation_config=generation_config,
+            request_options={"timeout": timeout},
+            stream=True
+        )
+        for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. only safety metadata)
+                continue
+            if text:
+                yield text
+
+
+class StubBackend:
+    """Deterministic offline backend that replays recorded responses.
+
+    The responses file is a JSON list (or a JSONL file, as written by
+    RecordingBackend) of entries, checked in order:
+      {"key": "<request_key>", "response": "..."}   exact replay of a recording
+      {"match": "substring of the prompt", "response": "..."}
+    An entry without "key" or "match" is the default. `latency_ms` adds a
+    fixed delay (plus `jitter_ms` of uniform noise) to mimic the remote call.
+    """
+
+    def __init__(self, responses_path=None, latency_ms=0.0, jitter_ms=0.0, seed=0, chunk_chars=64):
+        responses_path = responses_path or os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), 'stub_responses.json')
+        with open(responses_path) as f:
+            if responses_path.endswith('.jsonl'):
+                entries = [json.loads(line) for line in f if line.strip()]
+            else:
+                entries = json.load(f)
+        self._by_key = {e['key']: e['response'] for e in entries if 'key' in e}
+        self._by_match = [(e['match'], e['response']) for e in entries if 'match' in e]
+        self._default = next((e['response'] for e in entries if 'key' not in e and 'match' not in e), '{}')
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.chunk_chars = chunk_chars
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    def lookup(self, contents, model_name):
+        response = self._by_key.get(request_key(contents, model_name))
+        if response is not None:
+            return response
+        prompt = _prompt_text(contents)
+        for match, response in self._by_match:
+            if match in prompt:
+                return response
+        return self._default
+
+    def _delay_ms(self):
+        delay = self.latency_ms
+        if self.jitter_ms:
+            with self._random_lock:
+                delay += self._random.uniform(0, self.jitter_ms)
+        return delay
+
+    def _response(self, contents, model_name):
+        response = self.lookup(contents, model_name)
+        return response if isinstance(response, str) else json.dumps(response)
+
+    def generate(self, contents, model_name, generation_config, timeout):
+        delay = self._delay_ms()
+        if delay:
+            time.sleep(delay / 1000.0)
+        return self._response(contents, model_name)
+
+    def generate_stream(self, contents, model_name, generation_config, timeout):
+        text = self._response(contents, model_name)
+        chunks = [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)] or ['']
+        # Spread the simulated latency over the chunks like a real token stream
+        per_chunk = self._delay_ms() / len(chunks) / 1000.0
+        for chunk in chunks:
+            if per_chunk:
+                time.sleep(per_chunk)
+            yield chunk
+
+
+class RecordingBackend:
+    """Wraps a live backend and appends every response to a JSONL file for replay."""
+
+    def __init__(self, backend, record_path):
+        self.backend = backend
+        self.record_path = record_path
+        self._lock = threading.Lock()
+
+    def generate(self, contents, model_name, generation_config, timeout):
+        text = self.backend.generate(contents, model_name, generation_config, timeout)
+        entry = {"key": request_key(contents, model_name), "response": text}
+        self._write(entry)
+        return text
+
+    def generate_stream(self, contents, model_name, generation_config, timeout):
+        chunks = []
+        for chunk in self.backend.generate_stream(contents, model_name, generation_config, timeout):
+            chunks.append(chunk)
+            yield chunk
+        self._write({"key": request_key(contents, model_name), "response": ''.join(chunks)})
+
+    def _write(self, entry):
+        with self._lock, open(self.record_path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+
+class LLMClient:
+    """Shared entry point for every LLM call: timeouts, retries and concurrency limits."""
+
+    def __init__(self, backend, timeout=60.0, max_retries=2, backoff=0.5,
+                 max_concurrency=8, acquire_timeout=30.0, json_mode=True):
+        self.backend = backend
+        self.json_mode = json_mode
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.acquire_timeout = acquire_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def _config(self, temperature, json_response):
+        config = {"temperature": temperature}
+        if json_response and self.json_mode:
+            # The model emits bare JSON: no fences, no prose, no trailing commas
+            config["response_mime_type"] = "application/json"
+        return config
+
+    def generate(self, contents, temperature=0.2, model_name=DEFAULT_MODEL, json_response=False):
+        """Return the response text for `contents` (a prompt or [prompt, image])."""
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            LLM_ERRORS.inc(reason='busy')
+            raise LLMBusyError("Too many concurrent LLM requests")
+        try:
+            attempt = 0
+            while True:
+                try:
+                    return self.backend.generate(
+                        contents, model_name, self._config(temperature, json_response), self.timeout)
+                except Exception as e:
+                    if attempt >= self.max_retries or not _is_retryable(e):
+                        LLM_ERRORS.inc(reason=_error_reason(e))
+                        raise LLMError(str(e)) from e
+                    # Exponential backoff with full jitter
+                    LLM_RETRIES.inc()
+                    time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+                    attempt += 1
+        finally:
+            self._slots.release()
+            # Includes time spent waiting for a slot and on retries
+            record('llm', time.perf_counter() - start)
+
+    def generate_stream(self, contents, temperature=0.2, model_name=DEFAULT_MODEL, json_response=False):
+        """Yield response text chunks as they arrive.
+
+        Retries only happen before the first chunk; once text has been handed
+        to the caller a failure is raised as LLMError.
+        """
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            LLM_ERRORS.inc(reason='busy')
+            raise LLMBusyError("Too many concurrent LLM requests")
+        try:
+            attempt = 0
+            while True:
+                started = False
+                try:
+                    for chunk in self.backend.generate_stream(
+                            contents, model_name, self._config(temperature, json_response), self.timeout):
+                        started = True
+                        yield chunk
+                    return
+                except Exception as e:
+                    if started or attempt >= self.max_retries or not _is_retryable(e):
+                        LLM_ERRORS.inc(reason=_error_reason(e))
+                        raise LLMError(str(e)) from e
+                    LLM_RETRIES.inc()
+                    time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+                    attempt += 1
+        finally:
+            self._slots.release()
+            record('llm', time.perf_counter() - start)
+
+
+def create_llm_client():
+    """Build the process-wide client from LLM_* environment variables.
+
+    LLM_BACKEND=stub replays LLM_STUB_RESPONSES (default: stub_responses.json)
+    with LLM_STUB_LATENCY_MS of simulated latency; LLM_RECORD_PATH records
+    live Gemini responses in the same format for later replay.
+    """
+    if os.environ.get('LLM_BACKEND', 'gemini') == 'stub':
+        backend = StubBackend(
+            os.environ.get('LLM_STUB_RESPONSES'),
+            latency_ms=float(os.environ.get('LLM_STUB_LATENCY_MS', '0')),
+            jitter_ms=float(os.environ.get('LLM_STUB_JITTER_MS', '0')),
+        )
+    else:
+        backend = GeminiBackend()
+        if os.environ.get('LLM_RECORD_PATH'):
+            backend = RecordingBackend(backend, os.environ['LLM_RECORD_PATH'])
+    return LLMClient(
+        backend,
+        timeout=float(os.environ.get('LLM_TIMEOUT', '60')),
+        max_retries=int(os.environ.get('LLM_MAX_RETRIES', '2')),
+        backoff=float(os.environ.get('LLM_RETRY_BACKOFF', '0.5')),
+        max_concurrency=int(os.environ.get('LLM_MAX_CONCURRENCY', '8')),
+        json_mode=os.environ.get('LLM_JSON_MODE', '1') != '0',
+    )
@@ -0,0 +1,99 @@
+import io
+import math
+import os
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+from metrics import span
+
+ImageBudget = namedtuple('ImageBudget', ['max_pixels', 'format', 'quality'])
+
+# What each endpoint sends to the LLM. Gemini tiles images into 768x768
+# crops, so resolution beyond a few megapixels only adds upload time and
+# tokens. Text-heavy documents get more pixels than radiology images.
+IMAGE_BUDGETS = {
+    'medical_image': ImageBudget(1536 * 1536, 'JPEG', 90),
+    'prescription': ImageBudget(2048 * 1536, 'JPEG', 90),
+    'medical_report': ImageBudget(2048 * 1536, 'JPEG', 92),
+}
+
+MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp', 'PNG': 'image/png'}
+
+# 16-bit, 32-bit integer and float modes (DICOM exports, microscopy TIFFs).
+# convert('L'/'RGB') clips these at 255 instead of rescaling them.
+HIGH_DEPTH_MODES = ('I;16', 'I;16L', 'I;16B', 'I;16N', 'I', 'F')
+# Percentiles of the intensity window mapped to 0..255; outliers (burned-in
+# text, dead pixels) would otherwise squash the tissue range
+WINDOW_PERCENTILES = (0.5, 99.5)
+
+
+def _budget_from_env(name, default):
+    # e.g. LLM_IMAGE_BUDGET_PRESCRIPTION=4000000,WEBP,85
+    value = os.environ.get(f'LLM_IMAGE_BUDGET_{name.upper()}')
+    if not value:
+        return default
+    max_pixels, fmt, quality = value.split(',')
+    return ImageBudget(int(max_pixels), fmt.strip().upper(), int(quality))
+
+
+IMAGE_BUDGETS = {name: _budget_from_env(name, budget) for name, budget in IMAGE_BUDGETS.items()}
+
+
+def to_8bit(image):
+    """Rescale a high-bit-depth image to 8-bit grayscale; other images are returned as-is.
+
+    The window runs between the WINDOW_PERCENTILES of the pixel values
+    (min/max when those coincide), so a 0..4095 export uses the full 0..255
+    range instead of turning almost white.
+    """
+    if image.mode not in HIGH_DEPTH_MODES:
+        return image
+    pixels = np.asarray(image, dtype=np.float32)
+    low, high = np.percentile(pixels, WINDOW_PERCENTILES)
+    if high <= low:
+        low, high = float(pixels.min()), float(pixels.max())
+    scale = 255.0 / (high - low) if high > low else 0.0
+    scaled = np.clip((pixels - low) * scale, 0, 255)
+    return Image.fromarray(np.rint(scaled).astype(np.uint8))
+
+
+def fit_to_budget(image, max_pixels):
+    """Downscale (never upscale) so that width * height <= max_pixels."""
+    width, height = image.size
+    if width * height <= max_pixels:
+        return image
+    scale = math.sqrt(max_pixels / (width * height))
+    size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    factor = int(1 / scale) // 2
+    if factor >= 2:
+        # Cheap integer box reduction first, then a high-quality final resize
+        image = image.reduce(factor)
+    return image.resize(size, Image.LANCZOS)
+
+
+def encode_for_llm(image, budget, original_data=None):
+    """Return an inline image part ({'mime_type', 'data'}) that fits `budget`.
+
+    When the untouched upload already fits the budget in an accepted format
+    its bytes are passed through instead of being re-encoded; 8-bit PNGs
+    stay lossless that way. High-bit-depth images are windowed to 8 bits.
+    """
+    with span('encode'):
+        return _encode(image, IMAGE_BUDGETS[budget] if isinstance(budget, str) else budget, original_data)
+
+
+def _encode(image, budget, original_data):
+    width, height = image.size
+    if (original_data is not None and image.format in MIME_TYPES and image.mode not in HIGH_DEPTH_MODES
+            and width * height <= budget.max_pixels):
+        return {'mime_type': MIME_TYPES[image.format], 'data': original_data}
+
+    image = fit_to_budget(to_8bit(image), budget.max_pixels)
+    if budget.format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    options = {'quality': budget.quality} if budget.format in ('JPEG', 'WEBP') else {'optimize': True}
+    image.save(buffer, format=budget.format, **options)
+    return {'mime_type': MIME_TYPES[budget.format], 'data': buffer.getvalue()}
@@ -0,0 +1,177 @@
+import copy
+import json
+from collections import namedtuple
+
+from metrics import PARSE_FAILURES, PARSE_REPAIRS, span
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# How far back a truncated response may be cut to reach a parseable prefix
+MAX_TRUNCATION_CUTS = 64
+
+_CLOSERS = {'{': '}', '[': ']'}
+
+
+class LLMJSONError(ValueError):
+    """Raised when an LLM response holds no usable JSON object."""
+
+
+Field = namedtuple('Field', ['type', 'required', 'default', 'items'])
+
+
+def field(type, required=True, default=None, items=None):
+    """Schema entry: expected type, whether it must be present, fallback and list item type."""
+    return Field(type, required, default, items)
+
+
+def _scan(text, start):
+    """One pass over the object starting at text[start].
+
+    Returns (cleaned, end, cuts, state): the text with trailing commas
+    dropped, the index just past the closing brace (None if the response
+    was truncated), and for truncated responses the positions where the
+    object can be cut and closed.
+    """
+    out = []
+    stack = []
+    cuts = []
+    in_string = escape = False
+    pending_comma = None
+    dropped_commas = 0
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            out.append(c)
+            if escape:
+                escape = False
+            elif c == '\\':
+                escape = True
+            elif c == '"':
+                in_string = False
+            continue
+        if c.isspace():
+            out.append(c)
+            continue
+        if c in '}]' and pending_comma is not None:
+            # Trailing comma: {"a": 1,}
+            del out[pending_comma]
+            dropped_commas += 1
+        pending_comma = None
+        if c == '"':
+            in_string = True
+        elif c in '{[':
+            stack.append(_CLOSERS[c])
+            # An empty list is a fair prefix; an empty object inside one is just noise
+            if c == '[' or len(stack) == 1:
+                cuts.append((len(out) + 1, ''.join(reversed(stack))))
+        elif c in '}]':
+            if not stack or stack[-1] != c:
+                raise LLMJSONError(f"Unbalanced '{c}' at offset {i}")
+            stack.pop()
+            if not stack:
+                out.append(c)
+                return ''.join(out), i + 1, None, (False, stack, dropped_commas)
+        elif c == ',':
+            cuts.append((len(out), ''.join(reversed(stack))))
+            pending_comma = len(out)
+        out.append(c)
+    return ''.join(out), None, cuts[-MAX_TRUNCATION_CUTS:], (in_string, stack, dropped_commas)
+
+
+def _close_truncated(cleaned, cuts, in_string, stack):
+    """Close a cut-off object, giving up as little of the tail as possible."""
+    # A response cut inside a string value keeps the partial text
+    candidates = [cleaned + ('"' if in_string else '') + ''.join(reversed(stack))]
+    candidates += [cleaned[:index].rstrip() + closers for index, closers in reversed(cuts)]
+    for candidate in candidates:
+        try:
+            return _loads(candidate)
+        except ValueError:
+            continue
+    raise LLMJSONError("Truncated JSON object could not be repaired")
+
+
+def _strip_fences(text):
+    text = text.strip()
+    if text.startswith('```'):
+        text = text[3:]
+        if text[:4].lower() == 'json':
+            text = text[4:]
+    if text.endswith('```'):
+        text = text[:-3]
+    return text.strip()
+
+
+def _repair(text, stage):
+    start = text.find('{')
+    if start < 0:
+        raise LLMJSONError("No JSON object in response")
+    cleaned, end, cuts, (in_string, stack, dropped_commas) = _scan(text, start)
+    if end is None:
+        PARSE_REPAIRS.inc(stage=stage, kind='truncated')
+        return _close_truncated(cleaned, cuts, in_string, stack)
+    if dropped_commas:
+        PARSE_REPAIRS.inc(stage=stage, kind='trailing_comma')
+    if start > 0 or text[end:].strip():
+        PARSE_REPAIRS.inc(stage=stage, kind='surrounding_text')
+    try:
+        return _loads(cleaned)
+    except ValueError as e:
+        raise LLMJSONError(f"Invalid JSON in response: {e}") from e
+
+
+def validate(value, schema, stage=None):
+    """Check `value` against a {name: Field} schema.
+
+    Missing or mistyped optional fields get their default, list items of
+    the wrong type are dropped; missing or mistyped required fields raise
+    LLMJSONError listing every problem.
+    """
+    if not isinstance(value, dict):
+        raise LLMJSONError(f"Expected a JSON object, got {type(value).__name__}")
+    errors = []
+    for name, spec in schema.items():
+        present = name in value and value[name] is not None
+        if present and isinstance(value[name], spec.type):
+            if spec.items is not None:
+                items = [item for item in value[name] if isinstance(item, spec.items)]
+                if len(items) != len(value[name]):
+                    PARSE_REPAIRS.inc(stage=stage, kind='dropped_items')
+                    value[name] = items
+            continue
+        if spec.required:
+            errors.append(f"'{name}' is {'of the wrong type' if present else 'missing'}")
+        else:
+            PARSE_REPAIRS.inc(stage=stage, kind='default')
+            value[name] = copy.deepcopy(spec.default)
+    if errors:
+        raise LLMJSONError("Response does not match schema: " + ", ".join(errors))
+    return value
+
+
+def parse_llm_json(text, schema=None, stage='unknown'):
+    """Extract, repair and validate the JSON object in an LLM response.
+
+    Pure JSON (what the model's JSON response mode returns) is parsed
+    directly. Otherwise a single scan finds the object, ignoring code
+    fences and prose around it, drops trailing commas and, if the response
+    was cut off, closes it at the last complete element. Failures are
+    counted in arogya_parse_failures_total and raised as LLMJSONError.
+    """
+    with span('parse'):
+        try:
+            text = _strip_fences(text or '')
+            try:
+                value = _loads(text)
+            except ValueError:
+                value = _repair(text, stage)
+            if schema is not None:
+                value = validate(value, schema, stage)
+            return value
+        except LLMJSONError:
+            PARSE_FAILURES.inc(stage=stage)
+            raise
@@ -0,0 +1,154 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; LLM calls dominate, so the upper buckets go well past a minute
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, '')) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, '')) for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for upper, n in zip(self.buckets, counts):
+                    cumulative += n
+                    labels = _format_labels(self.labelnames, key, [('le', repr(float(upper)))])
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = _format_labels(self.labelnames, key, [('le', '+Inf')])
+                lines.append(f'{self.name}_bucket{labels} {count}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {total}')
+                lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+class Registry:
+    """Process-local metrics, rendered in the Prometheus text format.
+
+    Each gunicorn worker keeps its own numbers; a scrape sees the worker
+    that happened to serve it, so run one worker (with threads) per
+    instance when the totals matter.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    'arogya_request_seconds', 'End-to-end request latency.', ['endpoint', 'method', 'status'])
+STAGE_SECONDS = REGISTRY.histogram(
+    'arogya_stage_seconds', 'Latency of individual processing stages.', ['stage'])
+LLM_ERRORS = REGISTRY.counter(
+    'arogya_llm_errors_total', 'LLM calls that failed after retries.', ['reason'])
+LLM_RETRIES = REGISTRY.counter(
+    'arogya_llm_retries_total', 'LLM attempts that were retried.')
+PARSE_FAILURES = REGISTRY.counter(
+    'arogya_parse_failures_total', 'LLM responses that did not contain valid JSON.', ['stage'])
+PARSE_REPAIRS = REGISTRY.counter(
+    'arogya_parse_repairs_total', 'LLM responses that parsed only after a repair.', ['stage', 'kind'])
+REPORT_TIERS = REGISTRY.counter(
+    'arogya_report_tier_total', 'Medical reports by how they were analyzed (ocr, ocr_text, image).', ['tier'])
+
+# Spans recorded while handling the current request, for the Server-Timing header
+_request_spans = contextvars.ContextVar('request_spans', default=None)
+
+
+def start_request_spans():
+    spans = []
+    _request_spans.set(spans)
+    return spans
+
+
+@contextmanager
+def span(stage):
+    """Time a block as `stage` in arogya_stage_seconds (and the request's spans)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def record(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+
+def server_timing(spans):
+    """Server-Timing header value; repeated stages are summed."""
+    totals = {}
+    for stage, seconds in spans:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ', '.join(f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in totals.items())
@@ -0,0 +1,146 @@
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError, as_completed
+
+from metrics import span
+
+# Seconds each stage may take before its fallback is used instead
+STAGE_TIMEOUTS = {
+    'extract': float(os.environ.get('PRESCRIPTION_EXTRACT_TIMEOUT', '60')),
+    'diseases': float(os.environ.get('PRESCRIPTION_DISEASES_TIMEOUT', '30')),
+    'interactions': float(os.environ.get('PRESCRIPTION_INTERACTIONS_TIMEOUT', '30')),
+}
+
+# Shared by all requests in the process; the stages are remote calls, so the
+# threads spend their time waiting on the network.
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('PIPELINE_WORKERS', '16')),
+    thread_name_prefix='prescription-stage'
+)
+
+# Prescriptions of one batch upload processed at the same time
+BATCH_CONCURRENCY = int(os.environ.get('PRESCRIPTION_BATCH_CONCURRENCY', '4'))
+
+
+def _timed(name, fn, arg):
+    with span(name):
+        return fn(arg)
+
+
+def _submit(executor, name, fn, arg):
+    # Run in a copy of the caller's context so the stage's spans reach its request
+    return executor.submit(contextvars.copy_context().run, _timed, name, fn, arg)
+
+
+def _wait(future, name, timeout):
+    """Return (value, None) on success or (None, error message) on failure/timeout."""
+    try:
+        return future.result(timeout=timeout), None
+    except TimeoutError:
+        error = f"Prescription stage '{name}' timed out after {timeout}s"
+    except Exception as e:
+        error = f"Prescription stage '{name}' failed: {str(e)}"
+    print(error)
+    return None, error
+
+
+def run_prescription_pipeline(image_data, extract, predict_diseases, get_interactions,
+                              on_extract_failure, executor=None, timeouts=None):
+    """Run the prescription DAG: extract, then diseases and interactions in parallel.
+
+    The stages are plain callables so the DAG can be driven by fakes:
+      extract(image_data) -> prescription dict (raises on failure)
+      predict_diseases(prescription) -> list of possible diseases
+      get_interactions(medications) -> list of drug interactions
+    `on_extract_failure(message)` builds the error result. Returns
+    (result, ok); end-to-end latency is roughly extract + max(diseases, interactions).
+    """
+    executor = executor or _executor
+    timeouts = {**STAGE_TIMEOUTS, **(timeouts or {})}
+
+    result, error = _wait(_submit(executor, 'extract', extract, image_data), 'extract', timeouts['extract'])
+    if error:
+        return on_extract_failure(error), False
+    if not result.get('medications'):
+        result['possible_diseases'] = []
+        result['drug_interactions'] = []
+        return result, True
+
+    # Both follow-ups depend only on the extracted medication list
+    diseases = _submit(executor, 'diseases', predict_diseases, result)
+    interactions = _submit(executor, 'interactions', get_interactions, result['medications'])
+
+    # Deadlines are measured from when both were submitted, not one after the other
+    submitted = time.perf_counter()
+    result['possible_diseases'] = _wait(diseases, 'diseases', timeouts['diseases'])[0] or []
+    remaining = max(0.0, timeouts['interactions'] - (time.perf_counter() - submitted))
+    result['drug_interactions'] = _wait(interactions, 'interactions', remaining)[0] or []
+    return result, True
+
+
+def medication_key(medications, fields=('name',)):
+    """Order- and case-insensitive key of a medication list, e.g. for sharing interaction checks."""
+    return tuple(sorted({
+        tuple(str(med.get(f) or '').strip().lower() for f in fields)
+        for med in medications if isinstance(med, dict)
+    }))
+
+
+class SharedCalls:
+    """Runs each keyed call once; concurrent callers with the same key wait for that result.
+
+    The first caller computes in its own thread, so callers blocked on it
+    never wait on work that is still queued behind them.
+    """
+
+    def __init__(self):
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._futures)
+
+    def call(self, key, fn, arg):
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = self._futures[key] = Future()
+        if owner:
+            try:
+                future.set_result(fn(arg))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+    def wrap(self, fn, key_fn):
+        """`fn` deduplicated on key_fn(arg)."""
+        return lambda arg: self.call(key_fn(arg), fn, arg)
+
+
+def run_prescription_batch(uploads, process, concurrency=None):
+    """Run `process(data)` over (name, data) uploads, yielding (index, name, result, error) as each finishes.
+
+    At most `concurrency` uploads are in flight, so a batch of any size
+    takes roughly len(uploads) / concurrency times one prescription.
+    """
+    workers = max(1, min(concurrency or BATCH_CONCURRENCY, len(uploads)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prescription-batch') as pool:
+        futures = {
+            pool.submit(contextvars.copy_context().run, process, data): (index, name)
+            for index, (name, data) in enumerate(uploads)
+        }
+        try:
+            for future in as_completed(futures):
+                index, name = futures[future]
+                try:
+                    yield index, name, future.result(), None
+                except Exception as e:
+                    print(f"Error processing prescription '{name}': {str(e)}")
+                    yield index, name, None, str(e)
+        finally:
+            # A client that disconnects mid-stream should not leave the rest running
+            for future in futures:
+                future.cancel()
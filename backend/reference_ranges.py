@@ -0,0 +1,385 @@
+import re
+from collections import namedtuple
+
+import numpy as np
+
+# Lab analytes: the names reports print for them, the unit the reference
+# ranges below are in, factors converting other units into it, and ranges
+# as (sex, min_age, max_age, low, high). Rows for one sex come before the
+# row for either sex; None is an open bound or "any".
+Analyte = namedtuple('Analyte', ['name', 'panel', 'aliases', 'unit', 'conversions', 'ranges',
+                                 'low_meaning', 'high_meaning'])
+
+_CELLS_PER_UL = {'10^3/ul': 1, 'x10^3/ul': 1, 'thousand/ul': 1, 'k/ul': 1, '10^9/l': 1, 'x10^9/l': 1,
+                 '/ul': 0.001, 'cells/ul': 0.001, 'lakhs/ul': 100, 'lakh/ul': 100}
+_MG_DL_PER_MMOL_CHOLESTEROL = {'mmol/l': 38.67}
+
+ANALYTES = [
+    Analyte('Hemoglobin', 'cbc', ['hemoglobin', 'haemoglobin', 'hb', 'hgb'],
+            'g/dl', {'g/l': 0.1, 'mmol/l': 1.611},
+            [('male', 18, None, 13.0, 17.0), ('female', 18, None, 12.0, 15.5), (None, 18, None, 12.0, 17.0),
+             (None, None, 18, 11.0, 15.5)],
+            'may indicate anemia', 'may indicate dehydration or polycythemia'),
+    Analyte('RBC Count', 'cbc', ['rbc count', 'total rbc', 'rbc', 'red blood cell count', 'red cell count', 'erythrocytes'],
+            '10^6/ul', {'million/ul': 1, 'x10^6/ul': 1, 'mill/ul': 1, '10^12/l': 1, 'x10^12/l': 1},
+            [('male', 18, None, 4.5, 5.9), ('female', 18, None, 4.0, 5.2), (None, None, None, 4.0, 5.9)],
+            'may indicate anemia or blood loss', 'may indicate dehydration or polycythemia'),
+    Analyte('WBC Count', 'cbc', ['wbc count', 'total wbc', 'wbc', 'total leucocyte count', 'total leukocyte count', 'tlc',
+                                 'white blood cell count'],
+            '10^3/ul', _CELLS_PER_UL,
+            [(None, 18, None, 4.0, 11.0), (None, None, 18, 4.5, 13.5)],
+            'may indicate bone marrow suppression or a viral infection', 'may indicate infection or inflammation'),
+    Analyte('Platelet Count', 'cbc', ['platelet count', 'platelets', 'plt'],
+            '10^3/ul', _CELLS_PER_UL,
+            [(None, None, None, 150, 410)],
+            'may indicate thrombocytopenia and bleeding risk', 'may indicate inflammation or a myeloproliferative disorder'),
+    Analyte('Hematocrit', 'cbc', ['hematocrit', 'haematocrit', 'hct', 'pcv', 'packed cell volume'],
+            '%', {'l/l': 100},
+            [('male', 18, None, 40, 50), ('female', 18, None, 36, 46), (None, None, None, 36, 50)],
+            'may indicate anemia', 'may indicate dehydration'),
+    Analyte('MCV', 'cbc', ['mcv', 'mean corpuscular volume'],
+            'fl', {'um3': 1},
+            [(None, None, None, 80, 100)],
+            'may indicate iron deficiency', 'may indicate vitamin B12 or folate deficiency'),
+    Analyte('MCH', 'cbc', ['mch', 'mean corpuscular hemoglobin'],
+            'pg', {},
+            [(None, None, None, 27, 33)],
+            'may indicate iron deficiency', 'may indicate macrocytic anemia'),
+    Analyte('MCHC', 'cbc', ['mchc', 'mean corpuscular hemoglobin concentration'],
+            'g/dl', {'g/l': 0.1, '%': 1},
+            [(None, None, None, 32, 36)],
+            'may indicate iron deficiency', 'may indicate spherocytosis'),
+    Analyte('RDW', 'cbc', ['rdw', 'rdw-cv', 'red cell distribution width'],
+            '%', {},
+            [(None, None, None, 11.5, 14.5)],
+            'is rarely significant', 'may indicate mixed or nutritional anemia'),
+    Analyte('Neutrophils', 'cbc', ['neutrophils', 'neutrophil', 'polymorphs'],
+            '%', {},
+            [(None, None, None, 40, 80)],
+            'may indicate a viral infection or marrow suppression', 'may indicate a bacterial infection'),
+    Analyte('Lymphocytes', 'cbc', ['lymphocytes', 'lymphocyte'],
+            '%', {},
+            [(None, 18, None, 20, 40), (None, None, 18, 20, 60)],
+            'may indicate immune suppression', 'may indicate a viral infection'),
+    Analyte('Monocytes', 'cbc', ['monocytes', 'monocyte'],
+            '%', {},
+            [(None, None, None, 2, 10)],
+            'is rarely significant', 'may indicate a chronic infection'),
+    Analyte('Eosinophils', 'cbc', ['eosinophils', 'eosinophil'],
+            '%', {},
+            [(None, None, None, 1, 6)],
+            'is rarely significant', 'may indicate allergy or a parasitic infection'),
+    Analyte('Basophils', 'cbc', ['basophils', 'basophil'],
+            '%', {},
+            [(None, None, None, 0, 2)],
+            'is rarely significant', 'may indicate an allergic or myeloproliferative condition'),
+    Analyte('Glucose', 'cmp', ['glucose', 'fasting blood sugar', 'blood sugar fasting', 'fbs', 'blood glucose'],
+            'mg/dl', {'mmol/l': 18.016},
+            [(None, None, None, 70, 99)],
+            'may indicate hypoglycemia', 'may indicate diabetes or impaired glucose tolerance'),
+    Analyte('Blood Urea Nitrogen', 'cmp', ['blood urea nitrogen', 'bun'],
+            'mg/dl', {'mmol/l': 2.801},
+            [(None, None, None, 7, 20)],
+            'may indicate low protein intake or liver disease', 'may indicate reduced kidney function or dehydration'),
+    Analyte('Urea', 'cmp', ['urea', 'blood urea', 'serum urea'],
+            'mg/dl', {'mmol/l': 6.006},
+            [(None, None, None, 15, 45)],
+            'may indicate low protein intake or liver disease', 'may indicate reduced kidney function or dehydration'),
+    Analyte('Creatinine', 'cmp', ['creatinine', 'serum creatinine', 's. creatinine'],
+            'mg/dl', {'umol/l': 0.0113},
+            [('male', 18, None, 0.74, 1.35), ('female', 18, None, 0.59, 1.04), (None, 18, None, 0.59, 1.35),
+             (None, None, 18, 0.3, 1.0)],
+            'may indicate low muscle mass', 'may indicate reduced kidney function'),
+    Analyte('Sodium', 'cmp', ['sodium', 'na+', 'na'],
+            'mmol/l', {'meq/l': 1},
+            [(None, None, None, 135, 145)],
+            'may indicate hyponatremia', 'may indicate dehydration'),
+    Analyte('Potassium', 'cmp', ['potassium', 'k+', 'k'],
+            'mmol/l', {'meq/l': 1},
+            [(None, None, None, 3.5, 5.1)],
+            'may indicate hypokalemia', 'may indicate hyperkalemia or reduced kidney function'),
+    Analyte('Chloride', 'cmp', ['chloride', 'cl-', 'cl'],
+            'mmol/l', {'meq/l': 1},
+            [(None, None, None, 98, 107)],
+            'may indicate metabolic alkalosis', 'may indicate dehydration or metabolic acidosis'),
+    Analyte('Bicarbonate', 'cmp', ['bicarbonate', 'co2', 'total co2', 'hco3'],
+            'mmol/l', {'meq/l': 1},
+            [(None, None, None, 22, 29)],
+            'may indicate metabolic acidosis', 'may indicate metabolic alkalosis'),
+    Analyte('Calcium', 'cmp', ['calcium', 'serum calcium', 'ca'],
+            'mg/dl', {'mmol/l': 4.008},
+            [(None, None, None, 8.6, 10.3)],
+            'may indicate vitamin D deficiency or hypoparathyroidism', 'may indicate hyperparathyroidism'),
+    Analyte('Total Protein', 'cmp', ['total protein', 'protein total', 'serum protein'],
+            'g/dl', {'g/l': 0.1},
+            [(None, None, None, 6.0, 8.3)],
+            'may indicate malnutrition or liver disease', 'may indicate chronic inflammation'),
+    Analyte('Albumin', 'cmp', ['albumin', 'serum albumin'],
+            'g/dl', {'g/l': 0.1},
+            [(None, None, None, 3.5, 5.0)],
+            'may indicate malnutrition, liver or kidney disease', 'may indicate dehydration'),
+    Analyte('Total Bilirubin', 'cmp', ['total bilirubin', 'bilirubin total', 'bilirubin'],
+            'mg/dl', {'umol/l': 0.0585},
+            [(None, None, None, 0.1, 1.2)],
+            'is rarely significant', 'may indicate liver disease or hemolysis'),
+    Analyte('Alkaline Phosphatase', 'cmp', ['alkaline phosphatase', 'alp'],
+            'u/l', {'iu/l': 1},
+            [(None, 18, None, 44, 147), (None, None, 18, 100, 390)],
+            'is rarely significant', 'may indicate liver or bone disease'),
+    Analyte('ALT', 'cmp', ['alt', 'sgpt', 'alanine aminotransferase'],
+            'u/l', {'iu/l': 1},
+            [('male', None, None, 7, 55), ('female', None, None, 7, 45), (None, None, None, 7, 55)],
+            'is rarely significant', 'may indicate liver injury'),
+    Analyte('AST', 'cmp', ['ast', 'sgot', 'aspartate aminotransferase'],
+            'u/l', {'iu/l': 1},
+            [(None, None, None, 8, 48)],
+            'is rarely significant', 'may indicate liver or muscle injury'),
+    Analyte('Total Cholesterol', 'lipid', ['total cholesterol', 'cholesterol total', 'cholesterol', 'serum cholesterol'],
+            'mg/dl', _MG_DL_PER_MMOL_CHOLESTEROL,
+            [(None, None, None, None, 200)],
+            'is rarely significant', 'increases cardiovascular risk'),
+    Analyte('HDL Cholesterol', 'lipid', ['hdl cholesterol', 'hdl-c', 'hdl'],
+            'mg/dl', _MG_DL_PER_MMOL_CHOLESTEROL,
+            [('male', None, None, 40, None), ('female', None, None, 50, None), (None, None, None, 40, None)],
+            'increases cardiovascular risk', 'is generally protective'),
+    Analyte('LDL Cholesterol', 'lipid', ['ldl cholesterol', 'ldl-c', 'ldl'],
+            'mg/dl', _MG_DL_PER_MMOL_CHOLESTEROL,
+            [(None, None, None, None, 100)],
+            'is rarely significant', 'increases cardiovascular risk'),
+    Analyte('Triglycerides', 'lipid', ['triglycerides', 'triglyceride', 'tg'],
+            'mg/dl', {'mmol/l': 88.57},
+            [(None, None, None, None, 150)],
+            'is rarely significant', 'increases cardiovascular and pancreatitis risk'),
+]
+
+# Longest alias first so "total bilirubin" wins over "bilirubin" and "mchc" over "mch"
+_ALIASES = sorted(((alias, analyte) for analyte in ANALYTES for alias in analyte.aliases),
+                  key=lambda pair: len(pair[0]), reverse=True)
+ALIAS_RE = re.compile(
+    r'^[^a-z0-9]*(' + '|'.join(re.escape(alias) for alias, _ in _ALIASES) + r')(?![a-z0-9])')
+ANALYTE_BY_ALIAS = {alias: analyte for alias, analyte in _ALIASES}
+# Words that may follow an alias without naming a different test ("Creatinine,
+# Serum"), besides the analyte's own alias words ("Hemoglobin (Hb)").
+# Anything else means a test that only starts like a known one: "Hb A1c",
+# "CA 19-9", "Bilirubin Direct", "Glucose PP"
+QUALIFIER_WORDS = frozenset(['serum', 's', 'plasma', 'blood', 'whole', 'level', 'levels', 'value', 'result'])
+_ALIAS_WORDS = {analyte.name: frozenset(word for alias in analyte.aliases for word in re.findall(r'[a-z0-9]+', alias))
+                for analyte in ANALYTES}
+_ANALYTE_INDEX = {analyte.name: i for i, analyte in enumerate(ANALYTES)}
+
+_SEX_CODES = {None: 0, 'male': 1, 'female': 2}
+
+# The range table flattened into parallel arrays, one row per range, so a
+# whole report is matched against it with one broadcast comparison
+_ROWS = [(_ANALYTE_INDEX[a.name], _SEX_CODES[sex], min_age, max_age, low, high)
+         for a in ANALYTES for sex, min_age, max_age, low, high in a.ranges]
+_ROW_ANALYTE = np.array([row[0] for row in _ROWS])
+_ROW_SEX = np.array([row[1] for row in _ROWS])
+_ROW_MIN_AGE = np.array([-np.inf if row[2] is None else row[2] for row in _ROWS], dtype=np.float64)
+_ROW_MAX_AGE = np.array([np.inf if row[3] is None else row[3] for row in _ROWS], dtype=np.float64)
+_ROW_LOW = np.array([np.nan if row[4] is None else row[4] for row in _ROWS], dtype=np.float64)
+_ROW_HIGH = np.array([np.nan if row[5] is None else row[5] for row in _ROWS], dtype=np.float64)
+
+# Adults are assumed when the report does not give an age
+DEFAULT_AGE = 30.0
+
+_NUMBER = r'\d+(?:,\d{2,3})*(?:\.\d+)?'
+RANGE_RE = re.compile(rf'({_NUMBER})\s*(?:-|to)\s*({_NUMBER})')
+BOUND_RE = re.compile(rf'(<=?|>=?|up\s*to|upto|less than|more than|below|above)\s*({_NUMBER})')
+# Tiers of a multi-part range are separated by ';', '|', a newline or a
+# comma that is not a thousands separator
+TIER_SPLIT_RE = re.compile(r'[;|\n]|,(?!\d)')
+NORMAL_TIER_RE = re.compile(r'(?<!near )(?<!above )(?<!borderline )'
+                            r'\b(?:normal|desirable|optimal|reference|healthy)\b')
+
+SEVERITIES = np.array(['mild', 'moderate', 'severe'])
+
+
+def to_number(value):
+    """Float from a number or numeric string ("1,50,000", "11.2 L"); NaN if there is none."""
+    if isinstance(value, bool):
+        return np.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.search(_NUMBER, str(value or ''))
+    return float(match.group(0).replace(',', '')) if match else np.nan
+
+
+def find_ranges(text):
+    """Every (low, high) range or one-sided bound written in `text`, in order."""
+    found = [(match.start(), to_number(match.group(1)), to_number(match.group(2)))
+             for match in RANGE_RE.finditer(text)]
+    # Blank out the ranges so "200 - 239" is not also read as a bound
+    rest = RANGE_RE.sub(lambda match: ' ' * len(match.group(0)), text)
+    for match in BOUND_RE.finditer(rest):
+        value = to_number(match.group(2))
+        lower = match.group(1).startswith(('>', 'more', 'above'))
+        found.append((match.start(), value if lower else None, None if lower else value))
+    return [(low, high) for _, low, high in sorted(found, key=lambda item: item[0])]
+
+
+def parse_reference_range(text):
+    """(low, high) from '13.0 - 17.0', '< 200', '>40' or 'up to 35'; None bounds are open.
+
+    Tiered ranges ("Desirable: < 200, Borderline: 200 - 239, High: >= 240")
+    give their normal or desirable tier. None when nothing parses or when
+    several ranges are printed (per sex, per risk tier) and none of them is
+    marked as the normal one.
+    """
+    text = str(text or '').lower().replace('–', '-').replace('—', '-')
+    ranges = find_ranges(text)
+    if len(ranges) > 1:
+        normal = [found for tier in TIER_SPLIT_RE.split(text) if NORMAL_TIER_RE.search(tier)
+                  for found in find_ranges(tier)]
+        ranges = normal if len(normal) == 1 else []
+    return ranges[0] if ranges else None
+
+
+def match_analyte(name):
+    """The Analyte a printed parameter name refers to, or None.
+
+    The name must be an alias plus at most qualifier words; "Glucose PP" or
+    "Hb A1c" start with an alias but are not that analyte.
+    """
+    text = ' '.join(str(name or '').lower().split())
+    match = ALIAS_RE.match(text)
+    if not match:
+        return None
+    analyte = ANALYTE_BY_ALIAS[match.group(1)]
+    return analyte if only_qualifiers(analyte, text[match.end():]) else None
+
+
+def only_qualifiers(analyte, text):
+    """True when `text`, following an alias of `analyte`, does not name another test."""
+    allowed = QUALIFIER_WORDS | _ALIAS_WORDS[analyte.name]
+    return all(word in allowed for word in re.findall(r'[a-z0-9]+', text))
+
+
+def normalize_unit(unit):
+    unit = str(unit or '').lower().replace(' ', '').replace('µ', 'u').replace('μ', 'u')
+    unit = unit.replace('cumm', 'ul').replace('mm3', 'ul').replace('mcl', 'ul').replace('×', 'x')
+    unit = unit.replace('10³', '10^3').replace('10⁶', '10^6').replace('10⁹', '10^9').replace('10¹²', '10^12')
+    return re.sub(r'^x?10\*', '10^', unit)
+
+
+def unit_factor(analyte, unit):
+    """Factor converting `unit` into the analyte's table unit; NaN if unknown or missing."""
+    unit = normalize_unit(unit)
+    if unit == analyte.unit:
+        return 1.0
+    return float(analyte.conversions.get(unit, np.nan))
+
+
+def sex_code(sex):
+    sex = str(sex or '').strip().lower()
+    return 1 if sex in ('m', 'male', 'man') else 2 if sex in ('f', 'female', 'woman') else 0
+
+
+def evaluate(parameters, sex=None, age=None):
+    """Status and severity of every report parameter, computed in one vectorized pass.
+
+    Each parameter is a dict with 'name', 'value', 'unit' and optionally
+    'reference_range'. The range printed on the report is used when it can
+    be parsed (it is in the value's own unit); otherwise the value is
+    converted to the analyte's table unit and compared with the range for
+    the patient's sex and age. The table is only used when the name is a
+    known analyte (see match_analyte) and the unit is its table unit or
+    converts to it; without a unit the scale is unknown. Returns (status, severity) arrays: status is
+    'low', 'high', 'normal' or '' when no range applies, severity is '' for
+    values inside their range.
+    """
+    n = len(parameters)
+    values = np.full(n, np.nan)
+    lows = np.full(n, np.nan)
+    highs = np.full(n, np.nan)
+    analyte_ids = np.full(n, -1)
+    factors = np.ones(n)
+    for i, parameter in enumerate(parameters):
+        values[i] = to_number(parameter.get('value'))
+        printed = parse_reference_range(parameter.get('reference_range'))
+        if printed is not None:
+            lows[i] = np.nan if printed[0] is None else printed[0]
+            highs[i] = np.nan if printed[1] is None else printed[1]
+            continue
+        analyte = match_analyte(parameter.get('name'))
+        if analyte is not None:
+            analyte_ids[i] = _ANALYTE_INDEX[analyte.name]
+            factors[i] = unit_factor(analyte, parameter.get('unit'))
+
+    # Table ranges for parameters without a printed one: the first row per
+    # parameter matching analyte, sex (or "either") and age
+    lookup = analyte_ids >= 0
+    if lookup.any():
+        patient_age = DEFAULT_AGE if np.isnan(to_number(age)) else to_number(age)
+        patient_sex = sex_code(sex)
+        matches = ((_ROW_ANALYTE[None, :] == analyte_ids[lookup, None])
+                   & ((_ROW_SEX == 0) | (_ROW_SEX == patient_sex))[None, :]
+                   & ((_ROW_MIN_AGE <= patient_age) & (patient_age < _ROW_MAX_AGE))[None, :])
+        found = matches.any(axis=1)
+        rows = matches.argmax(axis=1)
+        lows[lookup] = np.where(found, _ROW_LOW[rows], np.nan)
+        highs[lookup] = np.where(found, _ROW_HIGH[rows], np.nan)
+        values[lookup] = values[lookup] * factors[lookup]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        below = values < lows
+        above = values > highs
+        known = ~np.isnan(values) & ~(np.isnan(lows) & np.isnan(highs))
+        # Distance outside the range relative to its width, or to the bound when open-ended
+        width = highs - lows
+        scale = np.where(width > 0, width, np.abs(np.where(below, lows, highs)))
+        distance = np.where(below, lows - values, np.where(above, values - highs, 0.0))
+        ratio = np.where(scale > 0, distance / scale, 1.0)
+    status = np.where(below, 'low', np.where(above, 'high', np.where(known, 'normal', '')))
+    severity = np.where(below | above, SEVERITIES[(ratio >= 0.25).astype(int) + (ratio >= 1.0)], '')
+    return status, severity
+
+
+def annotate_report(result):
+    """Set the status of numeric parameters locally and reconcile abnormal_findings with it.
+
+    Only parameters evaluate() could check are overridden: their findings are
+    dropped when in range and get the computed severity otherwise, and
+    abnormal ones without a finding get one from the analyte table. Rows it
+    cannot check (qualitative results such as "Positive" against "Negative",
+    unknown analytes without a printed range) keep the LLM's status and
+    findings.
+    """
+    parameters = [p for p in result.get('parameters', []) if isinstance(p, dict)]
+    if not parameters:
+        return result
+    patient = result.get('patient_info') if isinstance(result.get('patient_info'), dict) else {}
+    status, severity = evaluate(parameters, patient.get('gender'), patient.get('age'))
+
+    checked = {}
+    for parameter, s, level in zip(parameters, status.tolist(), severity.tolist()):
+        if s:
+            parameter['status'] = s
+            checked[str(parameter.get('name', '')).lower()] = (parameter, level)
+        elif not parameter.get('status'):
+            parameter['status'] = 'unknown'
+
+    findings = []
+    for finding in result.get('abnormal_findings', []):
+        key = str(finding.get('parameter', '')).lower() if isinstance(finding, dict) else ''
+        if key not in checked:
+            # Not a parameter the engine could check; keep the LLM's finding
+            findings.append(finding)
+            continue
+        parameter, level = checked.pop(key)
+        if parameter['status'] in ('low', 'high'):
+            finding['severity'] = level
+            findings.append(finding)
+    for parameter, level in checked.values():
+        if parameter['status'] not in ('low', 'high'):
+            continue
+        analyte = match_analyte(parameter.get('name'))
+        meaning = (analyte.low_meaning if parameter['status'] == 'low' else analyte.high_meaning) if analyte else \
+            'is outside the reference range'
+        findings.append({
+            "parameter": parameter.get('name', ''),
+            "interpretation": f"{parameter['status'].capitalize()} {parameter.get('name', '')} {meaning}",
+            "severity": level,
+        })
+    result['abnormal_findings'] = findings
+    return result
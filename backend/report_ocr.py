@@ -0,0 +1,232 @@
+import os
+import re
+from collections import namedtuple
+
+from PIL import ImageOps
+
+from metrics import span
+from reference_ranges import (ALIAS_RE, ANALYTE_BY_ALIAS, BOUND_RE, NORMAL_TIER_RE, RANGE_RE, evaluate, find_ranges,
+                              only_qualifiers, to_number)
+
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+# Cleared when the tesseract binary turns out to be missing; the module stays
+# bound so threads already inside read_report are unaffected
+_tesseract_available = pytesseract is not None
+
+# Local tier for printed lab reports: OCR, then a table parser for known
+# panels. A report is answered locally when confidence reaches
+# REPORT_OCR_MIN_CONFIDENCE; otherwise the LLM gets the OCR text (if it
+# reads well enough) instead of the image. REPORT_OCR=0 turns it off.
+OCR_ENABLED = os.environ.get('REPORT_OCR', '1') != '0'
+MIN_CONFIDENCE = float(os.environ.get('REPORT_OCR_MIN_CONFIDENCE', '0.8'))
+MIN_TEXT_CONFIDENCE = float(os.environ.get('REPORT_OCR_MIN_TEXT_CONFIDENCE', '0.6'))
+MIN_PARAMETERS = int(os.environ.get('REPORT_OCR_MIN_PARAMETERS', '4'))
+# Tesseract: LSTM engine, one uniform block of text (keeps table rows on one line)
+TESSERACT_CONFIG = os.environ.get('REPORT_OCR_CONFIG', '--oem 1 --psm 6')
+# Scans are resized to roughly this width; Tesseract reads ~300 dpi text best
+OCR_WIDTH = int(os.environ.get('REPORT_OCR_WIDTH', '2000'))
+
+LocalReport = namedtuple('LocalReport', ['text', 'ocr_confidence', 'confidence', 'result'])
+
+PANEL_NAMES = {
+    'cbc': 'Complete Blood Count',
+    'cmp': 'Comprehensive Metabolic Panel',
+    'lipid': 'Lipid Profile',
+}
+
+_NUMBER = r'\d+(?:,\d{2,3})*(?:\.\d+)?'
+# A standalone number: not part of a unit like 10^3/uL or of a word
+_VALUE_RE = re.compile(rf'(?<![\w^.,/])({_NUMBER})(?![\w^])')
+# "Borderline:" or "High risk:" just before a printed range
+_TIER_LABEL_RE = re.compile(r'([a-z][a-z ]*)\s*:\s*$')
+_FLAG_RE = re.compile(r'(?<![\w/])(h|l|high|low|\*)(?![\w/])')
+_UNIT_RE = re.compile(r'(?<![\w])((?:x\s*)?10\^?\d+/\w+|/?[a-zµμ%][\w/%.^µμ]*)')
+
+_DATE_RE = re.compile(r'(?:date|collected|reported|sample)[^:\n]*:\s*'
+                      r'(\d{1,2}[-/.]\d{1,2}[-/.]\d{2,4}|\d{4}-\d{2}-\d{2}|\d{1,2}[ -][a-z]{3}[a-z]*[ -]\d{2,4})')
+_PATIENT_RES = {
+    'name': re.compile(r'(?:patient\s*name|name)\s*:\s*(?:mr\.?|mrs\.?|ms\.?)?\s*([a-z][a-z .]+?)(?:\s{2,}|\s+(?:age|sex|gender)\b|$)'),
+    'age': re.compile(r'age\s*(?:/\s*(?:sex|gender))?\s*:\s*(\d{1,3})'),
+    'gender': re.compile(r'(?:sex|gender)\s*:\s*(male|female|m|f)\b|\d{1,3}\s*(?:y|yrs?|years)?\s*/\s*(male|female|m|f)\b'),
+    'id': re.compile(r'(?:patient\s*id|reg(?:istration)?\.?\s*no|uhid|lab\s*no)\.?\s*:\s*([\w/-]+)'),
+}
+
+
+def parse_parameter_line(line):
+    """Parse one table row ("Hemoglobin  11.2 L  g/dL  13.0 - 17.0").
+
+    Returns (analyte, parameter dict or None) for rows naming a known
+    analyte, None for other lines (including tests that only start like
+    one, "Glucose PP"). The parameter is None when the row
+    could not be read completely, or when its reference is tiered (several
+    ranges or bounds, or one labelled as other than the normal tier) and
+    so is left to the LLM.
+    """
+    text = ' '.join(line.lower().replace('–', '-').replace('—', '-').split())
+    match = ALIAS_RE.match(text)
+    if not match:
+        return None
+    analyte = ANALYTE_BY_ALIAS[match.group(1)]
+    rest = text[match.end():].lstrip(' :.')
+    # Drop a parenthesised abbreviation: "Hemoglobin (Hb) 13.5"
+    rest = re.sub(r'^\([^)]*\)\s*', '', rest)
+    # "Glucose PP" or "Bilirubin Direct" only start like a known analyte
+    # (a unit such as "g/dL" may come before the value)
+    name_words = [word for word in re.split(r'\d', rest, maxsplit=1)[0].split() if '/' not in word]
+    if not only_qualifiers(analyte, ' '.join(name_words)):
+        return None
+
+    if len(find_ranges(rest)) != 1:
+        return analyte, None
+    reference = RANGE_RE.search(rest) or BOUND_RE.search(rest)
+    label = _TIER_LABEL_RE.search(rest[:reference.start()])
+    if label and not NORMAL_TIER_RE.search(label.group(1)):
+        return analyte, None
+    rest = rest[:reference.start()] + ' ' + rest[reference.end():]
+    value = _VALUE_RE.search(rest)
+    if value is None:
+        return analyte, None
+    after = rest[value.end():]
+    flag = _FLAG_RE.search(after)
+    unit = _UNIT_RE.search(_FLAG_RE.sub(' ', after) if flag else after)
+    return analyte, {
+        "name": analyte.name,
+        "value": to_number(value.group(1)),
+        "unit": unit.group(1) if unit else "",
+        "reference_range": reference.group(0),
+        "flag": flag.group(1)[0] if flag and flag.group(1) != '*' else "",
+    }
+
+
+def _patient_info(text):
+    info = {}
+    for key, pattern in _PATIENT_RES.items():
+        match = pattern.search(text)
+        if match:
+            info[key] = next(group for group in match.groups() if group).strip().title()
+    return info
+
+
+def parse_report_text(text):
+    """Build a medical-report result from OCR text.
+
+    Returns (result, coverage): coverage is the fraction of rows naming a
+    known analyte that parsed completely. result is None when fewer than
+    MIN_PARAMETERS parameters were found, i.e. not a layout parsed here.
+    """
+    parameters = []
+    panels = {}
+    seen = set()
+    rows = 0
+    for line in text.splitlines():
+        parsed = parse_parameter_line(line)
+        if parsed is None:
+            continue
+        analyte, parameter = parsed
+        if analyte.name in seen:
+            continue
+        rows += 1
+        if parameter is None:
+            continue
+        seen.add(analyte.name)
+        parameters.append((analyte, parameter))
+
+    lowered = text.lower()
+    patient_info = _patient_info(lowered)
+    status, severity = evaluate([parameter for _, parameter in parameters],
+                                patient_info.get('gender'), patient_info.get('age'))
+    checked = []
+    for (analyte, parameter), s, level in zip(parameters, status.tolist(), severity.tolist()):
+        flag = parameter.pop('flag')
+        if flag and s != ('high' if flag == 'h' else 'low'):
+            # The lab's own H/L marker disagrees with the parsed numbers: misread row
+            continue
+        parameter['status'] = s
+        checked.append((analyte, parameter, level))
+        panels[analyte.panel] = panels.get(analyte.panel, 0) + 1
+
+    if len(checked) < MIN_PARAMETERS:
+        return None, 0.0
+
+    abnormal = [(analyte, parameter, level) for analyte, parameter, level in checked if parameter['status'] != 'normal']
+    abnormal_findings = [{
+        "parameter": analyte.name,
+        "interpretation": f"{parameter['status'].capitalize()} {analyte.name} "
+                          f"{analyte.low_meaning if parameter['status'] == 'low' else analyte.high_meaning}",
+        "severity": level,
+    } for analyte, parameter, level in abnormal]
+
+    # Only what the numbers show; interpretation is left to a clinician
+    if abnormal:
+        listed = ', '.join(f"{analyte.name} ({parameter['status']})" for analyte, parameter, _ in abnormal)
+        summary = f"{len(abnormal)} of {len(checked)} parameters are outside the reference range: {listed}."
+    else:
+        summary = f"All {len(checked)} parameters are within the reference ranges printed on the report."
+
+    date = _DATE_RE.search(lowered)
+    result = {
+        "report_type": ' / '.join(PANEL_NAMES[panel] for panel in sorted(panels, key=panels.get, reverse=True)),
+        "patient_info": patient_info,
+        "test_date": date.group(1) if date else "",
+        "parameters": [parameter for _, parameter, _ in checked],
+        "abnormal_findings": abnormal_findings,
+        "summary": summary,
+        "recommendations": ["Please consult with a healthcare professional to interpret these results"],
+        "extraction": "ocr",
+    }
+    return result, len(checked) / rows
+
+
+def _ocr(image):
+    """(text, mean word confidence 0..1) from Tesseract."""
+    image = ImageOps.autocontrast(ImageOps.grayscale(image))
+    if image.width > OCR_WIDTH * 1.25 or image.width < OCR_WIDTH / 2:
+        scale = OCR_WIDTH / image.width
+        image = image.resize((OCR_WIDTH, max(1, int(image.height * scale))))
+    data = pytesseract.image_to_data(image, config=TESSERACT_CONFIG, output_type=pytesseract.Output.DICT)
+    lines = {}
+    confidences = []
+    for word, conf, block, par, line in zip(data['text'], data['conf'], data['block_num'],
+                                            data['par_num'], data['line_num']):
+        if not word.strip():
+            continue
+        lines.setdefault((block, par, line), []).append(word)
+        if float(conf) >= 0:
+            confidences.append(float(conf) / 100)
+    text = '\n'.join(' '.join(words) for _, words in sorted(lines.items()))
+    return text, sum(confidences) / len(confidences) if confidences else 0.0
+
+
+def read_report(image):
+    """Run the local tier on a decoded report image.
+
+    Returns None when OCR is unavailable. Otherwise `result` is set when the
+    report was read confidently enough to skip the LLM, and `text` when the
+    OCR output is good enough to send to the LLM in place of the image.
+    """
+    global _tesseract_available
+    if not OCR_ENABLED or not _tesseract_available:
+        return None
+    try:
+        with span('ocr'):
+            text, ocr_confidence = _ocr(image)
+    except pytesseract.TesseractNotFoundError:
+        print("Tesseract is not installed; medical reports go straight to the LLM")
+        _tesseract_available = False
+        return None
+    except Exception as e:
+        print(f"Error running OCR on report: {str(e)}")
+        return None
+
+    with span('report_parse'):
+        result, coverage = parse_report_text(text)
+    confidence = ocr_confidence * coverage
+    return LocalReport(
+        text=text if ocr_confidence >= MIN_TEXT_CONFIDENCE else '',
+        ocr_confidence=ocr_confidence,
+        confidence=confidence,
+        result=result if result is not None and confidence >= MIN_CONFIDENCE else None,
+    )
@@ -0,0 +1,194 @@
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+# Spellings and lay terms mapped to one name so equivalent complaints share
+# a cached answer. Only true equivalents belong here: the canonical form is
+# the cache key, and related but distinct complaints (migraine, chest
+# tightness, weakness) must not share an answer with a broader one.
+SYMPTOM_SYNONYMS = {
+    'high temperature': 'fever',
+    'pyrexia': 'fever',
+    'feverish': 'fever',
+    'coughing': 'cough',
+    'headaches': 'headache',
+    'head ache': 'headache',
+    'head pain': 'headache',
+    'runny nose': 'rhinorrhea',
+    'running nose': 'rhinorrhea',
+    'blocked nose': 'nasal congestion',
+    'stuffy nose': 'nasal congestion',
+    'throat pain': 'sore throat',
+    'tiredness': 'fatigue',
+    'tired': 'fatigue',
+    'exhaustion': 'fatigue',
+    'shortness of breath': 'dyspnea',
+    'breathlessness': 'dyspnea',
+    'difficulty breathing': 'dyspnea',
+    'short of breath': 'dyspnea',
+    'throwing up': 'vomiting',
+    'vomit': 'vomiting',
+    'nauseous': 'nausea',
+    'loose motions': 'diarrhea',
+    'loose stools': 'diarrhea',
+    'diarrhoea': 'diarrhea',
+    'stomach ache': 'abdominal pain',
+    'stomach pain': 'abdominal pain',
+    'tummy ache': 'abdominal pain',
+    'belly pain': 'abdominal pain',
+    'body ache': 'myalgia',
+    'body aches': 'myalgia',
+    'muscle pain': 'myalgia',
+    'muscle aches': 'myalgia',
+    'joint pain': 'arthralgia',
+    'joint aches': 'arthralgia',
+    'dizzy': 'dizziness',
+    'giddiness': 'dizziness',
+    'rashes': 'rash',
+    'skin rash': 'rash',
+    'itching': 'pruritus',
+    'itchy skin': 'pruritus',
+    'loss of appetite': 'poor appetite',
+    'burning urination': 'dysuria',
+    'painful urination': 'dysuria',
+    'excessive thirst': 'polydipsia',
+    'palpitation': 'palpitations',
+    'racing heart': 'palpitations',
+    'loss of smell': 'anosmia',
+    'loss of taste': 'ageusia',
+    'back ache': 'back pain',
+    'backache': 'back pain',
+}
+
+_NON_WORD_RE = re.compile(r'[^a-z0-9\s]+')
+
+# Age ranges that change the differential; exact ages within one are treated alike
+AGE_BUCKETS = (
+    (2, '0-1'),
+    (13, '2-12'),
+    (18, '13-17'),
+    (40, '18-39'),
+    (65, '40-64'),
+    (None, '65+'),
+)
+
+_GENDERS = {
+    'm': 'male', 'male': 'male', 'man': 'male', 'boy': 'male',
+    'f': 'female', 'female': 'female', 'woman': 'female', 'girl': 'female',
+    'other': 'other', 'non-binary': 'other', 'nonbinary': 'other', 'non binary': 'other',
+    'intersex': 'other', 'transgender': 'other',
+}
+# Patients whose age or gender was not given, or cannot be read, share this
+# bucket instead of being grouped with a real one ('Not specified' with
+# 'other', an age of 'nan' with '65+')
+UNKNOWN = 'unknown'
+
+
+def canonical_symptom(name):
+    """Normalize one symptom: ' Loose  Motions!' -> 'diarrhea'."""
+    text = ' '.join(_NON_WORD_RE.sub(' ', str(name).lower()).split())
+    return SYMPTOM_SYNONYMS.get(text, text)
+
+
+def canonical_symptoms(symptoms):
+    """Lowercased, synonym-mapped, deduplicated and sorted symptom list."""
+    return sorted({s for s in (canonical_symptom(name) for name in symptoms) if s})
+
+
+def age_bucket(age):
+    try:
+        age = float(str(age).strip())
+    except (TypeError, ValueError):
+        return UNKNOWN
+    if not math.isfinite(age) or age < 0:
+        return UNKNOWN
+    for upper, label in AGE_BUCKETS:
+        if upper is None or age < upper:
+            return label
+
+
+def canonical_patient_info(patient_info):
+    """Bucket the patient details that key cached symptom answers."""
+    patient_info = patient_info or {}
+    gender = str(patient_info.get('gender') or '').strip().lower()
+    conditions = patient_info.get('existingConditions') or ''
+    if isinstance(conditions, str):
+        conditions = conditions.split(',')
+    conditions = canonical_symptoms(conditions)
+    return {
+        'age': age_bucket(patient_info.get('age')),
+        'gender': _GENDERS.get(gender, UNKNOWN),
+        'existingConditions': ', '.join(conditions) if conditions else 'None',
+    }
+
+
+class SymptomIndex:
+    """Nearest-neighbour lookup over symptom sets that already have a cached answer.
+
+    Sets are compared by Jaccard similarity, only within the same patient
+    group (age bucket, gender, existing conditions). An inverted index from
+    symptom to entries keeps the candidate scan small. `threshold` <= 0
+    disables neighbour matching; entries expire after `ttl` seconds.
+    """
+
+    def __init__(self, threshold=0.0, ttl=6 * 3600, max_entries=5000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._by_symptom = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def add(self, key, group, symptoms):
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            self._entries[key] = (group, frozenset(symptoms), time.time())
+            for symptom in symptoms:
+                self._by_symptom[symptom].add(key)
+            while len(self._entries) > self.max_entries:
+                self._discard(next(iter(self._entries)))
+
+    def _discard(self, key):
+        _, symptoms, _ = self._entries.pop(key)
+        for symptom in symptoms:
+            keys = self._by_symptom[symptom]
+            keys.discard(key)
+            if not keys:
+                del self._by_symptom[symptom]
+
+    def nearest(self, group, symptoms):
+        """Return [(similarity, key, symptoms)] at or above the threshold, best first."""
+        if self.threshold <= 0:
+            return []
+        query = frozenset(symptoms)
+        now = time.time()
+        matches = []
+        with self._lock:
+            candidates = set()
+            for symptom in query:
+                candidates.update(self._by_symptom.get(symptom, ()))
+            for key in candidates:
+                entry_group, entry_symptoms, created_at = self._entries[key]
+                if now - created_at >= self.ttl:
+                    self._discard(key)
+                    continue
+                if entry_group != group:
+                    continue
+                similarity = len(query & entry_symptoms) / len(query | entry_symptoms)
+                if similarity >= self.threshold:
+                    matches.append((similarity, key, sorted(entry_symptoms)))
+        matches.sort(reverse=True)
+        return matches
+
+
+def create_symptom_index():
+    """Build the neighbour index from SYMPTOM_* environment variables."""
+    return SymptomIndex(
+        threshold=float(os.environ.get('SYMPTOM_NEIGHBOR_THRESHOLD', '0')),
+        ttl=float(os.environ.get('SYMPTOM_CACHE_TTL', str(6 * 3600))),
+        max_entries=int(os.environ.get('SYMPTOM_INDEX_SIZE', '5000')),
+    )
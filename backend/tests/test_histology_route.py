@@ -0,0 +1,62 @@
+"""/api/classify_histology upload limits: python -m pytest backend/tests"""
+import functools
+import io
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('LLM_BACKEND', 'stub')
+os.environ.setdefault('REPORT_OCR', '0')
+os.environ.setdefault('RESULT_CACHE_PATH', '')
+os.environ.setdefault('INTERACTION_DB_PATH', '')
+os.environ.setdefault('JOB_STORE_PATH', ':memory:')
+
+import api  # noqa: E402
+import uploads  # noqa: E402
+
+
+class FakeBatcher:
+    def predict(self, images):
+        return [{"label": "benign", "size": list(image.size)} for image in images]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(api, 'get_batcher', FakeBatcher)
+    return api.app.test_client()
+
+
+def _upload(client, size):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'white').save(buffer, format='PNG')
+    buffer.seek(0)
+    return client.post('/api/classify_histology', data={'file': (buffer, 'tile.png')},
+                       content_type='multipart/form-data')
+
+
+def test_tile_is_classified(client):
+    response = _upload(client, (32, 24))
+
+    assert response.status_code == 200
+    assert response.get_json() == {"label": "benign", "size": [32, 24], "filename": "tile.png"}
+
+
+def test_decompression_bomb_is_413(client, monkeypatch):
+    # Pillow errors out above twice this many pixels
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 100)
+
+    response = _upload(client, (32, 32))
+
+    assert response.status_code == 413
+
+
+def test_oversized_upload_is_413(client, monkeypatch):
+    monkeypatch.setattr(api, 'read_upload', functools.partial(uploads.read_upload, max_bytes=10))
+
+    response = _upload(client, (32, 32))
+
+    assert response.status_code == 413
+    assert response.get_json() == {"error": uploads.UPLOAD_LIMIT_MESSAGE}
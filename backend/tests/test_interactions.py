@@ -0,0 +1,77 @@
+"""Drug-interaction memo: python -m pytest backend/tests"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from interactions import InteractionStore, canonical_drug_name  # noqa: E402
+
+PAIRS = [('Metformin', 'Aspirin'), ('Metformin', 'Warfarin'), ('Aspirin', 'Warfarin')]
+
+
+@pytest.mark.parametrize('name, expected', [
+    ("Tab. Glycomet-SR 500mg", 'metformin'),
+    ("Metformin Hydrochloride 500 mg", 'metformin'),
+    ("Amlodipine Besylate 5mg", 'amlodipine'),
+    ("Crocin 650", 'paracetamol'),
+    ("Augmentin 625 Duo", 'augmentin duo'),
+    ("AMOXYCLAV 625", 'amoxicillin clavulanate'),
+    # Combination products are not their first ingredient
+    ("Telma H 40", 'telma h'),
+    ("Pan-D", 'pan d'),
+    ("Tab Telma 40", 'telmisartan'),
+    # Metal ions are the active part; counter-ions are not
+    ("Potassium Chloride Syrup", 'potassium chloride'),
+    ("Calcium Carbonate 500mg", 'calcium carbonate'),
+    ("Salbutamol Sulphate Inhaler", 'salbutamol inhaler'),
+])
+def test_canonical_drug_name(name, expected):
+    assert canonical_drug_name(name) == expected
+
+
+def test_record_maps_answers_to_pairs():
+    store = InteractionStore(None)
+    answers = [
+        {"pair": 2, "interacts": True, "severity": "severe", "effect": "Bleeding risk",
+         "drugs": ["wrong", "names"]},
+        {"pair": 1, "interacts": False},
+        # Pair 3 skipped; invalid indexes are not stored
+        {"pair": 0, "interacts": False},
+        {"pair": True, "interacts": False},
+        {"pair": "3", "interacts": False},
+        {"pair": 7, "interacts": True, "drugs": ["Aspirin", "Warfarin"], "severity": "moderate"},
+    ]
+
+    interactions = store.record(PAIRS, answers)
+
+    assert interactions == [
+        {"severity": "severe", "effect": "Bleeding risk", "drugs": ["Metformin", "Warfarin"]},
+        # Unindexed positive answers are returned, not remembered
+        {"drugs": ["Aspirin", "Warfarin"], "severity": "moderate"},
+    ]
+    known, missing = store.lookup(["Glycomet 500", "Ecosprin 75", "Coumadin"])
+    assert missing == [('Ecosprin 75', 'Coumadin')]
+    assert known == [{"severity": "severe", "effect": "Bleeding risk", "drugs": ["Glycomet 500", "Coumadin"]}]
+
+
+def test_memory_tier_is_bounded_lru():
+    store = InteractionStore(None, max_entries=2)
+    store.record(PAIRS[:2], [{"pair": 1, "interacts": False}, {"pair": 2, "interacts": False}])
+    # Touch the first pair so the second is the least recently used
+    store.lookup(['Metformin', 'Aspirin'])
+
+    store.record(PAIRS[2:], [{"pair": 1, "interacts": False}])
+
+    assert len(store._memory) == 2
+    assert store.lookup(['Metformin', 'Aspirin'])[1] == []
+    assert store.lookup(['Metformin', 'Warfarin'])[1] == [('Metformin', 'Warfarin')]
+
+
+def test_expired_answers_are_asked_again():
+    store = InteractionStore(None, ttl=0)
+    store.record(PAIRS[:1], [{"pair": 1, "interacts": False}])
+
+    assert store.lookup(['Metformin', 'Aspirin'])[1] == [('Aspirin', 'Metformin')]
+    assert len(store._memory) == 0
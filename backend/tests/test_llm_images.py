@@ -0,0 +1,65 @@
+"""Image parts sent to Gemini: python -m pytest backend/tests"""
+import io
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_images import ImageBudget, encode_for_llm, to_8bit  # noqa: E402
+
+BUDGET = ImageBudget(max_pixels=256 * 256, format='JPEG', quality=90)
+
+
+def _png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _decode(part):
+    return np.asarray(Image.open(io.BytesIO(part['data'])).convert('L'))
+
+
+def test_16bit_png_is_windowed_not_clipped():
+    # 12-bit gradient (0..4095) stored as a 16-bit PNG
+    gradient = np.tile(np.linspace(0, 4095, 128).astype(np.uint16), (32, 1))
+    data = _png(Image.fromarray(gradient))
+    image = Image.open(io.BytesIO(data))
+
+    part = encode_for_llm(image, BUDGET, data)
+
+    assert part['mime_type'] == 'image/jpeg'
+    pixels = _decode(part)
+    # convert('L') would leave ~94% of these at 255
+    assert (pixels >= 250).mean() < 0.1
+    assert pixels[:, :8].mean() < 20 and pixels[:, -8:].mean() > 235
+
+
+def test_float_and_flat_images_rescale():
+    ramp = np.linspace(-1.0, 1.0, 64, dtype=np.float32).reshape(8, 8)
+    scaled = np.asarray(to_8bit(Image.fromarray(ramp)))
+    assert scaled.dtype == np.uint8 and scaled.min() == 0 and scaled.max() == 255
+
+    flat = to_8bit(Image.fromarray(np.full((4, 4), 1000, dtype=np.int32)))
+    assert flat.mode == 'L' and np.asarray(flat).max() == 0
+
+
+def test_8bit_png_under_budget_passes_through():
+    data = _png(Image.new('RGB', (64, 64), (10, 200, 30)))
+
+    part = encode_for_llm(Image.open(io.BytesIO(data)), BUDGET, data)
+
+    assert part == {'mime_type': 'image/png', 'data': data}
+
+
+def test_png_over_budget_is_resized_and_reencoded():
+    data = _png(Image.new('RGB', (512, 512), 'white'))
+
+    part = encode_for_llm(Image.open(io.BytesIO(data)), BUDGET, data)
+
+    assert part['mime_type'] == 'image/jpeg'
+    width, height = Image.open(io.BytesIO(part['data'])).size
+    assert width * height <= BUDGET.max_pixels
@@ -0,0 +1,143 @@
+"""Parsing and repairing LLM JSON output: python -m pytest backend/tests"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from json_stream import IncrementalJSONParser  # noqa: E402
+from llm_json import LLMJSONError, field, parse_llm_json, validate  # noqa: E402
+from metrics import PARSE_FAILURES, PARSE_REPAIRS  # noqa: E402
+
+REPORT = {
+    "report_type": "Complete Blood Count",
+    "parameters": [
+        {"name": "Hemoglobin", "value": "11.2", "unit": "g/dL", "reference_range": "13.0 - 17.0"},
+        {"name": "Platelet Count", "value": "2,50,000", "unit": "/cumm", "reference_range": "[150000, 410000]"},
+    ],
+    "abnormal_findings": [],
+    "summary": "One value {low}; see \"notes\" [1].",
+}
+SCHEMA = {
+    'report_type': field(str),
+    'parameters': field(list, items=dict),
+    'abnormal_findings': field(list, required=False, default=[]),
+    'summary': field(str, required=False, default=""),
+    'recommendations': field(list, required=False, default=[]),
+}
+
+
+def _repairs(stage):
+    return {kind: count for (s, kind), count in PARSE_REPAIRS._values.items() if s == stage}
+
+
+def test_clean_json_needs_no_repair():
+    assert parse_llm_json(json.dumps(REPORT), stage='test_clean') == REPORT
+    assert _repairs('test_clean') == {}
+
+
+@pytest.mark.parametrize('text', [
+    "```json\n{body}\n```",
+    "```\n{body}\n```",
+    "Here is the analysis:\n```json\n{body}\n```\nLet me know if you need more.",
+    "Sure! {body} Hope this helps.",
+])
+def test_fences_and_prose_are_ignored(text):
+    assert parse_llm_json(text.replace('{body}', json.dumps(REPORT, indent=2))) == REPORT
+
+
+def test_trailing_commas_are_dropped():
+    text = '{"a": [1, 2, 3,], "b": {"c": "x, }",}, "d": [],}'
+
+    assert parse_llm_json(text, stage='test_commas') == {"a": [1, 2, 3], "b": {"c": "x, }"}, "d": []}
+    assert _repairs('test_commas') == {'trailing_comma': 1}
+
+
+def test_brackets_inside_strings_do_not_close_the_object():
+    text = 'Result: {"summary": "range [4.0, 11.0] } and {unclosed", "quote": "say \\"}\\""} trailing {junk}'
+
+    assert parse_llm_json(text) == {"summary": "range [4.0, 11.0] } and {unclosed", "quote": 'say "}"'}
+
+
+def test_truncated_object_keeps_complete_elements():
+    text = json.dumps(REPORT)
+    cut = text.index('"Platelet Count"') + 10
+
+    value = parse_llm_json(text[:cut], stage='test_truncated')
+
+    assert value['report_type'] == REPORT['report_type']
+    assert value['parameters'][0] == REPORT['parameters'][0]
+    assert all(p.get('name') != 'Platelet Count' for p in value['parameters'])
+    assert _repairs('test_truncated') == {'truncated': 1}
+
+
+def test_truncated_inside_a_string_keeps_the_partial_text():
+    assert parse_llm_json('{"summary": "Values are within') == {"summary": "Values are within"}
+
+
+@pytest.mark.parametrize('text', ["", "No JSON here", '{"a": 1]', "[1, 2, 3]"])
+def test_unusable_responses_raise(text):
+    before = PARSE_FAILURES._values.get(('test_failures',), 0)
+    with pytest.raises(LLMJSONError):
+        parse_llm_json(text, schema=SCHEMA, stage='test_failures')
+    assert PARSE_FAILURES._values[('test_failures',)] == before + 1
+
+
+def test_schema_fills_defaults_and_drops_mistyped_items():
+    value = parse_llm_json(json.dumps({
+        "report_type": "CBC",
+        "parameters": [{"name": "Hemoglobin"}, "Platelets: 2.5 lakh", None],
+        "abnormal_findings": "none",
+        "summary": None,
+    }), schema=SCHEMA, stage='test_schema')
+
+    assert value == {"report_type": "CBC", "parameters": [{"name": "Hemoglobin"}],
+                     "abnormal_findings": [], "summary": "", "recommendations": []}
+    assert _repairs('test_schema') == {'dropped_items': 1, 'default': 3}
+
+
+def test_schema_defaults_are_not_shared():
+    first = validate({"report_type": "a", "parameters": []}, SCHEMA)
+    first['recommendations'].append("Drink water")
+
+    second = validate({"report_type": "b", "parameters": []}, SCHEMA)
+
+    assert second['recommendations'] == []
+
+
+def test_schema_reports_every_required_problem():
+    with pytest.raises(LLMJSONError) as error:
+        parse_llm_json('{"report_type": 3}', schema=SCHEMA)
+    assert "'report_type' is of the wrong type" in str(error.value)
+    assert "'parameters' is missing" in str(error.value)
+
+
+@pytest.mark.parametrize('size', [1, 2, 7, 64])
+def test_incremental_parser_events_do_not_depend_on_chunking(size):
+    text = "```json\n" + json.dumps(REPORT, indent=2) + "\n```"
+    parser = IncrementalJSONParser()
+
+    events = []
+    for i in range(0, len(text), size):
+        events.extend(parser.feed(text[i:i + size]))
+
+    assert events == [
+        {"event": "field", "field": "report_type", "value": REPORT['report_type']},
+        {"event": "item", "field": "parameters", "value": REPORT['parameters'][0]},
+        {"event": "item", "field": "parameters", "value": REPORT['parameters'][1]},
+        {"event": "field", "field": "summary", "value": REPORT['summary']},
+    ]
+    assert parser.done
+    assert parser.result(SCHEMA) == dict(REPORT, recommendations=[])
+
+
+def test_incremental_parser_result_repairs_a_cut_stream():
+    parser = IncrementalJSONParser()
+    text = json.dumps(REPORT)
+    events = parser.feed(text[:text.index('"Platelet Count"')])
+
+    assert [event['event'] for event in events] == ['field', 'item']
+    assert not parser.done
+    assert parser.result()['parameters'] == REPORT['parameters'][:1]
@@ -0,0 +1,52 @@
+"""Enhancement options of the medical image analysis: python -m pytest backend/tests"""
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('LLM_BACKEND', 'stub')
+os.environ.setdefault('REPORT_OCR', '0')
+os.environ.setdefault('RESULT_CACHE_PATH', '')
+os.environ.setdefault('INTERACTION_DB_PATH', '')
+os.environ.setdefault('JOB_STORE_PATH', ':memory:')
+
+import api  # noqa: E402
+
+
+@pytest.mark.parametrize('raw, expected', [
+    ('["contrast", "sharpen"]', ['contrast', 'sharpen']),
+    ('[]', []),
+    (None, []),
+    ('', []),
+    ('contrast', []),
+    ('["contrast",', []),
+    ('{"contrast": true}', []),
+    ('[1, 2]', []),
+    ('"contrast"', []),
+])
+def test_parse_enhancements(raw, expected):
+    assert api.parse_enhancements(raw) == expected
+
+
+@pytest.fixture
+def analyzed(monkeypatch):
+    calls = []
+
+    def analyze(image_data, enhancements=None):
+        calls.append(enhancements)
+        return {"analysis": "ok"}
+    monkeypatch.setattr(api, 'analyze_medical_image', analyze)
+    return calls
+
+
+@pytest.mark.parametrize('raw', ['["denoise"', '{"denoise": 1}'])
+def test_sync_route_and_job_agree_on_malformed_enhancements(analyzed, raw):
+    client = api.app.test_client()
+    response = client.post('/api/analyze_medical_image', content_type='multipart/form-data',
+                           data={'file': (io.BytesIO(b'image'), 'scan.png'), 'enhancements': raw})
+
+    assert response.status_code == 200
+    assert api.JOB_HANDLERS['medical_image'](b'image', {'enhancements': raw}) == {"analysis": "ok"}
+    assert analyzed == [[], []]
@@ -0,0 +1,173 @@
+"""Prescription DAG against a fake Gemini backend: python -m pytest backend/tests"""
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Offline, memory-only stores; set before api creates them at import
+os.environ.setdefault('LLM_BACKEND', 'stub')
+os.environ.setdefault('REPORT_OCR', '0')
+os.environ.setdefault('RESULT_CACHE_PATH', '')
+os.environ.setdefault('INTERACTION_DB_PATH', '')
+os.environ.setdefault('JOB_STORE_PATH', ':memory:')
+
+import api  # noqa: E402
+import pipeline  # noqa: E402
+from cache import ResultCache  # noqa: E402
+from interactions import InteractionStore  # noqa: E402
+from llm import LLMClient  # noqa: E402
+
+# Which stage a prompt belongs to, and what the fake model answers
+STAGE_MATCHES = {
+    'extract': 'expert medical transcriptionist',
+    'diseases': 'list of medications prescribed to a patient',
+    'interactions': 'pharmacology expert',
+}
+RESPONSES = {
+    'extract': {
+        "patient_name": "Test Patient", "patient_age": "42y", "patient_gender": "Male",
+        "medications": [{"name": "Metformin", "dosage": "500 mg"}, {"name": "Aspirin", "dosage": "75 mg"}],
+    },
+    'diseases': {"possible_diseases": [{"name": "Type 2 diabetes mellitus", "probability": "high"}]},
+    'interactions': {"interactions": [{"pair": 1, "interacts": True, "severity": "mild",
+                                       "effect": "Additive effect", "recommendation": "Monitor"}]},
+}
+
+
+class FakeGemini:
+    """LLMClient backend answering by prompt, with per-stage latency and failures.
+
+    Tracks how many calls were in flight at once, so tests can tell whether
+    the follow-up stages overlapped.
+    """
+
+    def __init__(self, delays=None, failures=None):
+        self.delays = delays or {}
+        self.failures = failures or {}
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def _stage(self, contents):
+        prompt = contents[0] if isinstance(contents, list) else contents
+        return next(stage for stage, match in STAGE_MATCHES.items() if match in prompt)
+
+    def generate(self, contents, model_name, generation_config, timeout):
+        stage = self._stage(contents)
+        with self._lock:
+            self.calls.append(stage)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delays.get(stage, 0))
+            if stage in self.failures:
+                raise self.failures[stage]
+            return json.dumps(RESPONSES[stage])
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def generate_stream(self, contents, model_name, generation_config, timeout):
+        yield self.generate(contents, model_name, generation_config, timeout)
+
+
+@pytest.fixture
+def fake_gemini(monkeypatch):
+    """Install a FakeGemini as the API's LLM, with fresh memory-only stores."""
+    def install(**kwargs):
+        backend = FakeGemini(**kwargs)
+        monkeypatch.setattr(api, 'llm', LLMClient(backend, max_retries=0))
+        monkeypatch.setattr(api, 'result_cache', ResultCache(None))
+        monkeypatch.setattr(api, 'interaction_store', InteractionStore(None))
+        return backend
+    return install
+
+
+@pytest.fixture(scope='module')
+def image_data():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), 'white').save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def test_follow_up_stages_run_concurrently(fake_gemini, image_data):
+    backend = fake_gemini(delays={'extract': 0.05, 'diseases': 0.3, 'interactions': 0.3})
+
+    start = time.perf_counter()
+    result = api.get_prescription_information(image_data)
+    elapsed = time.perf_counter() - start
+
+    assert backend.calls[0] == 'extract'
+    assert sorted(backend.calls[1:]) == ['diseases', 'interactions']
+    assert backend.max_active == 2
+    # extract + max(diseases, interactions), not their sum (0.65s)
+    assert elapsed < 0.55
+    assert result['possible_diseases'][0]['name'] == "Type 2 diabetes mellitus"
+    assert result['drug_interactions'][0]['drugs'] == ['Aspirin', 'Metformin']
+
+
+def test_stage_timeout_falls_back_without_waiting(fake_gemini, image_data, monkeypatch):
+    monkeypatch.setitem(pipeline.STAGE_TIMEOUTS, 'diseases', 0.1)
+    fake_gemini(delays={'diseases': 1.0, 'interactions': 0.05})
+
+    start = time.perf_counter()
+    result = api.get_prescription_information(image_data)
+    elapsed = time.perf_counter() - start
+
+    assert elapsed < 0.6
+    assert result['possible_diseases'] == []
+    assert len(result['drug_interactions']) == 1
+
+
+def test_extract_failure_returns_error_result(fake_gemini, image_data):
+    backend = fake_gemini(failures={'extract': ValueError("model unavailable")})
+
+    result = api.get_prescription_information(image_data)
+
+    assert backend.calls == ['extract']
+    assert result['medications'] == []
+    assert "model unavailable" in result['additional_notes']
+    # Failed extractions are not cached, so the next request tries again
+    assert api.result_cache.stats()['memory_entries'] == 0
+
+
+def test_follow_up_failure_keeps_other_stage(fake_gemini, image_data):
+    fake_gemini(failures={'interactions': ValueError("quota exceeded")})
+
+    result = api.get_prescription_information(image_data)
+
+    assert result['drug_interactions'] == []
+    assert len(result['possible_diseases']) == 1
+
+
+def test_stage_errors_reach_the_pipeline():
+    def failing(_):
+        raise RuntimeError("boom")
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        result, ok = pipeline.run_prescription_pipeline(
+            b'image',
+            extract=lambda _: {"medications": [{"name": "A"}, {"name": "B"}]},
+            predict_diseases=lambda _: [{"name": "X"}],
+            get_interactions=failing,
+            on_extract_failure=lambda message: {"error": message},
+            executor=executor,
+        )
+        assert ok
+        assert result['possible_diseases'] == [{"name": "X"}]
+        assert result['drug_interactions'] == []
+
+        result, ok = pipeline.run_prescription_pipeline(
+            b'image', extract=failing, predict_diseases=failing, get_interactions=failing,
+            on_extract_failure=lambda message: {"error": message}, executor=executor,
+        )
+        assert not ok
+        assert result == {"error": "Prescription stage 'extract' failed: boom"}
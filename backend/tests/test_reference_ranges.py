@@ -0,0 +1,118 @@
+"""Local reference-range engine: python -m pytest backend/tests"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reference_ranges import annotate_report, evaluate, match_analyte, parse_reference_range  # noqa: E402
+
+LIPID_TIERS = "Desirable: < 200, Borderline: 200 - 239, High: >= 240"
+
+
+@pytest.mark.parametrize('text, expected', [
+    ("13.0 - 17.0", (13.0, 17.0)),
+    ("4.0 to 11.0", (4.0, 11.0)),
+    ("1,50,000 - 4,10,000", (150000.0, 410000.0)),
+    ("< 200", (None, 200.0)),
+    (">40", (40.0, None)),
+    ("up to 35", (None, 35.0)),
+    (LIPID_TIERS, (None, 200.0)),
+    ("Optimal: <100; Near optimal: 100-129; High: 160-189", (None, 100.0)),
+    # Several ranges and none marked as the normal one
+    ("M: 13 - 17 F: 12 - 15.5", None),
+    ("Negative", None),
+    ("", None),
+])
+def test_parse_reference_range(text, expected):
+    assert parse_reference_range(text) == expected
+
+
+def _status(parameters, sex=None, age=None):
+    return evaluate(parameters, sex, age)[0].tolist()
+
+
+def test_evaluate_uses_sex_and_age_rows():
+    hemoglobin = [{"name": "Hemoglobin", "value": 12.5, "unit": "g/dL"}]
+    assert _status(hemoglobin, 'male', 40) == ['low']
+    assert _status(hemoglobin, 'Female', 40) == ['normal']
+
+    wbc = [{"name": "WBC Count", "value": "12.5", "unit": "10^3/uL"}]
+    assert _status(wbc, None, 40) == ['high']
+    assert _status(wbc, None, 8) == ['normal']
+    # No age on the report: adult ranges
+    assert _status(wbc) == ['high']
+
+
+def test_evaluate_converts_units():
+    parameters = [
+        {"name": "Hemoglobin", "value": 125, "unit": "g/L"},
+        {"name": "Glucose", "value": 7.2, "unit": "mmol/L"},
+        {"name": "Platelet Count", "value": "1,20,000", "unit": "cells/cumm"},
+        {"name": "Creatinine", "value": 80, "unit": "µmol/L"},
+    ]
+    assert _status(parameters, 'female', 50) == ['normal', 'high', 'low', 'normal']
+
+
+def test_evaluate_prefers_the_printed_range():
+    status, severity = evaluate([
+        {"name": "Total Cholesterol", "value": 220, "unit": "mg/dL", "reference_range": LIPID_TIERS},
+        {"name": "Hemoglobin", "value": 12.5, "unit": "g/dL", "reference_range": "12.0 - 15.5"},
+        {"name": "HDL Cholesterol", "value": 30, "unit": "mg/dL", "reference_range": "> 40"},
+    ], 'male', 40)
+    assert status.tolist() == ['high', 'normal', 'low']
+    assert severity.tolist() == ['mild', '', 'moderate']
+
+
+@pytest.mark.parametrize('name, value, unit', [
+    ("Hb A1c", 6.8, "%"),
+    ("HbA1c", 6.8, ""),
+    ("CA 19-9", 20, ""),
+    ("Bilirubin Direct", 0.9, "mg/dL"),
+    ("Glucose PP", 130, "mg/dL"),
+    ("Blood Glucose Random", 130, "mg/dL"),
+    ("Hemoglobin", 135, ""),
+    ("Hemoglobin", 13.5, "mg/L"),
+])
+def test_evaluate_skips_names_and_units_it_cannot_check(name, value, unit):
+    assert _status([{"name": name, "value": value, "unit": unit}], 'male', 40) == ['']
+
+
+def test_match_analyte_allows_qualifiers_only():
+    assert match_analyte("Creatinine, Serum").name == 'Creatinine'
+    assert match_analyte("Hemoglobin (Hb)").name == 'Hemoglobin'
+    assert match_analyte("Bilirubin Total").name == 'Total Bilirubin'
+    assert match_analyte("Cholesterol HDL") is None
+    assert match_analyte("Vitamin D") is None
+
+
+def test_annotate_report_reconciles_findings():
+    result = {
+        "patient_info": {"gender": "Male", "age": "45"},
+        "parameters": [
+            # LLM said high; in range for a man
+            {"name": "Hemoglobin", "value": "14.2", "unit": "g/dL", "status": "high"},
+            {"name": "Glucose", "value": "110", "unit": "mg/dL", "reference_range": "70 - 99", "status": "normal"},
+            {"name": "HbA1c", "value": "6.8", "unit": "%", "status": "high"},
+            {"name": "Urine Protein", "value": "Positive", "reference_range": "Negative"},
+        ],
+        "abnormal_findings": [
+            {"parameter": "Hemoglobin", "interpretation": "High hemoglobin", "severity": "severe"},
+            {"parameter": "HbA1c", "interpretation": "Diabetic range", "severity": "moderate"},
+        ],
+    }
+
+    annotate_report(result)
+
+    assert [p['status'] for p in result['parameters']] == ['normal', 'high', 'high', 'unknown']
+    findings = {f['parameter']: f for f in result['abnormal_findings']}
+    assert set(findings) == {'HbA1c', 'Glucose'}
+    # The LLM's finding for a parameter the engine cannot check is kept as is
+    assert findings['HbA1c']['severity'] == 'moderate'
+    assert findings['Glucose']['severity'] == 'moderate'
+    assert findings['Glucose']['interpretation'].startswith("High Glucose may indicate diabetes")
+
+
+def test_annotate_report_without_parameters():
+    assert annotate_report({"summary": "No values"}) == {"summary": "No values"}
@@ -0,0 +1,129 @@
+"""Table parser of the local report tier: python -m pytest backend/tests"""
+import os
+import sys
+import types
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import report_ocr  # noqa: E402
+from report_ocr import parse_parameter_line, parse_report_text  # noqa: E402
+
+CBC_ROWS = [
+    "Hemoglobin (Hb) 11.2 L g/dL 13.0 - 17.0",
+    "Total RBC 4.1 million/cumm 4.5 - 5.5",
+    "Total WBC 11,800 H cells/cumm 4000 - 11000",
+    "Platelet Count 2,50,000 /cumm 150000 - 410000",
+    "PCV 42 % 40 - 50",
+]
+CMP_ROWS = [
+    "Glucose Fasting 112 H mg/dL 70 - 100",
+    "Creatinine, Serum 0.9 mg/dL 0.7 - 1.3",
+    "Sodium (Na+) 139 mmol/L 135 - 145",
+    "SGPT 62 U/L up to 55",
+]
+LIPID_ROWS = [
+    "Total Cholesterol 230 mg/dL < 200",
+    "HDL Cholesterol 38 mg/dL > 40",
+    "Triglycerides 140 mg/dL Normal: < 150",
+]
+
+
+@pytest.mark.parametrize('line, expected', [
+    (CBC_ROWS[0], {"name": "Hemoglobin", "value": 11.2, "unit": "g/dl", "reference_range": "13.0 - 17.0",
+                   "flag": "l"}),
+    (CBC_ROWS[2], {"name": "WBC Count", "value": 11800.0, "unit": "cells/cumm", "reference_range": "4000 - 11000",
+                   "flag": "h"}),
+    (CBC_ROWS[3], {"name": "Platelet Count", "value": 250000.0, "unit": "/cumm",
+                   "reference_range": "150000 - 410000", "flag": ""}),
+    (CMP_ROWS[0], {"name": "Glucose", "value": 112.0, "unit": "mg/dl", "reference_range": "70 - 100", "flag": "h"}),
+    (CMP_ROWS[1], {"name": "Creatinine", "value": 0.9, "unit": "mg/dl", "reference_range": "0.7 - 1.3",
+                   "flag": ""}),
+    (CMP_ROWS[3], {"name": "ALT", "value": 62.0, "unit": "u/l", "reference_range": "up to 55", "flag": ""}),
+    (LIPID_ROWS[0], {"name": "Total Cholesterol", "value": 230.0, "unit": "mg/dl", "reference_range": "< 200",
+                     "flag": ""}),
+    (LIPID_ROWS[2], {"name": "Triglycerides", "value": 140.0, "unit": "mg/dl", "reference_range": "< 150",
+                     "flag": ""}),
+])
+def test_parse_parameter_line(line, expected):
+    analyte, parameter = parse_parameter_line(line)
+    assert analyte.name == expected['name']
+    assert parameter == expected
+
+
+@pytest.mark.parametrize('line', [
+    "Total Cholesterol 230 mg/dL Desirable: < 200, Borderline: 200 - 239, High: >= 240",
+    "LDL Cholesterol 150 mg/dL Optimal <100 Near optimal 100-129 Borderline 130-159",
+    "HDL Cholesterol 38 mg/dL High risk: < 40",
+    "Hemoglobin 13.5 g/dL M: 13 - 17 F: 12 - 15.5",
+    "Hemoglobin g/dL 13.0 - 17.0",
+])
+def test_tiered_or_incomplete_rows_go_to_the_llm(line):
+    analyte, parameter = parse_parameter_line(line)
+    assert analyte is not None
+    assert parameter is None
+
+
+@pytest.mark.parametrize('line', [
+    "Glucose PP 130 mg/dL 70 - 140",
+    "Bilirubin Direct 0.2 mg/dL 0.0 - 0.3",
+    "Hb A1c 6.1 % 4.0 - 5.6",
+    "Vitamin B12 300 pg/mL 200 - 900",
+    "Patient Name: Test Patient",
+])
+def test_other_lines_are_not_parameters(line):
+    assert parse_parameter_line(line) is None
+
+
+def test_parse_report_text():
+    text = '\n'.join(["Patient Name: Test Patient   Age/Sex: 45 Y / Male", "Collected On: 12/03/2024",
+                      *CBC_ROWS, *CMP_ROWS, *LIPID_ROWS,
+                      "LDL Cholesterol 150 mg/dL Optimal <100 Near optimal 100-129 Borderline 130-159"])
+
+    result, coverage = parse_report_text(text)
+
+    # The tiered LDL row counts against coverage but is not reported
+    assert coverage == pytest.approx(12 / 13)
+    assert result['patient_info'] == {"name": "Test Patient", "age": "45", "gender": "Male"}
+    assert result['test_date'] == "12/03/2024"
+    assert result['report_type'].startswith("Complete Blood Count")
+    statuses = {p['name']: p['status'] for p in result['parameters']}
+    assert statuses == {
+        "Hemoglobin": "low", "RBC Count": "low", "WBC Count": "high", "Platelet Count": "normal",
+        "Hematocrit": "normal", "Glucose": "high", "Creatinine": "normal", "Sodium": "normal", "ALT": "high",
+        "Total Cholesterol": "high", "HDL Cholesterol": "low", "Triglycerides": "normal",
+    }
+    assert {f['parameter'] for f in result['abnormal_findings']} == {
+        name for name, status in statuses.items() if status != 'normal'}
+
+
+def test_parse_report_text_needs_enough_rows():
+    assert parse_report_text('\n'.join(CBC_ROWS[:2])) == (None, 0.0)
+
+
+def test_missing_tesseract_turns_ocr_off(monkeypatch):
+    class NotFound(OSError):
+        pass
+
+    class FakeTesseract:
+        Output = types.SimpleNamespace(DICT='dict')
+        TesseractNotFoundError = NotFound
+        calls = 0
+
+        @classmethod
+        def image_to_data(cls, image, config, output_type):
+            cls.calls += 1
+            raise NotFound()
+
+    monkeypatch.setattr(report_ocr, 'OCR_ENABLED', True)
+    monkeypatch.setattr(report_ocr, 'pytesseract', FakeTesseract)
+    monkeypatch.setattr(report_ocr, '_tesseract_available', True)
+    image = Image.new('RGB', (400, 300), 'white')
+
+    assert report_ocr.read_report(image) is None
+    assert report_ocr.read_report(image) is None
+    assert FakeTesseract.calls == 1
+    # The module stays bound for threads already past the availability check
+    assert report_ocr.pytesseract is FakeTesseract
@@ -0,0 +1,32 @@
+"""Canonical symptom-checker inputs: python -m pytest backend/tests"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from symptoms import age_bucket, canonical_patient_info, canonical_symptoms  # noqa: E402
+
+
+@pytest.mark.parametrize('age, expected', [
+    (0, '0-1'), ("1", '0-1'), (34, '18-39'), ("35.5", '18-39'), (64.9, '40-64'), (90, '65+'),
+    (None, 'unknown'), ("", 'unknown'), ("nan", 'unknown'), ("inf", 'unknown'), (-1, 'unknown'),
+    ("forty", 'unknown'),
+])
+def test_age_bucket(age, expected):
+    assert age_bucket(age) == expected
+
+
+@pytest.mark.parametrize('gender, expected', [
+    ("M", 'male'), (" Female ", 'female'), ("Non-binary", 'other'), ("Other", 'other'),
+    (None, 'unknown'), ("", 'unknown'), ("Not specified", 'unknown'), ("Prefer not to say", 'unknown'),
+])
+def test_gender_bucket(gender, expected):
+    assert canonical_patient_info({"gender": gender})['gender'] == expected
+
+
+def test_canonical_patient_info():
+    assert canonical_patient_info({"age": "34", "gender": "f", "existingConditions": "Asthma, high BP ,asthma"}) == {
+        'age': '18-39', 'gender': 'female', 'existingConditions': ', '.join(canonical_symptoms(['asthma', 'high bp']))}
+    assert canonical_patient_info(None) == {'age': 'unknown', 'gender': 'unknown', 'existingConditions': 'None'}
@@ -0,0 +1,124 @@
+import io
+import os
+import tempfile
+import zipfile
+
+from flask import Request
+from PIL import Image
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from metrics import span
+
+# Uploads larger than this are rejected with 413 before they are parsed
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', str(25 * 1024 * 1024)))
+
+# Multipart file parts stay in memory up to this size, then spill to a temp file
+UPLOAD_SPILL_BYTES = int(os.environ.get('UPLOAD_SPILL_BYTES', str(8 * 1024 * 1024)))
+
+UPLOAD_LIMIT_MESSAGE = f"File exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit"
+
+# Batch uploads: files per request and total bytes after unpacking zips
+MAX_BATCH_FILES = int(os.environ.get('MAX_BATCH_FILES', '100'))
+MAX_BATCH_BYTES = int(os.environ.get('MAX_BATCH_BYTES', str(200 * 1024 * 1024)))
+# Request body limit for batch routes: the batch plus room for multipart headers
+MAX_BATCH_BODY_BYTES = MAX_BATCH_BYTES + MAX_BATCH_FILES * 4096
+
+BATCH_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff', '.heic')
+
+
+class UploadTooLarge(RequestEntityTooLarge):
+    description = UPLOAD_LIMIT_MESSAGE
+
+
+class UploadRequest(Request):
+    """Keeps multipart file parts in memory unless they are very large.
+
+    Werkzeug's default writes any request over 500 KB to a temporary file,
+    which is most phone photos and scans.
+
+    Endpoints in `body_limits` accept bodies larger than MAX_CONTENT_LENGTH
+    (the batch route); read_upload still holds each file to its own limit.
+    """
+
+    body_limits = {}
+
+    @property
+    def max_content_length(self):
+        limit = self.body_limits.get(self.endpoint)
+        return limit if limit is not None else super().max_content_length
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPILL_BYTES, mode='rb+')
+
+
+def read_upload(file, max_bytes=MAX_UPLOAD_BYTES):
+    """Read an uploaded FileStorage into bytes without touching the upload folder."""
+    with span('upload'):
+        file.stream.seek(0)
+        data = file.stream.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise UploadTooLarge()
+    return data
+
+
+def _zip_entries(archive, max_bytes):
+    for info in archive.infolist():
+        name = info.filename
+        base = os.path.basename(name)
+        if info.is_dir() or name.startswith('__MACOSX/') or base.startswith('.'):
+            continue
+        if not base.lower().endswith(BATCH_IMAGE_EXTENSIONS):
+            continue
+        if info.file_size > max_bytes:
+            raise UploadTooLarge()
+        with archive.open(info) as f:
+            # file_size comes from the archive itself, so cap the read as well
+            data = f.read(max_bytes + 1)
+        if len(data) > max_bytes:
+            raise UploadTooLarge()
+        yield name, data
+
+
+def _expand(file):
+    # A zip may be as large as the whole batch; a single image only as large as one upload
+    data = read_upload(file, MAX_BATCH_BYTES)
+    if not zipfile.is_zipfile(io.BytesIO(data)):
+        if len(data) > MAX_UPLOAD_BYTES:
+            raise UploadTooLarge()
+        yield file.filename, data
+        return
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            yield from _zip_entries(archive, MAX_UPLOAD_BYTES)
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"Invalid zip archive '{file.filename}': {e}") from e
+
+
+def read_batch(files, max_files=MAX_BATCH_FILES, max_bytes=MAX_BATCH_BYTES):
+    """Read a multi-file upload into (name, bytes) pairs, unpacking any zip archives.
+
+    Raises ValueError for an empty or oversized batch and UploadTooLarge
+    when a single image or the unpacked total is over its limit.
+    """
+    uploads = []
+    total = 0
+    for file in files:
+        # Entries are unpacked one at a time, so limits stop a zip bomb early
+        for name, data in _expand(file):
+            total += len(data)
+            if total > max_bytes:
+                raise UploadTooLarge(f"Batch exceeds the {max_bytes // (1024 * 1024)} MB limit")
+            if len(uploads) == max_files:
+                raise ValueError(f"Batch exceeds the {max_files} file limit")
+            uploads.append((name, data))
+    if not uploads:
+        raise ValueError("No prescription images in the upload")
+    return uploads
+
+
+def open_image(data):
+    """Decode image bytes (or a memoryview of them) into a PIL image."""
+    with span('decode'):
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    return image
@@ -0,0 +1,91 @@
+"""Compare the fused enhancement engine with the original enhance_image.
+
+    python benchmarks/bench_enhance.py [--threads 4]
+
+Runs every enhancement combination on the test-samples images (plus one
+synthetic 4000x3000 X-ray-sized image) and reports latency for the original
+PIL/BGR-swapping implementation, the fused engine at full resolution and the
+fused engine in fast (downscaled) denoise mode.
+"""
+import argparse
+import glob
+import itertools
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from PIL import Image, ImageEnhance
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'backend'))
+
+from enhance import ENHANCEMENTS, enhance_image  # noqa: E402
+
+
+def legacy_enhance_image(img, enhancements):
+    """The enhance_image implementation before the fused engine, kept for comparison."""
+    enhanced_img = img.copy()
+    if 'contrastBoost' in enhancements:
+        enhanced_img = ImageEnhance.Contrast(enhanced_img).enhance(1.5)
+    if 'noiseReduction' in enhancements:
+        cv_img = cv2.cvtColor(np.array(enhanced_img), cv2.COLOR_RGB2BGR)
+        cv_img = cv2.fastNlMeansDenoisingColored(cv_img, None, 10, 10, 7, 21)
+        enhanced_img = Image.fromarray(cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB))
+    if 'edgeEnhancement' in enhancements:
+        cv_img = cv2.cvtColor(np.array(enhanced_img), cv2.COLOR_RGB2BGR)
+        gaussian = cv2.GaussianBlur(cv_img, (0, 0), 3.0)
+        cv_img = cv2.addWeighted(cv_img, 1.5, gaussian, -0.5, 0)
+        enhanced_img = Image.fromarray(cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB))
+    return enhanced_img
+
+
+def load_images():
+    images = {}
+    for path in sorted(glob.glob(os.path.join(ROOT, 'test-samples', '*'))):
+        images[os.path.basename(path)] = Image.open(path).convert('RGB')
+    rng = np.random.default_rng(0)
+    base = cv2.GaussianBlur(rng.integers(0, 256, (3000, 4000), dtype=np.uint8), (0, 0), 8)
+    noisy = np.clip(base.astype(np.int16) + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+    images['synthetic-4000x3000'] = Image.fromarray(noisy).convert('RGB')
+    return images
+
+
+def timeit(fn, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) * 1000 / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeats', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=4,
+                        help="Also time the fast engine over all images in a thread pool")
+    args = parser.parse_args()
+
+    images = load_images()
+    combos = [c for n in range(1, 4) for c in itertools.combinations(ENHANCEMENTS, n)]
+
+    print(f"{'image':28s} {'enhancements':45s} {'legacy':>9s} {'full':>9s} {'fast':>9s}  ms")
+    for name, image in images.items():
+        for combo in combos:
+            legacy = timeit(lambda: legacy_enhance_image(image, combo), args.repeats)
+            full = timeit(lambda: enhance_image(image, combo, mode='full'), args.repeats)
+            fast = timeit(lambda: enhance_image(image, combo, mode='fast'), args.repeats)
+            print(f"{name:28s} {'+'.join(combo):45s} {legacy:9.1f} {full:9.1f} {fast:9.1f}")
+
+    # OpenCV releases the GIL, so concurrent requests should overlap
+    work = [(image, ENHANCEMENTS) for image in images.values()] * args.threads
+    serial = timeit(lambda: [enhance_image(i, e, mode='fast') for i, e in work], 1)
+    with ThreadPoolExecutor(args.threads) as pool:
+        threaded = timeit(lambda: list(pool.map(lambda w: enhance_image(w[0], w[1], mode='fast'), work)), 1)
+    print(f"\nall enhancements, {len(work)} images: serial {serial:.1f} ms, "
+          f"{args.threads} threads {threaded:.1f} ms ({serial / threaded:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Payload size and latency of the images sent to the LLM, per endpoint budget.
+
+    python benchmarks/bench_llm_images.py            # offline: encode time + payload size
+    python benchmarks/bench_llm_images.py --live     # also call Gemini (needs GOOGLE_API_KEY)
+
+Each test sample is encoded the way the SDK would send the raw PIL image
+(PNG for non-JPEG inputs) and under several budgets. With --live, every
+variant is sent with the endpoint's prompt and the parsed JSON is compared
+with the full-resolution answer (share of matching leaf values).
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'backend'))
+
+from llm_images import IMAGE_BUDGETS, ImageBudget, encode_for_llm  # noqa: E402
+
+SAMPLES = {
+    'prescriptions-test.jpg': ('prescription', 'PRESCRIPTION_PROMPT'),
+    'report-analysis-test.jpg': ('medical_report', 'MEDICAL_REPORT_PROMPT'),
+    'image-analysis-test.png': ('medical_image', 'MEDICAL_IMAGE_PROMPT'),
+}
+
+
+def variants(endpoint):
+    default = IMAGE_BUDGETS[endpoint]
+    return {
+        f'budget ({default.format} q{default.quality}, {default.max_pixels / 1e6:.1f}MP)': default,
+        'JPEG q75, 1.0MP': ImageBudget(1024 * 1024, 'JPEG', 75),
+        'WEBP q80, same pixels': ImageBudget(default.max_pixels, 'WEBP', 80),
+    }
+
+
+def sdk_payload(image, data):
+    # google-generativeai sends JPEG uploads as-is and re-encodes everything else as PNG
+    if image.format == 'JPEG':
+        return {'mime_type': 'image/jpeg', 'data': data}
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return {'mime_type': 'image/png', 'data': buffer.getvalue()}
+
+
+def leaves(value, prefix=''):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            yield from leaves(v, f'{prefix}.{k}')
+    elif isinstance(value, list):
+        for i, v in enumerate(value):
+            yield from leaves(v, f'{prefix}[{i}]')
+    else:
+        yield prefix, str(value).strip().lower()
+
+
+def agreement(reference, candidate):
+    ref, cand = dict(leaves(reference)), dict(leaves(candidate))
+    if not ref:
+        return 0.0
+    return sum(1 for k, v in ref.items() if cand.get(k) == v) / len(ref)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--live', action='store_true')
+    args = parser.parse_args()
+
+    api = None
+    if args.live:
+        import api  # noqa: F401  (configures the shared LLM client)
+
+    for filename, (endpoint, prompt_name) in SAMPLES.items():
+        with open(os.path.join(ROOT, 'test-samples', filename), 'rb') as f:
+            data = f.read()
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        print(f"\n{filename} ({image.size[0]}x{image.size[1]}, {len(data) / 1024:.0f} KB) -> {endpoint}")
+
+        payloads = {'as uploaded (SDK default)': (sdk_payload(image, data), 0.0)}
+        for name, budget in variants(endpoint).items():
+            start = time.perf_counter()
+            part = encode_for_llm(image, budget)
+            payloads[name] = (part, (time.perf_counter() - start) * 1000)
+
+        reference = None
+        for name, (part, encode_ms) in payloads.items():
+            line = f"  {name:40s} {len(part['data']) / 1024:8.0f} KB  encode {encode_ms:7.1f} ms"
+            if api is not None:
+                start = time.perf_counter()
+                text = api.llm.generate([getattr(api, prompt_name), part], temperature=0.2)
+                call_ms = (time.perf_counter() - start) * 1000
+                try:
+                    result = json.loads(text[text.find('{'):text.rfind('}') + 1])
+                except ValueError:
+                    result = {}
+                if reference is None:
+                    reference = result
+                line += f"  llm {call_ms:8.0f} ms  agreement {agreement(reference, result):5.1%}"
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Decode + preprocess cost of the histology pipeline relative to the ViT forward pass.
+
+    python benchmarks/bench_preprocess.py --batch-size 32
+
+Compares the per-image torchvision transform chain used at training time with
+the batched uint8 preprocessor, and times a CPU forward pass at the same batch
+size (random weights, so no checkpoint is needed).
+"""
+import argparse
+import glob
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'model'))
+
+from predictor import ViTForCancerClassification, class_names, transform  # noqa: E402
+from preprocessing import BatchPreprocessor, fold_normalization  # noqa: E402
+
+
+def load_inputs(batch_size, synthetic_size):
+    """Encoded JPEG bytes for the test samples plus synthetic large tiles."""
+    blobs = []
+    for path in sorted(glob.glob(os.path.join(ROOT, 'test-samples', '*'))):
+        with open(path, 'rb') as f:
+            blobs.append(f.read())
+    rng = np.random.default_rng(0)
+    while len(blobs) < batch_size:
+        pixels = rng.integers(0, 256, (synthetic_size, synthetic_size, 3), dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format='JPEG', quality=90)
+        blobs.append(buffer.getvalue())
+    return blobs[:batch_size]
+
+
+def timeit(fn, repeats):
+    fn()  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) * 1000 / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--synthetic-size', type=int, default=1024)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    blobs = load_inputs(args.batch_size, args.synthetic_size)
+
+    def per_image():
+        torch.stack([transform(Image.open(io.BytesIO(b)).convert('RGB')) for b in blobs])
+
+    batched = BatchPreprocessor(args.batch_size, threads=args.threads)
+    batched_draft = BatchPreprocessor(args.batch_size, threads=args.threads, draft=True)
+    cast_only = BatchPreprocessor(args.batch_size, threads=args.threads, normalize=False)
+
+    results = {
+        'per-image PIL transforms': timeit(per_image, args.repeats),
+        'batched uint8 buffer': timeit(lambda: batched([io.BytesIO(b) for b in blobs]), args.repeats),
+        'batched + JPEG draft decode': timeit(lambda: batched_draft([io.BytesIO(b) for b in blobs]), args.repeats),
+        'batched, normalization folded': timeit(lambda: cast_only([io.BytesIO(b) for b in blobs]), args.repeats),
+    }
+
+    model = ViTForCancerClassification(len(class_names), pretrained=False).eval()
+    batch = batched([io.BytesIO(b) for b in blobs])
+    with torch.inference_mode():
+        forward_ms = timeit(lambda: model(batch), max(1, args.repeats // 2))
+
+    # Folding must not change the outputs
+    folded = ViTForCancerClassification(len(class_names), pretrained=False).eval()
+    folded.load_state_dict(model.state_dict())
+    fold_normalization(folded)
+    with torch.inference_mode():
+        delta = (model(batch) - folded(cast_only([io.BytesIO(b) for b in blobs]))).abs().max().item()
+
+    print(f"batch={args.batch_size} synthetic={args.synthetic_size}px threads={args.threads}")
+    for name, ms in results.items():
+        print(f"{name:32s} {ms:9.1f} ms/batch {ms / args.batch_size:7.2f} ms/img "
+              f"{100 * ms / forward_ms:6.1f}% of forward")
+    print(f"{'ViT-B/16 forward (CPU)':32s} {forward_ms:9.1f} ms/batch {forward_ms / args.batch_size:7.2f} ms/img")
+    print(f"folded-normalization max logit delta: {delta:.2e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Cost of histology test-time augmentation: one batched pass vs one call per view.
+
+    python benchmarks/bench_tta.py --batch-size 8 --views 8
+
+Times a CPU forward pass (random weights, so no checkpoint is needed) of
+the plain batch, of all TTA views stacked into one batch, and of the same
+views sent as separate forward calls.
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'model'))
+
+from calibration import TTA_VIEWS, augment_views  # noqa: E402
+from predictor import ViTForCancerClassification, class_names  # noqa: E402
+
+
+def timeit(fn, repeats):
+    fn()  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) * 1000 / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--views', type=int, default=8, choices=[2, 4, 8])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=torch.get_num_threads())
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    model = ViTForCancerClassification(len(class_names), pretrained=False).eval()
+    batch = torch.randn(args.batch_size, 3, 224, 224)
+
+    def run(x):
+        with torch.inference_mode():
+            return model(x)
+
+    def separate():
+        for quarter_turns, flip in TTA_VIEWS[:args.views]:
+            view = torch.rot90(batch, quarter_turns, dims=(2, 3))
+            run(torch.flip(view, dims=(3,)) if flip else view)
+
+    plain = timeit(lambda: run(batch), args.repeats)
+    batched = timeit(lambda: run(augment_views(batch, args.views)), args.repeats)
+    calls = timeit(separate, args.repeats)
+    n = args.batch_size
+    print(f"no TTA                      {plain:9.1f} ms  ({plain / n:7.1f} ms/tile)")
+    print(f"{args.views} views, one batched pass  {batched:9.1f} ms  ({batched / n:7.1f} ms/tile)")
+    print(f"{args.views} views, separate calls    {calls:9.1f} ms  ({calls / n:7.1f} ms/tile)")
+    print(f"batched speedup over separate calls: {calls / batched:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
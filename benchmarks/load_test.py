@@ -0,0 +1,194 @@
+"""Requests/sec and latency of the API under gunicorn at several serving settings.
+
+    python benchmarks/load_test.py                                # default sweep
+    python benchmarks/load_test.py --settings gthread:2:16 sync:4:1 --latency-ms 1500
+
+Each setting (worker_class:workers:threads) starts gunicorn with
+backend/gunicorn.conf.py against the stub LLM (LLM_BACKEND=stub) with
+--latency-ms of simulated Gemini latency, then drives it with
+--concurrency parallel clients. Every request is made unique (symptom
+lists get a counter, uploads get trailing bytes), so the result cache
+never answers and each request really waits on the stub.
+"""
+import argparse
+import io
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(ROOT, 'backend')
+SAMPLES = os.path.join(ROOT, 'test-samples')
+
+DEFAULT_SETTINGS = ['sync:4:1', 'gthread:2:4', 'gthread:2:16', 'gthread:4:16']
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def multipart(field, filename, data, content_type='image/jpeg'):
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; '
+               f'filename="{filename}"\r\nContent-Type: {content_type}\r\n\r\n'.encode())
+    body.write(data)
+    body.write(f'\r\n--{boundary}--\r\n'.encode())
+    return body.getvalue(), f'multipart/form-data; boundary={boundary}'
+
+
+class Scenario:
+    """Builds the n-th request of a load test; `kind` is symptoms, prescription, report or mixed."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        with open(os.path.join(SAMPLES, 'prescriptions-test.jpg'), 'rb') as f:
+            self.prescription = f.read()
+        with open(os.path.join(SAMPLES, 'report-analysis-test.jpg'), 'rb') as f:
+            self.report = f.read()
+
+    def request(self, base_url, n):
+        kind = self.kind if self.kind != 'mixed' else ('symptoms', 'prescription', 'report')[n % 3]
+        if kind == 'symptoms':
+            body = json.dumps({"symptoms": ["fever", "cough", f"load test {n}"]}).encode()
+            return urllib.request.Request(f'{base_url}/api/analyze_symptoms', body,
+                                          {'Content-Type': 'application/json'})
+        # JPEG decoders ignore bytes after the end-of-image marker; they only change the cache key
+        image = self.prescription if kind == 'prescription' else self.report
+        body, content_type = multipart('file', f'{kind}-{n}.jpg', image + f'load-test-{n}'.encode())
+        path = '/api/process_prescription' if kind == 'prescription' else '/api/analyze_medical_report'
+        return urllib.request.Request(f'{base_url}{path}', body, {'Content-Type': content_type})
+
+
+def start_server(setting, port, args):
+    worker_class, workers, threads = setting.split(':')
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        GUNICORN_WORKER_CLASS=worker_class,
+        WEB_CONCURRENCY=workers,
+        GUNICORN_THREADS=threads,
+        LLM_BACKEND='stub',
+        LLM_STUB_LATENCY_MS=str(args.latency_ms),
+        LLM_STUB_JITTER_MS=str(args.jitter_ms),
+        LLM_MAX_CONCURRENCY=str(max(int(threads), 1) * 2),
+        PRELOAD_HISTOLOGY='1' if args.preload_histology else '0',
+        REPORT_OCR='0',
+        # Fresh stores per run, so one setting never warms the next
+        RESULT_CACHE_PATH=os.path.join(args.tmp, f'results-{port}.sqlite3'),
+        INTERACTION_DB_PATH=os.path.join(args.tmp, f'interactions-{port}.sqlite3'),
+        JOB_STORE_PATH=os.path.join(args.tmp, f'jobs-{port}.sqlite3'),
+    )
+    log = open(os.path.join(args.tmp, f'gunicorn-{port}.log'), 'w')
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'api:app'],
+                              cwd=BACKEND, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + args.startup_timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn exited during startup; see {log.name}")
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=1).read()
+            return server
+        except (urllib.error.URLError, ConnectionError, OSError):
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"gunicorn did not become ready in {args.startup_timeout}s; see {log.name}")
+
+
+def stop_server(server):
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def run_load(base_url, scenario, requests, concurrency, timeout, counter):
+    def one(_):
+        request = scenario.request(base_url, next(counter))
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                response.read()
+                ok = response.status == 200
+        except (urllib.error.URLError, ConnectionError, OSError):
+            ok = False
+        return time.perf_counter() - start, ok
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(one, range(requests)))
+        elapsed = time.perf_counter() - start
+    latencies = [latency for latency, ok in results if ok]
+    return {
+        "requests": requests,
+        "errors": sum(1 for _, ok in results if not ok),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000 if latencies else None,
+        "p95_ms": percentile(latencies, 95) * 1000 if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--settings', nargs='+', default=DEFAULT_SETTINGS,
+                        help="worker_class:workers:threads, e.g. gthread:2:16")
+    parser.add_argument('--scenario', default='mixed', choices=['symptoms', 'prescription', 'report', 'mixed'])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=32, help="Parallel clients")
+    parser.add_argument('--latency-ms', type=float, default=800, help="Simulated LLM latency per call")
+    parser.add_argument('--jitter-ms', type=float, default=200)
+    parser.add_argument('--timeout', type=float, default=120, help="Client timeout per request")
+    parser.add_argument('--startup-timeout', type=float, default=60)
+    parser.add_argument('--preload-histology', action='store_true', help="Also load the ViT in the master")
+    parser.add_argument('--output', help="Also write the results as JSON")
+    args = parser.parse_args()
+
+    scenario = Scenario(args.scenario)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        args.tmp = tmp
+        for setting in args.settings:
+            port = free_port()
+            server = start_server(setting, port, args)
+            try:
+                base_url = f'http://127.0.0.1:{port}'
+                # Warm-up: first requests pay for imports and connection setup
+                counter = count()
+                run_load(base_url, scenario, min(args.concurrency, args.requests), args.concurrency,
+                         args.timeout, counter)
+                result = run_load(base_url, scenario, args.requests, args.concurrency, args.timeout, counter)
+            finally:
+                stop_server(server)
+            result["setting"] = setting
+            rows.append(result)
+            p50 = f"{result['p50_ms']:8.0f}" if result['p50_ms'] is not None else '       -'
+            p95 = f"{result['p95_ms']:8.0f}" if result['p95_ms'] is not None else '       -'
+            print(f"{setting:16s} {result['rps']:7.1f} req/s  p50 {p50} ms  p95 {p95} ms  "
+                  f"errors {result['errors']}/{result['requests']}", flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"scenario": args.scenario, "latency_ms": args.latency_ms,
+                       "concurrency": args.concurrency, "results": rows}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,354 @@
+"""Benchmark suite for the backend and model hot paths, with a regression check.
+
+    python benchmarks/suite.py --save                 # record benchmarks/baseline.json
+    python benchmarks/suite.py --compare              # fail if slower than the baseline
+    python benchmarks/suite.py --groups json routes --filter symptoms --compare
+
+Groups:
+  enhance  enhance_image for every enhancement combination, on the
+           test-samples images and a synthetic 4000x3000 image
+  decode   upload decode, and histology decode + preprocess (needs torch)
+  vit      ViT forward pass on CPU at batch sizes 1, 8 and 32 (random
+           weights, needs torch)
+  json     LLM JSON extraction: clean, fenced, repaired, truncated, streamed
+  report   OCR table parsing and the reference-range engine
+  routes   the Flask routes through the test client against the stub LLM
+           with --llm-latency-ms of injected latency
+
+Each case runs until --min-time seconds or --max-runs calls have passed
+(at least three runs) and reports the median and p95 per call. Baselines are
+machine-specific: record one on the machine you compare on. A case regresses
+when its median exceeds the baseline by more than --threshold (relative) and
+--min-delta-ms (absolute, so sub-millisecond noise is ignored).
+"""
+import argparse
+import atexit
+import io
+import itertools
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import zipfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLES = os.path.join(ROOT, 'test-samples')
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+GROUPS = ('enhance', 'decode', 'vit', 'json', 'report', 'routes')
+
+sys.path.insert(0, os.path.join(ROOT, 'backend'))
+sys.path.insert(0, os.path.join(ROOT, 'model'))
+
+
+def read_sample(name):
+    with open(os.path.join(SAMPLES, name), 'rb') as f:
+        return f.read()
+
+
+def synthetic_image(width=4000, height=3000):
+    """A smooth, noisy grayscale-as-RGB image the size of a large X-ray."""
+    import cv2
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    base = cv2.GaussianBlur(rng.integers(0, 256, (height, width), dtype=np.uint8), (0, 0), 8)
+    noisy = np.clip(base.astype(np.int16) + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+    return Image.fromarray(noisy).convert('RGB')
+
+
+def enhance_cases():
+    from PIL import Image
+
+    from enhance import ENHANCEMENTS, enhance_image
+
+    images = {name: Image.open(os.path.join(SAMPLES, name)).convert('RGB') for name in sorted(os.listdir(SAMPLES))}
+    images['synthetic-4000x3000'] = synthetic_image()
+    combos = [list(c) for r in range(1, len(ENHANCEMENTS) + 1) for c in itertools.combinations(ENHANCEMENTS, r)]
+    for name, image in images.items():
+        for combo in combos:
+            yield f"enhance/{name}/{'+'.join(combo)}", lambda image=image, combo=combo: enhance_image(image, combo)
+
+
+def decode_cases():
+    from PIL import Image
+
+    from uploads import open_image
+
+    blobs = {name: read_sample(name) for name in sorted(os.listdir(SAMPLES))}
+    buffer = io.BytesIO()
+    synthetic_image().save(buffer, format='JPEG', quality=90)
+    blobs['synthetic-4000x3000.jpg'] = buffer.getvalue()
+    for name, data in blobs.items():
+        yield f"decode/open_image/{name}", lambda data=data: open_image(data)
+
+    try:
+        from preprocessing import BatchPreprocessor
+    except ImportError as e:
+        print(f"  skipping histology preprocessing: {e}")
+        return
+    preprocessor = BatchPreprocessor(max_batch_size=32)
+    for batch_size in (1, 8, 32):
+        batch = [Image.open(io.BytesIO(blob)) for blob in itertools.islice(itertools.cycle(blobs.values()), batch_size)]
+        yield f"decode/preprocess/batch{batch_size}", lambda batch=batch: preprocessor(
+            [image.copy() for image in batch])
+
+
+def vit_cases():
+    import torch
+
+    from predictor import ViTForCancerClassification, class_names
+
+    model = ViTForCancerClassification(len(class_names), pretrained=False).eval()
+    for batch_size in (1, 8, 32):
+        batch = torch.randn(batch_size, 3, 224, 224)
+
+        def forward(batch=batch):
+            with torch.inference_mode():
+                return model(batch)
+        yield f"vit/forward/batch{batch_size}", forward
+
+
+def json_cases():
+    from json_stream import IncrementalJSONParser
+    from llm_json import parse_llm_json
+
+    with open(os.path.join(ROOT, 'backend', 'stub_responses.json')) as f:
+        report = next(e['response'] for e in json.load(f) if e.get('match') == 'expert medical report analyzer')
+    value = json.loads(report)
+    value['parameters'] = [dict(p, name=f"{p['name']} {i}") for i in range(40) for p in value['parameters']]
+    large = json.dumps(value)
+    texts = {
+        'clean': report,
+        'fenced_prose': f"Here is the analysis:\n```json\n{report}\n```\nLet me know if you need more.",
+        'trailing_commas': report.replace('}', ',}').replace(']', ',]').replace(',,', ','),
+        'truncated': large[:int(len(large) * 0.8)],
+        'large_clean': large,
+    }
+    for name, text in texts.items():
+        yield f"json/parse/{name}", lambda text=text: parse_llm_json(text, stage='benchmark')
+
+    chunks = [large[i:i + 64] for i in range(0, len(large), 64)]
+
+    def stream():
+        parser = IncrementalJSONParser()
+        for chunk in chunks:
+            for _ in parser.feed(chunk):
+                pass
+        return parser.result(stage='benchmark')
+    yield "json/stream/large", stream
+
+
+def report_cases():
+    from reference_ranges import annotate_report, evaluate
+    from report_ocr import parse_report_text
+
+    rows = [
+        "Hemoglobin (Hb) 11.2 L g/dL 13.0 - 17.0", "Total RBC 4.1 million/cumm 4.5 - 5.5",
+        "Total WBC 11,800 H cells/cumm 4000 - 11000", "Platelet Count 2,50,000 /cumm 150000 - 410000",
+        "PCV 38 % 40 - 50", "MCV 88.5 fL 83 - 101", "MCH 27.3 pg 27-32", "MCHC 31.8 g/dL 31.5 - 34.5",
+        "Neutrophils 68 % 40-80", "Lymphocytes 25 % 20 - 40", "Glucose 112 H mg/dL 70 - 100",
+        "Creatinine 0.9 mg/dL 0.7 - 1.3", "Sodium 139 mmol/L 135 - 145", "Total Cholesterol 230 mg/dL < 200",
+    ]
+    text = "Patient Name: Test Patient   Age/Sex: 45 Y / Male\nCollected On: 12/03/2024\n" + '\n'.join(rows)
+    yield "report/parse_ocr_text", lambda: parse_report_text(text)
+
+    parameters = [{"name": name, "value": value, "unit": unit}
+                  for name, value, unit in [("Hemoglobin", 11.2, "g/dL"), ("WBC", 15.0, "10^9/L"),
+                                            ("Platelets", "2,50,000", "/cumm"), ("Glucose", 7.5, "mmol/L"),
+                                            ("Creatinine", 110, "umol/L"), ("HDL", 38, "mg/dL")]] * 20
+    yield "report/evaluate/120_parameters", lambda: evaluate(parameters, 'female', 40)
+    result = {"patient_info": {"gender": "Male", "age": "45"}, "abnormal_findings": []}
+    yield "report/annotate/120_parameters", lambda: annotate_report(
+        dict(result, parameters=[dict(p) for p in parameters]))
+
+
+def route_cases(args):
+    import api
+
+    client = api.app.test_client()
+    counter = itertools.count()
+    prescription = read_sample('prescriptions-test.jpg')
+    report = read_sample('report-analysis-test.jpg')
+    medical_image = read_sample('image-analysis-test.png')
+
+    def unique(data):
+        # Trailing bytes after the image end marker only change the cache key
+        return data + f'benchmark-{next(counter)}'.encode()
+
+    def post_file(path, data, name, **form):
+        response = client.post(path, data=dict(form, file=(io.BytesIO(data), name)),
+                               content_type='multipart/form-data')
+        body = response.get_data()
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} returned {response.status_code}: {body[:200]}")
+        return body
+
+    def symptoms():
+        response = client.post('/api/analyze_symptoms',
+                               json={"symptoms": ["fever", "cough", f"benchmark {next(counter)}"]})
+        if response.status_code != 200:
+            raise RuntimeError(f"/api/analyze_symptoms returned {response.status_code}")
+
+    def batch():
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as z:
+            for i in range(4):
+                z.writestr(f'prescription-{i}.jpg', unique(prescription))
+        post_file('/api/process_prescriptions', archive.getvalue(), 'batch.zip')
+
+    yield "routes/health", lambda: client.get('/health').get_data()
+    yield "routes/metrics", lambda: client.get('/metrics').get_data()
+    yield "routes/analyze_symptoms", symptoms
+    yield "routes/analyze_symptoms/cached", lambda: client.post(
+        '/api/analyze_symptoms', json={"symptoms": ["fever", "cough"]}).get_data()
+    yield "routes/process_prescription", lambda: post_file(
+        '/api/process_prescription', unique(prescription), 'prescription.jpg')
+    yield "routes/process_prescriptions/zip4", batch
+    yield "routes/analyze_medical_report", lambda: post_file(
+        '/api/analyze_medical_report', unique(report), 'report.jpg')
+    yield "routes/analyze_medical_report/stream", lambda: post_file(
+        '/api/analyze_medical_report?stream=1', unique(report), 'report.jpg')
+    yield "routes/analyze_medical_image/enhanced", lambda: post_file(
+        '/api/analyze_medical_image', unique(medical_image), 'image.png',
+        enhancements=json.dumps(['contrastBoost', 'noiseReduction', 'edgeEnhancement']))
+
+
+def measure(fn, min_time, max_runs):
+    """Per-call times in ms: one warm-up call, then at least 3 runs."""
+    fn()
+    times = []
+    deadline = time.perf_counter() + min_time
+    while len(times) < 3 or (len(times) < max_runs and time.perf_counter() < deadline):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return {
+        "median_ms": statistics.median(times),
+        "p95_ms": times[min(len(times) - 1, int(0.95 * len(times)))],
+        "min_ms": times[0],
+        "runs": len(times),
+    }
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    """Print a comparison table; returns the names of regressed cases."""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"  {name:60s} {result['median_ms']:10.2f} ms  (new)")
+            continue
+        change = result['median_ms'] / before['median_ms'] - 1 if before['median_ms'] else 0.0
+        regressed = change > threshold and result['median_ms'] - before['median_ms'] > min_delta_ms
+        if regressed:
+            regressions.append(name)
+        print(f"  {name:60s} {before['median_ms']:10.2f} -> {result['median_ms']:10.2f} ms  "
+              f"{change * 100:+6.1f}%{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument('--groups', nargs='+', default=list(GROUPS), choices=GROUPS)
+    parser.add_argument('--filter', help="Only run cases whose name contains this text")
+    parser.add_argument('--min-time', type=float, default=1.0, help="Seconds to spend per case")
+    parser.add_argument('--max-runs', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=None, help="torch/OpenCV threads (default: library default)")
+    parser.add_argument('--llm-latency-ms', type=float, default=50, help="Stub LLM latency for the routes group")
+    parser.add_argument('--save', nargs='?', const=DEFAULT_BASELINE, help="Write results as the new baseline")
+    parser.add_argument('--compare', nargs='?', const=DEFAULT_BASELINE, help="Baseline to compare against")
+    parser.add_argument('--threshold', type=float, default=0.15, help="Allowed relative slowdown of the median")
+    parser.add_argument('--min-delta-ms', type=float, default=0.05, help="Ignore slowdowns smaller than this")
+    args = parser.parse_args()
+
+    # The backend reads its configuration at import time, so set it before any group imports it
+    state = tempfile.mkdtemp(prefix='arogya-bench-')
+    atexit.register(shutil.rmtree, state, ignore_errors=True)
+    os.environ.update({
+        'LLM_BACKEND': 'stub',
+        'LLM_STUB_LATENCY_MS': str(args.llm_latency_ms),
+        'LLM_STUB_JITTER_MS': '0',
+        'REPORT_OCR': '0',
+        'RESULT_CACHE_PATH': os.path.join(state, 'results.sqlite3'),
+        'INTERACTION_DB_PATH': os.path.join(state, 'interactions.sqlite3'),
+        'JOB_STORE_PATH': os.path.join(state, 'jobs.sqlite3'),
+    })
+    if args.threads:
+        import cv2
+        cv2.setNumThreads(args.threads)
+        try:
+            import torch
+            torch.set_num_threads(args.threads)
+        except ImportError:
+            pass
+
+    factories = {
+        'enhance': enhance_cases,
+        'decode': decode_cases,
+        'vit': vit_cases,
+        'json': json_cases,
+        'report': report_cases,
+        'routes': lambda: route_cases(args),
+    }
+    results = {}
+    skipped = []
+    for group in args.groups:
+        print(f"[{group}]", flush=True)
+        try:
+            cases = list(factories[group]())
+        except ImportError as e:
+            print(f"  skipped: {e}")
+            skipped.append(group)
+            continue
+        for name, fn in cases:
+            if args.filter and args.filter not in name:
+                continue
+            results[name] = measure(fn, args.min_time, args.max_runs)
+            r = results[name]
+            print(f"  {name:60s} median {r['median_ms']:10.2f} ms  p95 {r['p95_ms']:10.2f} ms  "
+                  f"({r['runs']} runs)", flush=True)
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        print(f"\nCompared with {args.compare} (threshold {args.threshold * 100:.0f}%):")
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+        missing = sorted(name for name in set(baseline) - set(results) if name.split('/')[0] in args.groups)
+        if missing and not args.filter:
+            print(f"  not run: {', '.join(missing)}")
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            exit_code = 1
+        else:
+            print("\nNo regressions.")
+
+    if args.save:
+        meta = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "llm_latency_ms": args.llm_latency_ms,
+            "skipped_groups": skipped,
+        }
+        try:
+            import torch
+            meta["torch"] = torch.__version__
+        except ImportError:
+            pass
+        with open(args.save, 'w') as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2, sort_keys=True)
+        print(f"Wrote baseline {args.save}")
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+
+class MicroBatcher:
+    """Collects concurrent predict requests into batched forward passes.
+
+    Callers preprocess their own image (so decoding runs in the request
+    thread) and hand the tensor to a single worker thread, which waits up to
+    `max_wait_ms` for more work or until `max_batch_size` images are queued,
+    runs one forward pass and splits the logits back out to each caller.
+    """
+
+    def __init__(self, predictor, max_batch_size=16, max_wait_ms=10):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        self._worker = threading.Thread(target=self._run, name='vit-micro-batcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, image):
+        """Queue one PIL image or path; returns a Future with its result dict."""
+        if self._stopped.is_set():
+            raise RuntimeError("MicroBatcher is stopped")
+        future = Future()
+        tensor = self.predictor.preprocess([image])[0]
+        self._queue.put((tensor, future))
+        return future
+
+    def predict(self, images, timeout=None):
+        """Blocking helper with the same shape as HistologyPredictor.predict."""
+        futures = [self.submit(image) for image in images]
+        return [future.result(timeout=timeout) for future in futures]
+
+    def stop(self):
+        self._stopped.set()
+        self._queue.put(None)
+        self._worker.join()
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[1].set_exception(RuntimeError("MicroBatcher is stopped"))
+
+    def _collect(self):
+        item = self._queue.get()
+        if item is None:
+            return []
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while not self._stopped.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+            futures = [future for _, future in batch]
+            try:
+                results = self.predictor.classify(torch.stack([tensor for tensor, _ in batch]))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, result in zip(futures, results):
+                future.set_result(result)
@@ -0,0 +1,139 @@
+import argparse
+import json
+import os
+import sys
+
+import torch
+
+# Dihedral views of a tile: H&E tiles have no canonical orientation, so
+# flips and 90-degree rotations keep the label. Ordered so that the first
+# n views form a sensible subset for n in (1, 2, 4, 8).
+TTA_VIEWS = (
+    (0, False), (0, True), (2, False), (2, True),
+    (1, False), (1, True), (3, False), (3, True),
+)
+
+
+def augment_views(batch, views=8):
+    """Stack the first `views` rotations/flips of an NCHW batch into one (views * N) batch.
+
+    Row v * N + i is view v of image i, so the logits reshape to (views, N, C).
+    """
+    if not 1 <= views <= len(TTA_VIEWS):
+        raise ValueError(f"views must be between 1 and {len(TTA_VIEWS)}")
+    if views == 1:
+        return batch
+    out = []
+    for quarter_turns, flip in TTA_VIEWS[:views]:
+        view = torch.rot90(batch, quarter_turns, dims=(2, 3)) if quarter_turns else batch
+        out.append(torch.flip(view, dims=(3,)) if flip else view)
+    return torch.cat(out)
+
+
+def view_probabilities(logits, views, temperature=1.0):
+    """Average the temperature-scaled softmax of (views * N, C) logits over the views."""
+    logits = logits.reshape(views, -1, logits.shape[-1])
+    return torch.softmax(logits / temperature, dim=-1).mean(dim=0)
+
+
+def fit_temperature(logits, labels, views=1, max_iter=100):
+    """Fit the softmax temperature minimizing held-out NLL of the view-averaged probabilities."""
+    log_t = torch.zeros(1, requires_grad=True)
+    optimizer = torch.optim.LBFGS([log_t], lr=0.1, max_iter=max_iter)
+    index = torch.arange(labels.shape[0])
+
+    def nll():
+        optimizer.zero_grad()
+        probs = view_probabilities(logits, views, log_t.exp())
+        loss = -torch.log(probs[index, labels].clamp_min(1e-12)).mean()
+        loss.backward()
+        return loss
+
+    optimizer.step(nll)
+    return float(log_t.exp())
+
+
+def calibration_report(probabilities, labels, bins=15):
+    """NLL, accuracy and expected calibration error of (N, C) probabilities."""
+    confidence, predicted = probabilities.max(dim=1)
+    correct = (predicted == labels).float()
+    nll = -torch.log(probabilities[torch.arange(labels.shape[0]), labels].clamp_min(1e-12)).mean()
+    ece = torch.zeros(())
+    edges = torch.linspace(0, 1, bins + 1)
+    for lower, upper in zip(edges[:-1], edges[1:]):
+        in_bin = (confidence > lower) & (confidence <= upper)
+        if in_bin.any():
+            ece += in_bin.float().mean() * (confidence[in_bin].mean() - correct[in_bin].mean()).abs()
+    return {"nll": float(nll), "accuracy": float(correct.mean()), "ece": float(ece)}
+
+
+def load_calibration(path):
+    """Read a calibration file written by this script; returns a dict."""
+    with open(path) as f:
+        calibration = json.load(f)
+    if not calibration.get('temperature', 0) > 0:
+        raise ValueError(f"{path} has no positive temperature")
+    return calibration
+
+
+def collect_logits(predictor, dataset, views, batch_size=32, workers=4):
+    from torch.utils.data import DataLoader
+
+    loader = DataLoader(dataset, batch_size=batch_size, num_workers=workers, shuffle=False)
+    all_logits, all_labels = [], []
+    for i, (batch, labels) in enumerate(loader):
+        logits = predictor.forward(augment_views(batch, views))
+        all_logits.append(logits.reshape(views, -1, logits.shape[-1]))
+        all_labels.append(labels)
+        print(f"Scored {min((i + 1) * batch_size, len(dataset))}/{len(dataset)}", file=sys.stderr)
+    logits = torch.cat(all_logits, dim=1)
+    return logits.reshape(-1, logits.shape[-1]), torch.cat(all_labels)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Fit the softmax temperature of the histology ViT on a held-out set.")
+    parser.add_argument('held_out', help="ImageFolder-style directory (one sub-directory per class)")
+    parser.add_argument('--checkpoint', default=None)
+    parser.add_argument('--tta', type=int, default=8, choices=[1, 2, 4, 8],
+                        help="Views to average; calibrate with the value used at inference")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--output', help="Calibration JSON (default: <checkpoint>.calibration.json)")
+    args = parser.parse_args(argv)
+
+    from torchvision import datasets
+
+    from predictor import HistologyPredictor, class_names, default_checkpoint_path, transform
+
+    checkpoint = args.checkpoint or default_checkpoint_path()
+    dataset = datasets.ImageFolder(args.held_out, transform=transform)
+    unknown = set(dataset.classes) - set(class_names)
+    if unknown:
+        print(f"Error: unknown class directories {sorted(unknown)}")
+        sys.exit(1)
+    # ImageFolder numbers the directories present; map them onto the model's classes
+    dataset.target_transform = lambda label: class_names.index(dataset.classes[label])
+
+    predictor = HistologyPredictor(checkpoint)
+    logits, labels = collect_logits(predictor, dataset, args.tta, args.batch_size, args.workers)
+    temperature = fit_temperature(logits, labels, args.tta)
+
+    calibration = {
+        "temperature": temperature,
+        "tta": args.tta,
+        "samples": len(dataset),
+        "checkpoint": os.path.basename(checkpoint),
+        "before": calibration_report(view_probabilities(logits, args.tta), labels),
+        "after": calibration_report(view_probabilities(logits, args.tta, temperature), labels),
+    }
+    output = args.output or f"{checkpoint}.calibration.json"
+    with open(output, 'w') as f:
+        json.dump(calibration, f, indent=2)
+    print(f"Temperature {temperature:.3f}: NLL {calibration['before']['nll']:.4f} -> "
+          f"{calibration['after']['nll']:.4f}, ECE {calibration['before']['ece']:.4f} -> "
+          f"{calibration['after']['ece']:.4f}; wrote {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+import argparse
+import contextlib
+import glob
+import os
+import tempfile
+import time
+
+import torch
+
+from predictor import IMAGE_SIZE, HistologyPredictor, default_checkpoint_path, load_model
+
+BACKENDS = ('eager', 'int8', 'torchscript', 'compile', 'onnx')
+
+
+def quantize_int8(model):
+    """Dynamic int8 quantization of every Linear layer (weights int8, activations fp32)."""
+    engines = torch.backends.quantized.supported_engines
+    torch.backends.quantized.engine = 'fbgemm' if 'fbgemm' in engines else 'qnnpack'
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def export_torchscript(model, output_path):
+    example = torch.randn(1, 3, IMAGE_SIZE, IMAGE_SIZE)
+    with torch.inference_mode():
+        traced = torch.jit.trace(model, example)
+    traced = torch.jit.freeze(traced.eval())
+    traced.save(output_path)
+    return output_path
+
+
+def export_onnx(model, output_path, opset=17):
+    example = torch.randn(1, 3, IMAGE_SIZE, IMAGE_SIZE)
+    torch.onnx.export(
+        model, example, output_path,
+        input_names=['pixel_values'], output_names=['logits'],
+        dynamic_axes={'pixel_values': {0: 'batch'}, 'logits': {0: 'batch'}},
+        opset_version=opset,
+    )
+    return output_path
+
+
+class OnnxRuntimeModel:
+    """Callable wrapper so an ONNX Runtime session looks like a torch module."""
+
+    def __init__(self, onnx_path, threads=None):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("The 'onnx' backend requires onnxruntime: pip install onnxruntime")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        logits = self.session.run(None, {self.input_name: batch.contiguous().numpy()})[0]
+        return torch.from_numpy(logits)
+
+    def eval(self):
+        return self
+
+
+def load_backend(checkpoint_path, backend='eager', device='cpu', artifact_path=None):
+    """Return a model callable for the requested inference backend.
+
+    `artifact_path` points at a previously exported TorchScript/ONNX file; if it
+    is missing the artifact is built from the checkpoint on the fly (without
+    one, into a private temporary file that is removed once loaded).
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+
+    if backend == 'torchscript' and artifact_path and os.path.exists(artifact_path):
+        return torch.jit.load(artifact_path, map_location=device).eval()
+    if backend == 'onnx' and artifact_path and os.path.exists(artifact_path):
+        return OnnxRuntimeModel(artifact_path)
+
+    model = load_model(checkpoint_path, device)
+    if backend == 'eager':
+        return model
+    if backend == 'int8':
+        if device != 'cpu':
+            raise ValueError("Dynamic int8 quantization is only supported on CPU")
+        return quantize_int8(model)
+    if backend == 'compile':
+        return torch.compile(model)
+    if backend == 'torchscript':
+        if artifact_path:
+            return torch.jit.load(export_torchscript(model, artifact_path), map_location=device).eval()
+        with _private_artifact('.torchscript.pt') as path:
+            return torch.jit.load(export_torchscript(model, path), map_location=device).eval()
+    if artifact_path:
+        return OnnxRuntimeModel(export_onnx(model, artifact_path))
+    with _private_artifact('.onnx') as path:
+        return OnnxRuntimeModel(export_onnx(model, path))
+
+
+@contextlib.contextmanager
+def _private_artifact(suffix):
+    """Yield a fresh 0600 file for an on-the-fly export and delete it afterwards.
+
+    mkstemp gives every worker its own unguessable name, so concurrent
+    workers cannot clobber each other's exports and nobody can pre-plant a
+    symlink at the path; torch.jit.load and ONNX Runtime read the whole file
+    at load time, so it is not needed once the model is loaded.
+    """
+    fd, path = tempfile.mkstemp(prefix='vit_cancer_model.', suffix=suffix)
+    os.close(fd)
+    try:
+        yield path
+    finally:
+        os.remove(path)
+
+
+def model_size_mb(model):
+    """Serialized size of a model, used to compare backends."""
+    if isinstance(model, OnnxRuntimeModel):
+        return None
+    with tempfile.NamedTemporaryFile(suffix='.pt') as f:
+        if isinstance(model, torch.jit.ScriptModule):
+            model.save(f.name)
+        else:
+            torch.save(model.state_dict(), f.name)
+        return os.path.getsize(f.name) / (1024 * 1024)
+
+
+def check_parity(checkpoint_path, backend, sample_paths, artifact_path=None, repeats=3):
+    """Compare a backend against the fp32 checkpoint on the sample images."""
+    reference = HistologyPredictor(checkpoint_path, device='cpu')
+    candidate = HistologyPredictor(checkpoint_path, device='cpu', backend=backend,
+                                   artifact_path=artifact_path)
+    batch = reference.preprocess(sample_paths)
+
+    def timed(predictor):
+        predictor.forward(batch)  # warm-up (and compile for torch.compile)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            logits = predictor.forward(batch)
+        return logits, (time.perf_counter() - start) * 1000 / (repeats * len(sample_paths))
+
+    ref_logits, ref_ms = timed(reference)
+    cand_logits, cand_ms = timed(candidate)
+    ref_probs = torch.softmax(ref_logits, dim=1)
+    cand_probs = torch.softmax(cand_logits, dim=1)
+    agreement = (ref_probs.argmax(dim=1) == cand_probs.argmax(dim=1)).float().mean().item()
+
+    return {
+        "backend": backend,
+        "samples": len(sample_paths),
+        "top1_agreement": agreement,
+        "max_prob_delta": (ref_probs - cand_probs).abs().max().item(),
+        "fp32_ms_per_image": ref_ms,
+        "backend_ms_per_image": cand_ms,
+        "speedup": ref_ms / cand_ms if cand_ms else None,
+        "fp32_size_mb": model_size_mb(reference.model),
+        "backend_size_mb": model_size_mb(candidate.model),
+    }
+
+
+def main(argv=None):
+    default_samples = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'test-samples')
+    parser = argparse.ArgumentParser(description="Export and validate optimized CPU inference backends.")
+    parser.add_argument('--checkpoint', default=default_checkpoint_path())
+    parser.add_argument('--backend', choices=BACKENDS[1:], default='int8')
+    parser.add_argument('--output', help="Where to write the TorchScript/ONNX artifact")
+    parser.add_argument('--check-parity', action='store_true',
+                        help="Compare the backend against the fp32 checkpoint")
+    parser.add_argument('--samples', default=default_samples,
+                        help="Directory of images used for the parity check")
+    parser.add_argument('--min-agreement', type=float, default=1.0,
+                        help="Fail the parity check below this top-1 agreement with fp32")
+    parser.add_argument('--max-prob-delta', type=float, default=0.05,
+                        help="Fail the parity check above this probability delta")
+    args = parser.parse_args(argv)
+
+    if args.output:
+        if args.backend not in ('torchscript', 'onnx'):
+            parser.error(f"The {args.backend} backend is applied at load time and has no artifact")
+        model = load_model(args.checkpoint, 'cpu')
+        if args.backend == 'torchscript':
+            export_torchscript(model, args.output)
+        else:
+            export_onnx(model, args.output)
+        print(f"Exported {args.backend} model to {args.output}")
+
+    if args.check_parity:
+        samples = sorted(p for ext in ('*.jpg', '*.jpeg', '*.png')
+                         for p in glob.glob(os.path.join(args.samples, ext)))
+        if not samples:
+            parser.error(f"No sample images found in {args.samples}")
+        report = check_parity(args.checkpoint, args.backend, samples,
+                              args.output if args.backend in ('torchscript', 'onnx') else None)
+        for key, value in report.items():
+            print(f"{key}: {value}")
+        if report['top1_agreement'] < args.min_agreement or report['max_prob_delta'] > args.max_prob_delta:
+            raise SystemExit("Parity check failed")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,64 +1,177 @@
-import torch
-import torchvision
-import torchvision.transforms as transforms
-from PIL import Image
+import argparse
+import glob
+import json
 import os
 import sys
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from predictor import (HistologyPredictor, default_backend, default_calibration_path,
+                       default_checkpoint_path, default_tta)
+from preprocessing import IMAGE_EXTENSIONS, IMAGE_SIZE, decode_into, to_model_input
+
+
+def collect_paths(inputs, manifest=None):
+    """Expand files, directories, globs and an optional manifest into a sorted path list."""
+    paths = []
+    if manifest:
+        with open(manifest) as f:
+            paths.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                paths.extend(os.path.join(root, name) for name in files
+                             if name.lower().endswith(IMAGE_EXTENSIONS))
+        elif any(ch in item for ch in '*?['):
+            paths.extend(glob.glob(item, recursive=True))
+        else:
+            paths.append(item)
+    # De-duplicate while keeping a stable order so resumed runs line up
+    return sorted(set(paths))
+
+
+def load_completed(output_path):
+    """Return paths already classified in a JSONL output, dropping any torn last line.
+
+    Error records (unreadable or missing files) do not count, so a resumed run
+    tries those paths again and appends a newer record for them.
+    """
+    done = set()
+    if not output_path or not os.path.exists(output_path):
+        return done
+    with open(output_path, 'rb+') as f:
+        data = f.read()
+        last_newline = data.rfind(b'\n')
+        if last_newline + 1 != len(data):
+            # A crash mid-write leaves a partial record; cut it off before appending
+            f.truncate(last_newline + 1)
+            data = data[:last_newline + 1]
+    for line in data.splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if 'path' in record and 'error' not in record:
+            done.add(record['path'])
+    return done
+
+
+class TileDataset(Dataset):
+    """Decodes and preprocesses tiles inside DataLoader worker processes."""
+
+    def __init__(self, paths):
+        self.paths = paths
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        path = self.paths[index]
+        start = time.perf_counter()
+        try:
+            # Ship uint8 pixels between processes; normalization happens once per batch
+            pixels = decode_into(path, np.empty((IMAGE_SIZE, IMAGE_SIZE, 3), dtype=np.uint8))
+            error = None
+        except Exception as e:
+            pixels = None
+            error = str(e)
+        return path, pixels, error, (time.perf_counter() - start) * 1000
+
+
+def collate_tiles(items):
+    good = [item for item in items if item[1] is not None]
+    failed = [item for item in items if item[1] is None]
+    batch = to_model_input(torch.from_numpy(np.stack([item[1] for item in good]))) if good else None
+    return good, batch, failed
+
+
+def classify_paths(predictor, paths, out, batch_size=32, workers=4):
+    """Stream one JSON line per path to `out` as batches finish."""
+    loader = DataLoader(
+        TileDataset(paths),
+        batch_size=batch_size,
+        num_workers=workers,
+        collate_fn=collate_tiles,
+        persistent_workers=workers > 0,
+    )
+    processed = 0
+    for good, batch, failed in loader:
+        for path, _, error, _ in failed:
+            out.write(json.dumps({"path": path, "error": error}) + '\n')
+        if batch is not None:
+            start = time.perf_counter()
+            results = predictor.classify(batch)
+            forward_ms = (time.perf_counter() - start) * 1000 / len(good)
+            for (path, _, _, decode_ms), result in zip(good, results):
+                result.update({
+                    "path": path,
+                    "timing_ms": {"decode": round(decode_ms, 2), "forward": round(forward_ms, 2)},
+                })
+                out.write(json.dumps(result) + '\n')
+        out.flush()
+        processed += len(good) + len(failed)
+        print(f"Classified {processed}/{len(paths)}", file=sys.stderr)
+    return processed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Classify histology tiles with the TCGA ViT model.")
+    parser.add_argument('inputs', nargs='*', help="Image files, directories or glob patterns")
+    parser.add_argument('--manifest', help="Text file with one image path per line")
+    parser.add_argument('--output', help="JSONL output path (default: stdout)")
+    parser.add_argument('--checkpoint', default=default_checkpoint_path())
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--backend', default=default_backend(),
+                        choices=['eager', 'int8', 'torchscript', 'compile', 'onnx'])
+    parser.add_argument('--artifact', help="Pre-exported TorchScript/ONNX file for --backend")
+    parser.add_argument('--tta', type=int, default=default_tta(), choices=[1, 2, 4, 8],
+                        help="Average over this many flipped/rotated views per tile")
+    parser.add_argument('--calibration', default=default_calibration_path(),
+                        help="Temperature file written by calibration.py")
+    parser.add_argument('--no-resume', action='store_true',
+                        help="Overwrite --output instead of skipping already classified paths")
+    args = parser.parse_args(argv)
+
+    if not args.inputs and not args.manifest:
+        args.inputs = ['/home/ubuntu/inference.jpg']  # or 'inference.png'
+    paths = collect_paths(args.inputs, args.manifest)
+    single = len(paths) == 1 and not args.output and not args.manifest
+    if single and not os.path.exists(paths[0]):
+        print(f"Error: {paths[0]} does not exist.")
+        sys.exit(1)
+
+    predictor = HistologyPredictor(args.checkpoint, top_k=args.top_k,
+                                   backend=args.backend, artifact_path=args.artifact,
+                                   tta=args.tta, calibration_path=args.calibration)
+
+    # Original single-image usage: print the label and stop. In batch runs a
+    # missing path gets an error record like any other unreadable file.
+    if single:
+        result = predictor.predict_one(paths[0])
+        print(f"Predicted class: {result['predicted_class']}")
+        return
+
+    if args.output and args.no_resume and os.path.exists(args.output):
+        os.remove(args.output)
+    done = load_completed(args.output)
+    pending = [p for p in paths if p not in done]
+    if done:
+        print(f"Resuming: {len(done)} already classified, {len(pending)} remaining", file=sys.stderr)
+    if not pending:
+        return
+
+    out = open(args.output, 'a') if args.output else sys.stdout
+    try:
+        classify_paths(predictor, pending, out, args.batch_size, args.workers)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
 
-# Define the ViT model class
-class ViTForCancerClassification(torch.nn.Module):
-    def __init__(self, num_classes):
-        super(ViTForCancerClassification, self).__init__()
-        self.vit = torchvision.models.vit_b_16(weights=torchvision.models.ViT_B_16_Weights.DEFAULT)
-        in_features = self.vit.heads.head.in_features
-        self.vit.heads.head = torch.nn.Linear(in_features, num_classes)
-        
-    def forward(self, x):
-        return self.vit(x)
-
-# Load the model checkpoint
-checkpoint_path = 'vit_cancer_model_state_dict_6.pth'  # Replace 'X' with the correct epoch number
-num_classes = 32
-device = 'cuda' if torch.cuda.is_available() else 'cpu'
-
-model = ViTForCancerClassification(num_classes).to(device)
-model.load_state_dict(torch.load(checkpoint_path, map_location=device))
-model.eval()
-
-# Define class names
-class_names = [
-    'Adrenocortical_carcinoma', 'Bladder_Urothelial_Carcinoma', 'Brain_Lower_Grade_Glioma', 
-    'Breast_invasive_carcinoma', 'Cervical_squamous_cell_carcinoma_and_endocervical_adenocarcinoma',
-    'Cholangiocarcinoma', 'Colon_adenocarcinoma', 'Esophageal_carcinoma', 'Glioblastoma_multiforme',
-    'Head_and_Neck_squamous_cell_carcinoma', 'Kidney_Chromophobe', 'Kidney_renal_clear_cell_carcinoma',
-    'Kidney_renal_papillary_cell_carcinoma', 'Liver_hepatocellular_carcinoma', 'Lung_adenocarcinoma', 
-    'Lung_squamous_cell_carcinoma', 'Lymphoid_Neoplasm_Diffuse_Large_B-cell_Lymphoma', 'Mesothelioma', 
-    'Ovarian_serous_cystadenocarcinoma', 'Pancreatic_adenocarcinoma', 'Pheochromocytoma_and_Paraganglioma',
-    'Prostate_adenocarcinoma', 'Rectum_adenocarcinoma', 'Sarcoma', 'Skin_Cutaneous_Melanoma', 
-    'Stomach_adenocarcinoma', 'Testicular_Germ_Cell_Tumors', 'Thymoma', 'Thyroid_carcinoma', 
-    'Uterine_Carcinosarcoma', 'Uterine_Corpus_Endometrial_Carcinoma', 'Uveal_Melanoma'
-]
-
-# Image preprocessing
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-])
-
-# Load and preprocess the image
-image_path = '/home/ubuntu/inference.jpg'  # or 'inference.png'
-if not os.path.exists(image_path):
-    print(f"Error: {image_path} does not exist.")
-    sys.exit()
-
-image = Image.open(image_path).convert('RGB')
-image_tensor = transform(image).unsqueeze(0).to(device)
-
-# Perform inference
-with torch.no_grad():
-    output = model(image_tensor)
-    _, predicted_idx = torch.max(output, 1)
-    predicted_class = class_names[predicted_idx.item()]
-
-print(f"Predicted class: {predicted_class}")
+if __name__ == '__main__':
+    main()
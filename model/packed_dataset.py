@@ -0,0 +1,176 @@
+import argparse
+import json
+import os
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from preprocessing import IMAGE_EXTENSIONS, IMAGE_SIZE, decode_into
+
+INDEX_FILE = 'index.json'
+LABELS_FILE = 'labels.npy'
+
+
+def find_samples(root):
+    """(path, label) pairs and class names, numbered like torchvision's ImageFolder."""
+    classes = sorted(entry.name for entry in os.scandir(root) if entry.is_dir())
+    samples = []
+    for label, name in enumerate(classes):
+        for directory, _, files in sorted(os.walk(os.path.join(root, name), followlinks=True)):
+            samples.extend((os.path.join(directory, f), label) for f in sorted(files)
+                           if f.lower().endswith(IMAGE_EXTENSIONS))
+    return samples, classes
+
+
+def _decode(args):
+    path, image_size = args
+    return decode_into(path, np.empty((image_size, image_size, 3), dtype=np.uint8))
+
+
+def pack_image_folder(root, out_dir, image_size=IMAGE_SIZE, shard_size=4096, workers=8):
+    """Decode an ImageFolder tree once into fixed-size uint8 shards plus an index.
+
+    Each shard is a (count, H, W, 3) uint8 .npy array, so a sample is a fixed
+    offset into a memory-mapped file. index.json is written last; a pack
+    without it is incomplete and is rebuilt.
+    """
+    samples, classes = find_samples(root)
+    if not samples:
+        raise ValueError(f"No images found under {root}")
+    os.makedirs(out_dir, exist_ok=True)
+    labels = np.array([label for _, label in samples], dtype=np.int64)
+    np.save(os.path.join(out_dir, LABELS_FILE), labels)
+
+    shards = []
+    with Pool(workers) as pool:
+        for start in range(0, len(samples), shard_size):
+            chunk = samples[start:start + shard_size]
+            name = f'shard-{len(shards):05d}.npy'
+            shard = np.lib.format.open_memmap(
+                os.path.join(out_dir, name), mode='w+', dtype=np.uint8,
+                shape=(len(chunk), image_size, image_size, 3))
+            jobs = ((path, image_size) for path, _ in chunk)
+            for i, pixels in enumerate(pool.imap(_decode, jobs, chunksize=16)):
+                shard[i] = pixels
+            shard.flush()
+            del shard
+            shards.append({"file": name, "count": len(chunk)})
+            print(f"Packed {start + len(chunk)}/{len(samples)}", file=sys.stderr)
+
+    index = {
+        "image_size": image_size,
+        "classes": classes,
+        "class_counts": np.bincount(labels, minlength=len(classes)).tolist(),
+        "total": len(samples),
+        "shards": shards,
+        "sources": [path for path, _ in samples],
+    }
+    with open(os.path.join(out_dir, INDEX_FILE + '.tmp'), 'w') as f:
+        json.dump(index, f)
+    os.replace(os.path.join(out_dir, INDEX_FILE + '.tmp'), os.path.join(out_dir, INDEX_FILE))
+    return index
+
+
+def is_packed(out_dir):
+    return os.path.exists(os.path.join(out_dir, INDEX_FILE))
+
+
+class PackedTileDataset(Dataset):
+    """Tiles from pack_image_folder, read straight out of memory-mapped shards.
+
+    Items are (uint8 HWC tensor, label). With a DataLoader, batches go
+    through __getitems__, which gathers a whole batch from the page cache
+    into one array; use collate_packed to lay it out as uint8 NCHW and
+    preprocessing.normalize_on_device in the training loop.
+    The shards are mapped lazily in each worker process, and `labels` is a
+    plain array, so WeightedRandomSampler weights are one indexing away.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        self.classes = self.index['classes']
+        self.class_counts = self.index['class_counts']
+        self.image_size = self.index['image_size']
+        self.labels = np.load(os.path.join(path, LABELS_FILE))
+        counts = [shard['count'] for shard in self.index['shards']]
+        self._offsets = np.cumsum([0] + counts)
+        self._shards = None
+        self._pid = None
+
+    def __len__(self):
+        return int(self._offsets[-1])
+
+    def _open(self):
+        # Memory maps are opened per process, after the DataLoader has forked
+        if self._shards is None or self._pid != os.getpid():
+            self._shards = [np.load(os.path.join(self.path, shard['file']), mmap_mode='r')
+                            for shard in self.index['shards']]
+            self._pid = os.getpid()
+        return self._shards
+
+    def _locate(self, indices):
+        shard_ids = np.searchsorted(self._offsets, indices, side='right') - 1
+        return shard_ids, indices - self._offsets[shard_ids]
+
+    def __getitem__(self, index):
+        shards = self._open()
+        shard_id, row = self._locate(np.asarray(index))
+        pixels = np.array(shards[shard_id][row])
+        return torch.from_numpy(pixels), int(self.labels[index])
+
+    def __getitems__(self, indices):
+        shards = self._open()
+        indices = np.asarray(indices)
+        shard_ids, rows = self._locate(indices)
+        batch = np.empty((len(indices), self.image_size, self.image_size, 3), dtype=np.uint8)
+        for shard_id in np.unique(shard_ids):
+            selected = np.nonzero(shard_ids == shard_id)[0]
+            # Sorted reads keep access to each shard as sequential as the sampler allows
+            order = selected[np.argsort(rows[selected])]
+            batch[order] = shards[shard_id][rows[order]]
+        return torch.from_numpy(batch), torch.from_numpy(self.labels[indices])
+
+    def sample_weights(self):
+        """Inverse class frequency per sample, as the training notebook weights them."""
+        counts = np.asarray(self.class_counts, dtype=np.float64)
+        class_weights = len(self) / (len(self.classes) * np.maximum(counts, 1))
+        return class_weights[self.labels], class_weights
+
+
+def collate_packed(items):
+    """Batch collate: uint8 NHWC pixels -> uint8 NCHW, labels -> int64.
+
+    Batches stay uint8 through worker IPC and pinned memory (a quarter of
+    the float32 bytes); normalize them on the device with
+    preprocessing.normalize_on_device.
+    """
+    if isinstance(items, tuple):
+        pixels, labels = items
+    else:
+        pixels = torch.stack([pixels for pixels, _ in items])
+        labels = torch.tensor([label for _, label in items], dtype=torch.int64)
+    return pixels.permute(0, 3, 1, 2).contiguous(), labels
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pack an ImageFolder tree into memory-mapped uint8 shards.")
+    parser.add_argument('root', help="Dataset root with one sub-directory per class (e.g. TCGA)")
+    parser.add_argument('output', help="Directory for the shards and index.json")
+    parser.add_argument('--image-size', type=int, default=IMAGE_SIZE)
+    parser.add_argument('--shard-size', type=int, default=4096, help="Tiles per shard file")
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args(argv)
+
+    index = pack_image_folder(args.root, args.output, args.image_size, args.shard_size, args.workers)
+    size_gb = index['total'] * args.image_size * args.image_size * 3 / 1e9
+    print(f"Packed {index['total']} tiles of {len(index['classes'])} classes "
+          f"into {len(index['shards'])} shards ({size_gb:.1f} GB)")
+
+
+if __name__ == '__main__':
+    main()
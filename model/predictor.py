@@ -0,0 +1,162 @@
+import os
+import sys
+import threading
+
+import torch
+import torchvision
+import torchvision.transforms as transforms
+
+from calibration import augment_views, load_calibration, view_probabilities
+from preprocessing import IMAGE_SIZE, MEAN, STD, BatchPreprocessor
+from preprocessing import fold_normalization as _fold_normalization
+
+DEFAULT_CHECKPOINT = 'vit_cancer_model_state_dict_6.pth'
+
+class_names = [
+    'Adrenocortical_carcinoma', 'Bladder_Urothelial_Carcinoma', 'Brain_Lower_Grade_Glioma',
+    'Breast_invasive_carcinoma', 'Cervical_squamous_cell_carcinoma_and_endocervical_adenocarcinoma',
+    'Cholangiocarcinoma', 'Colon_adenocarcinoma', 'Esophageal_carcinoma', 'Glioblastoma_multiforme',
+    'Head_and_Neck_squamous_cell_carcinoma', 'Kidney_Chromophobe', 'Kidney_renal_clear_cell_carcinoma',
+    'Kidney_renal_papillary_cell_carcinoma', 'Liver_hepatocellular_carcinoma', 'Lung_adenocarcinoma',
+    'Lung_squamous_cell_carcinoma', 'Lymphoid_Neoplasm_Diffuse_Large_B-cell_Lymphoma', 'Mesothelioma',
+    'Ovarian_serous_cystadenocarcinoma', 'Pancreatic_adenocarcinoma', 'Pheochromocytoma_and_Paraganglioma',
+    'Prostate_adenocarcinoma', 'Rectum_adenocarcinoma', 'Sarcoma', 'Skin_Cutaneous_Melanoma',
+    'Stomach_adenocarcinoma', 'Testicular_Germ_Cell_Tumors', 'Thymoma', 'Thyroid_carcinoma',
+    'Uterine_Carcinosarcoma', 'Uterine_Corpus_Endometrial_Carcinoma', 'Uveal_Melanoma'
+]
+
+# Per-image reference pipeline (same as training); serving uses BatchPreprocessor
+transform = transforms.Compose([
+    transforms.Resize((IMAGE_SIZE, IMAGE_SIZE)),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=MEAN, std=STD)
+])
+
+# Define the ViT model class
+class ViTForCancerClassification(torch.nn.Module):
+    def __init__(self, num_classes, pretrained=True):
+        super(ViTForCancerClassification, self).__init__()
+        # The ImageNet backbone is only needed for training; a fine-tuned
+        # checkpoint overwrites every weight, so skip the download then.
+        weights = torchvision.models.ViT_B_16_Weights.DEFAULT if pretrained else None
+        self.vit = torchvision.models.vit_b_16(weights=weights)
+        in_features = self.vit.heads.head.in_features
+        self.vit.heads.head = torch.nn.Linear(in_features, num_classes)
+
+    def forward(self, x):
+        return self.vit(x)
+
+
+def load_model(checkpoint_path=DEFAULT_CHECKPOINT, device='cpu', num_classes=None):
+    """Build the ViT and load the fine-tuned checkpoint in eval mode."""
+    num_classes = num_classes or len(class_names)
+    model = ViTForCancerClassification(num_classes, pretrained=False)
+    model.load_state_dict(torch.load(checkpoint_path, map_location=device))
+    model.to(device)
+    model.eval()
+    return model
+
+
+class HistologyPredictor:
+    """Keeps the ViT resident in memory so it can be called many times.
+
+    `tta` > 1 averages the softmax over that many flipped/rotated views of
+    each tile (one forward pass of tta * N images). `calibration_path`
+    points at a file from calibration.py whose temperature rescales the
+    logits so confidences match held-out accuracy.
+    """
+
+    def __init__(self, checkpoint_path=DEFAULT_CHECKPOINT, device=None, top_k=5,
+                 backend='eager', artifact_path=None, fold_normalization=False,
+                 tta=1, calibration_path=None):
+        self.checkpoint_path = checkpoint_path
+        self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+        self.class_names = class_names
+        self.top_k = min(top_k, len(self.class_names))
+        self.backend = backend
+        self.tta = tta
+        self.temperature = 1.0
+        if calibration_path:
+            calibration = load_calibration(calibration_path)
+            self.temperature = calibration['temperature']
+            if calibration.get('tta', tta) != tta:
+                print(f"Warning: {calibration_path} was fitted with tta={calibration['tta']}, "
+                      f"running with tta={tta}", file=sys.stderr)
+        if backend == 'eager':
+            self.model = load_model(checkpoint_path, self.device)
+        else:
+            # int8 / torchscript / compile / onnx, see export.py
+            from export import load_backend
+            self.model = load_backend(checkpoint_path, backend, self.device, artifact_path)
+        if fold_normalization:
+            if backend != 'eager':
+                raise ValueError("fold_normalization is only supported with the eager backend")
+            # Model now takes raw 0..255 pixels; preprocessing is just a cast
+            _fold_normalization(self.model)
+        # Whether inputs still need ToTensor/Normalize (False once folded into conv_proj)
+        self.normalize = not fold_normalization
+        self._preprocessor = BatchPreprocessor(normalize=self.normalize)
+        # torch modules are not guaranteed re-entrant; serialize forward passes
+        self._lock = threading.Lock()
+
+    def preprocess(self, images):
+        """Turn PIL images or paths into a normalized NCHW batch."""
+        return self._preprocessor(images)
+
+    def forward(self, batch):
+        """Run the model on a preprocessed batch and return raw logits."""
+        with self._lock, torch.inference_mode():
+            return self.model(batch.to(self.device)).float().cpu()
+
+    def probabilities(self, batch):
+        """Calibrated (N, C) class probabilities of a preprocessed batch, averaged over TTA views."""
+        logits = self.forward(augment_views(batch, self.tta))
+        return view_probabilities(logits, self.tta, self.temperature)
+
+    def classify(self, batch):
+        """Run a preprocessed batch and return one result dict per image."""
+        return self.format_probabilities(self.probabilities(batch))
+
+    def format_logits(self, logits):
+        """Convert a batch of single-view logits into one result dict per image."""
+        return self.format_probabilities(torch.softmax(logits / self.temperature, dim=1))
+
+    def format_probabilities(self, probabilities):
+        """Convert (N, C) class probabilities into one result dict per image."""
+        top_probs, top_idx = torch.topk(probabilities, self.top_k, dim=1)
+        results = []
+        for probs, indices in zip(top_probs.tolist(), top_idx.tolist()):
+            results.append({
+                "predicted_class": self.class_names[indices[0]],
+                "confidence": probs[0],
+                "top_k": [
+                    {"class": self.class_names[i], "probability": p}
+                    for i, p in zip(indices, probs)
+                ]
+            })
+        return results
+
+    def predict(self, images):
+        """Classify a list of PIL images or file paths."""
+        if not images:
+            return []
+        return self.classify(self.preprocess(images))
+
+    def predict_one(self, image):
+        return self.predict([image])[0]
+
+
+def default_checkpoint_path():
+    return os.environ.get('HISTOLOGY_CHECKPOINT', DEFAULT_CHECKPOINT)
+
+
+def default_backend():
+    return os.environ.get('HISTOLOGY_BACKEND', 'eager')
+
+
+def default_tta():
+    return int(os.environ.get('HISTOLOGY_TTA', '1'))
+
+
+def default_calibration_path():
+    return os.environ.get('HISTOLOGY_CALIBRATION')
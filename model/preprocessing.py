@@ -0,0 +1,108 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+
+IMAGE_SIZE = 224
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.bmp')
+MEAN = [0.485, 0.456, 0.406]
+STD = [0.229, 0.224, 0.225]
+
+# ToTensor() + Normalize() collapsed into one scale-and-shift on 0..255 values:
+# (x / 255 - mean) / std == x * (1 / (255 * std)) - mean / std
+_SCALE = torch.tensor([1.0 / (255.0 * s) for s in STD]).view(1, 3, 1, 1)
+_SHIFT = torch.tensor([-m / s for m, s in zip(MEAN, STD)]).view(1, 3, 1, 1)
+
+
+def decode_into(image, out, draft=False):
+    """Decode a path/file/PIL image and write it resized into `out` (HxWx3 uint8)."""
+    if not isinstance(image, Image.Image):
+        image = Image.open(image)
+    size = (out.shape[1], out.shape[0])
+    if draft and image.format == 'JPEG':
+        # Let libjpeg decode at a reduced DCT scale instead of full resolution
+        image.draft('RGB', size)
+    image = image.convert('RGB')
+    if image.size != size:
+        image = image.resize(size, Image.BILINEAR)
+    out[...] = np.asarray(image)
+    return out
+
+
+def to_model_input(batch, normalize=True):
+    """NHWC uint8 tensor -> normalized NCHW float32 tensor in a single pass."""
+    x = batch.permute(0, 3, 1, 2).to(torch.float32, memory_format=torch.contiguous_format)
+    if normalize:
+        x.mul_(_SCALE).add_(_SHIFT)
+    return x
+
+
+def normalize_on_device(batch, device, non_blocking=True):
+    """uint8 NCHW tensor -> normalized float32 on `device`.
+
+    The batch crosses to the device as uint8, so the float copy (4x the
+    bytes) only ever exists there.
+    """
+    x = batch.to(device, non_blocking=non_blocking).to(torch.float32)
+    return x.mul_(_SCALE.to(device)).add_(_SHIFT.to(device))
+
+
+def fold_normalization(model):
+    """Fold the input normalization into the ViT patch-embedding convolution.
+
+    After folding the model takes raw 0..255 float pixels, so preprocessing
+    reduces to a dtype cast. conv_proj has no padding, so the mean shift
+    folds exactly into its bias.
+    """
+    conv = model.vit.conv_proj
+    with torch.no_grad():
+        bias_shift = (conv.weight * _SHIFT).sum(dim=(1, 2, 3))
+        conv.weight.mul_(_SCALE)
+        if conv.bias is None:
+            conv.bias = torch.nn.Parameter(bias_shift)
+        else:
+            conv.bias.add_(bias_shift)
+    return model
+
+
+class BatchPreprocessor:
+    """Decodes a batch of images into a reused uint8 buffer, then normalizes once.
+
+    Each thread gets its own buffer so concurrent callers (request threads,
+    the micro-batcher) never share memory. Decoding and resizing run in a
+    small thread pool; Pillow releases the GIL for both.
+    """
+
+    def __init__(self, max_batch_size=32, image_size=IMAGE_SIZE, threads=4,
+                 normalize=True, draft=False):
+        self.max_batch_size = max_batch_size
+        self.image_size = image_size
+        self.normalize = normalize
+        self.draft = draft
+        self._pool = ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+        self._local = threading.local()
+
+    def _buffer(self, n):
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None or buffer.shape[0] < n:
+            capacity = max(n, self.max_batch_size)
+            buffer = np.empty((capacity, self.image_size, self.image_size, 3), dtype=np.uint8)
+            self._local.buffer = buffer
+        return buffer[:n]
+
+    def decode(self, images):
+        """Decode into the thread's uint8 NHWC buffer (valid until the next call)."""
+        buffer = self._buffer(len(images))
+        if self._pool is not None and len(images) > 1:
+            list(self._pool.map(lambda args: decode_into(args[0], args[1], self.draft),
+                                zip(images, buffer)))
+        else:
+            for image, slot in zip(images, buffer):
+                decode_into(image, slot, self.draft)
+        return buffer
+
+    def __call__(self, images):
+        # to_model_input allocates the float output, so the buffer can be reused
+        return to_model_input(torch.from_numpy(self.decode(images)), self.normalize)
@@ -0,0 +1,340 @@
+import argparse
+import json
+import os
+import sys
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+
+from predictor import (HistologyPredictor, default_backend, default_calibration_path,
+                       default_checkpoint_path, default_tta)
+from preprocessing import IMAGE_SIZE, to_model_input
+
+# Whole-slide formats need openslide-python; uncompressed TIFFs are memory-mapped
+# with tifffile when it is installed. Both are optional.
+SLIDE_EXTENSIONS = ('.svs', '.ndpi', '.mrxs', '.scn', '.vms', '.vmu', '.bif')
+# Files open_slide() can read tile by tile instead of decoding them whole
+LAZY_EXTENSIONS = SLIDE_EXTENSIONS + ('.tif', '.tiff')
+
+# Largest image PillowReader decodes whole (RGB bytes are 3x this). Pillow's
+# own decompression-bomb warning (~89 MP) is silenced for these files, but its
+# hard error at twice that still applies; bigger slides go through
+# LAZY_EXTENSIONS readers.
+MAX_PIXELS = int(os.environ.get('SLIDE_MAX_PIXELS', str(20000 * 20000)))
+
+# The tissue mask is computed on a thumbnail no larger than this
+MASK_MAX_SIDE = 2048
+# Saturation threshold floor: Otsu on an almost-empty slide would split glass noise
+MIN_SATURATION = 20
+
+
+def open_image(source, max_pixels=MAX_PIXELS):
+    """Image.open with `max_pixels` as the decompression-bomb limit for this call.
+
+    Pillow's process-wide MAX_IMAGE_PIXELS is left alone, since other threads
+    decode under it; only its warning is silenced and the size is checked
+    here. Pillow still refuses anything over twice its own limit, which is
+    what LAZY_EXTENSIONS readers are for.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+        image = Image.open(source)
+    if image.width * image.height > max_pixels:
+        image.close()
+        raise Image.DecompressionBombError(
+            f"Image size ({image.width * image.height} pixels) exceeds the limit of {max_pixels} pixels")
+    return image
+
+
+class PillowReader:
+    """In-memory fallback for ordinary images (and PIL images already decoded)."""
+
+    def __init__(self, image, max_pixels=MAX_PIXELS):
+        if not isinstance(image, Image.Image):
+            image = open_image(image, max_pixels)
+        self._pixels = np.asarray(image.convert('RGB'))
+        self.size = (self._pixels.shape[1], self._pixels.shape[0])
+
+    def read_region(self, x, y, width, height):
+        region = self._pixels[y:y + height, x:x + width]
+        if region.shape[:2] != (height, width):
+            padded = np.full((height, width, 3), 255, dtype=np.uint8)
+            padded[:region.shape[0], :region.shape[1]] = region
+            region = padded
+        return region
+
+    def thumbnail(self, max_side):
+        image = Image.fromarray(self._pixels)
+        image.thumbnail((max_side, max_side), Image.BILINEAR)
+        return np.asarray(image)
+
+    def close(self):
+        self._pixels = None
+
+
+class TiffMemmapReader(PillowReader):
+    """Uncompressed RGB TIFFs, memory-mapped so only the touched tiles are paged in."""
+
+    def __init__(self, path):
+        import tifffile
+        self._pixels = tifffile.memmap(path, mode='r')
+        if self._pixels.ndim != 3 or self._pixels.shape[2] < 3:
+            raise ValueError(f"{path} is not an RGB image")
+        self._pixels = self._pixels[:, :, :3]
+        self.size = (self._pixels.shape[1], self._pixels.shape[0])
+
+    def thumbnail(self, max_side):
+        # Strided sampling reads a fraction of the pages instead of the whole file
+        step = max(1, int(np.ceil(max(self.size) / max_side)))
+        return np.ascontiguousarray(self._pixels[::step, ::step])
+
+
+class OpenSlideReader:
+    """Whole-slide formats through OpenSlide: regions are decoded on demand."""
+
+    def __init__(self, path):
+        import openslide
+        self._slide = openslide.OpenSlide(path)
+        self.size = self._slide.dimensions
+
+    def read_region(self, x, y, width, height):
+        region = self._slide.read_region((x, y), 0, (width, height))
+        # Transparent (unscanned) areas become white background
+        background = Image.new('RGB', region.size, (255, 255, 255))
+        background.paste(region, mask=region.split()[3])
+        return np.asarray(background)
+
+    def thumbnail(self, max_side):
+        return np.asarray(self._slide.get_thumbnail((max_side, max_side)).convert('RGB'))
+
+    def close(self):
+        self._slide.close()
+
+
+def open_slide(source):
+    """Pick the cheapest reader that does not load the whole image into RAM."""
+    if isinstance(source, (str, os.PathLike)):
+        path = str(source)
+        if path.lower().endswith(SLIDE_EXTENSIONS):
+            return OpenSlideReader(path)
+        if path.lower().endswith(('.tif', '.tiff')):
+            try:
+                return OpenSlideReader(path)
+            except Exception:
+                pass
+            try:
+                return TiffMemmapReader(path)
+            except Exception:
+                pass
+    return PillowReader(source)
+
+
+def otsu_threshold(values):
+    """Otsu's threshold of a uint8 array."""
+    hist = np.bincount(values.ravel(), minlength=256).astype(np.float64)
+    total = hist.sum()
+    if total == 0:
+        return 0
+    levels = np.arange(256)
+    weight_bg = np.cumsum(hist)
+    weight_fg = total - weight_bg
+    mean_bg = np.cumsum(hist * levels)
+    mean_total = mean_bg[-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = (mean_total * weight_bg - mean_bg * total) ** 2 / (weight_bg * weight_fg)
+    return int(np.nanargmax(between))
+
+
+def tissue_mask(thumbnail):
+    """Boolean mask of stained tissue: HSV saturation above an Otsu threshold."""
+    rgb = thumbnail.astype(np.int16)
+    high = rgb.max(axis=2)
+    low = rgb.min(axis=2)
+    saturation = np.where(high > 0, (high - low) * 255 // np.maximum(high, 1), 0).astype(np.uint8)
+    threshold = max(otsu_threshold(saturation), MIN_SATURATION)
+    # Near-black pixels (pen marks, scanner edges) are saturated but not tissue
+    return (saturation > threshold) & (high > 40)
+
+
+def tile_grid(size, tile_size, stride):
+    """Top-left corners of every tile; the last row/column is clamped to the edge."""
+    width, height = size
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size + 1, stride))
+        if positions[-1] + tile_size < length:
+            positions.append(length - tile_size)
+        return positions
+
+    return starts(width), starts(height)
+
+
+class SlideClassifier:
+    """Classifies large images tile by tile and aggregates a slide-level label.
+
+    Tiles of `tile_size` level-0 pixels are taken every `stride` pixels,
+    resized to the model input and skipped when less than `min_tissue` of
+    their area is tissue. At most two batches of tiles are in memory: one
+    being read in a thread pool while the previous one runs through the
+    model.
+    """
+
+    def __init__(self, predictor, tile_size=IMAGE_SIZE, stride=None, batch_size=32,
+                 min_tissue=0.25, threads=4):
+        self.predictor = predictor
+        self.tile_size = tile_size
+        self.stride = stride or tile_size
+        self.batch_size = batch_size
+        self.min_tissue = min_tissue
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='slide-tile')
+        # Separate single thread for batch prefetch, so it never waits on itself for a tile worker
+        self._prefetch = ThreadPoolExecutor(max_workers=1, thread_name_prefix='slide-prefetch')
+
+    def _select_tiles(self, reader):
+        xs, ys = tile_grid(reader.size, self.tile_size, self.stride)
+        thumbnail = reader.thumbnail(MASK_MAX_SIDE)
+        mask = tissue_mask(thumbnail)
+        scale_x = mask.shape[1] / reader.size[0]
+        scale_y = mask.shape[0] / reader.size[1]
+        tiles = []
+        for row, y in enumerate(ys):
+            y0, y1 = int(y * scale_y), max(int(y * scale_y) + 1, int((y + self.tile_size) * scale_y))
+            for col, x in enumerate(xs):
+                x0, x1 = int(x * scale_x), max(int(x * scale_x) + 1, int((x + self.tile_size) * scale_x))
+                if mask[y0:y1, x0:x1].mean() >= self.min_tissue:
+                    tiles.append((row, col, x, y))
+        return tiles, (len(ys), len(xs)), mask
+
+    def _read_tile(self, reader, x, y, out):
+        region = reader.read_region(x, y, self.tile_size, self.tile_size)
+        if self.tile_size != IMAGE_SIZE:
+            region = np.asarray(Image.fromarray(region).resize((IMAGE_SIZE, IMAGE_SIZE), Image.BILINEAR))
+        out[...] = region
+
+    def _read_batch(self, reader, tiles):
+        pixels = np.empty((len(tiles), IMAGE_SIZE, IMAGE_SIZE, 3), dtype=np.uint8)
+        list(self._pool.map(lambda args: self._read_tile(reader, args[0][2], args[0][3], args[1]),
+                            zip(tiles, pixels)))
+        return pixels
+
+    def classify(self, source):
+        """Return the slide-level result dict and a (rows, cols, classes) probability grid.
+
+        Background cells of the grid are NaN.
+        """
+        start = time.perf_counter()
+        reader = open_slide(source)
+        pending = None
+        try:
+            tiles, (rows, cols), mask = self._select_tiles(reader)
+            num_classes = len(self.predictor.class_names)
+            heatmap = np.full((rows, cols, num_classes), np.nan, dtype=np.float32)
+            total = np.zeros(num_classes, dtype=np.float64)
+            votes = np.zeros(num_classes, dtype=np.int64)
+
+            batches = [tiles[i:i + self.batch_size] for i in range(0, len(tiles), self.batch_size)]
+            pending = self._prefetch.submit(self._read_batch, reader, batches[0]) if batches else None
+            for i, batch_tiles in enumerate(batches):
+                pixels = pending.result()
+                # Read the next batch while this one runs through the model
+                pending = (self._prefetch.submit(self._read_batch, reader, batches[i + 1])
+                           if i + 1 < len(batches) else None)
+                probabilities = self.predictor.probabilities(
+                    to_model_input(torch.from_numpy(pixels), self.predictor.normalize)).numpy()
+                for (row, col, _, _), probs in zip(batch_tiles, probabilities):
+                    heatmap[row, col] = probs
+                total += probabilities.sum(axis=0)
+                votes += np.bincount(probabilities.argmax(axis=1), minlength=num_classes)
+        finally:
+            if pending is not None:
+                # Do not close the reader under a prefetch that is still running
+                pending.exception()
+            reader.close()
+
+        result = {
+            "width": reader.size[0],
+            "height": reader.size[1],
+            "tile_size": self.tile_size,
+            "stride": self.stride,
+            "grid": [rows, cols],
+            "tiles_total": rows * cols,
+            "tiles_classified": len(tiles),
+            "tissue_fraction": float(mask.mean()),
+            "timing_ms": round((time.perf_counter() - start) * 1000, 1),
+        }
+        if not tiles:
+            result.update({"predicted_class": None, "confidence": 0.0, "top_k": []})
+            return result, heatmap
+
+        # Slide label: mean tile probability; vote shares are reported alongside
+        mean = total / len(tiles)
+        order = np.argsort(mean)[::-1][:self.predictor.top_k]
+        class_names = self.predictor.class_names
+        result.update({
+            "predicted_class": class_names[order[0]],
+            "confidence": float(mean[order[0]]),
+            "top_k": [
+                {"class": class_names[i], "probability": float(mean[i]),
+                 "tile_votes": int(votes[i])}
+                for i in order
+            ],
+        })
+        return result, heatmap
+
+
+def save_heatmap(path, heatmap, class_names):
+    """Write the probability grid (.npz) plus a PNG of the winning class confidence."""
+    np.savez_compressed(path, probabilities=heatmap, class_names=np.array(class_names))
+    confidence = np.where(np.isnan(heatmap), 0.0, heatmap).max(axis=2, initial=0.0)
+    image = Image.fromarray((confidence * 255).astype(np.uint8))
+    image.save(os.path.splitext(path)[0] + '.png')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tile a large histology image and classify the slide.")
+    parser.add_argument('slide', help="Whole-slide (.svs, .ndpi, ...) or large TIFF/JPEG/PNG image")
+    parser.add_argument('--checkpoint', default=default_checkpoint_path())
+    parser.add_argument('--backend', default=default_backend(),
+                        choices=['eager', 'int8', 'torchscript', 'compile', 'onnx'])
+    parser.add_argument('--artifact', help="Pre-exported TorchScript/ONNX file for --backend")
+    parser.add_argument('--tta', type=int, default=default_tta(), choices=[1, 2, 4, 8])
+    parser.add_argument('--calibration', default=default_calibration_path())
+    parser.add_argument('--tile-size', type=int, default=IMAGE_SIZE,
+                        help="Tile edge in level-0 pixels (resized to the model input)")
+    parser.add_argument('--stride', type=int, help="Tile step in pixels (default: --tile-size)")
+    parser.add_argument('--min-tissue', type=float, default=0.25,
+                        help="Minimum tissue fraction for a tile to be classified")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--output', help="JSON result path (default: stdout)")
+    parser.add_argument('--heatmap', help="Write the class probability grid to this .npz (and a .png)")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.slide):
+        print(f"Error: {args.slide} does not exist.")
+        sys.exit(1)
+
+    predictor = HistologyPredictor(args.checkpoint, top_k=args.top_k, backend=args.backend,
+                                   artifact_path=args.artifact, tta=args.tta,
+                                   calibration_path=args.calibration)
+    classifier = SlideClassifier(predictor, args.tile_size, args.stride, args.batch_size, args.min_tissue)
+    result, heatmap = classifier.classify(args.slide)
+    result["path"] = args.slide
+
+    if args.heatmap:
+        save_heatmap(args.heatmap, heatmap, predictor.class_names)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    else:
+        print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()